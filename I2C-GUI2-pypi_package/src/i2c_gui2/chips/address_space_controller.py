@@ -24,12 +24,15 @@
 from __future__ import annotations
 
 import logging
+import random
+from contextlib import contextmanager
 from math import ceil
 
 from ..i2c_connection_helper import I2C_Connection_Helper
 from ..i2c_connection_helper import valid_endianness
 from ..i2c_connection_helper import valid_read_type
 from ..i2c_connection_helper import valid_write_type
+from .address_space_memory import Address_Space_Memory
 
 
 class Address_Space_Controller:
@@ -72,9 +75,15 @@ class Address_Space_Controller:
         self._write_type = write_type
 
         self._not_read = True
-        self._memory = [None for _ in range(self._address_space_size)]
-        self._defaults = [None for _ in range(self._address_space_size)]
-        self._read_only_map = [True for _ in range(self._address_space_size)]
+        self._bytes_per_word = ceil(self._word_bitlength / 8)
+        self._memory = Address_Space_Memory(self._address_space_size, self._bytes_per_word)
+        self._defaults = Address_Space_Memory(self._address_space_size, self._bytes_per_word)
+        # Last known state of the device, from the last read or write of each word
+        self._device_memory = Address_Space_Memory(self._address_space_size, self._bytes_per_word)
+        self._write_counters = {"bytes_written": 0, "bytes_skipped": 0, "write_transactions": 0}
+        # Blocks waiting for their readback check, while a deferred readback is active
+        self._deferred_readback = None
+        self._read_only_map = bytearray(b'\x01') * self._address_space_size
         self._blocks = {}
         self._register_map = {}
         self._register_blocks = {}
@@ -143,12 +152,7 @@ class Address_Space_Controller:
                     "An impossible condition occured, there was a memory block defined which does not have a base address and does not have an indexer"
                 )
 
-        self._bytes_per_word = ceil(self._word_bitlength / 8)
-        self._has_readonly = False
-        for val in self._read_only_map:
-            if val:
-                self._has_readonly = True
-                break
+        self._has_readonly = self._read_only_map.find(1) != -1
 
     def __len__(self):
         return self._address_space_size
@@ -233,16 +237,37 @@ class Address_Space_Controller:
 
         return min_address, max_address + max_offset, block_info
 
+    def as_numpy(self):
+        return self._memory.as_numpy()
+
     def update_i2c_address(self, address: int):
         if address != self._i2c_address:
             self._i2c_address = address
             self._not_read = True
+            self.reset_device_state()
 
             if address is not None:
                 self._logger.info(f"Updated address space '{self._name}' to the I2C address {address:#04x}")
             else:
                 self._logger.info(f"Reset the I2C address for the address space '{self._name}'")
 
+    def reset_device_state(self):
+        """Forget the last known state of the device, so that the next write_dirty writes every word."""
+        self._device_memory.invalidate()
+
+    def get_write_counters(self):
+        return dict(self._write_counters)
+
+    def reset_write_counters(self):
+        for key in self._write_counters:
+            self._write_counters[key] = 0
+
+    def _count_transactions(self, word_count):
+        max_seq_byte = self._i2c_connection._max_seq_byte
+        if max_seq_byte is None:
+            return 1
+        return ceil(word_count / max(1, max_seq_byte // self._bytes_per_word))
+
     # def update_register_map(self, register_map: dict[str, int]):
     #    self._register_map = register_map
 
@@ -274,8 +299,8 @@ class Address_Space_Controller:
             word_endianness=self._word_endianness,
             read_type=self._read_type,
         )
-        for idx in range(word_count):
-            self._memory[base_address + idx] = tmp[idx]
+        self._memory[base_address : base_address + word_count] = tmp[:word_count]
+        self._device_memory[base_address : base_address + word_count] = tmp[:word_count]
 
         return True
 
@@ -289,11 +314,7 @@ class Address_Space_Controller:
             self._logger.error(f"Unable to write address space '{self._name}' because the i2c address is not set")
             return False
 
-        has_read_only = False
-        for idx in range(word_count):
-            if self._read_only_map[base_address + idx]:
-                has_read_only = True
-                break
+        has_read_only = self._read_only_map.find(1, base_address, base_address + word_count) != -1
         if has_read_only:
             self._logger.info(
                 f"The block of {word_count} words starting at address {base_address} in the address space '{self._name}' covers one or more words which are read only, it will be broken down into smaller blocks which do not cover the read only words"
@@ -312,6 +333,22 @@ class Address_Space_Controller:
             word_endianness=self._word_endianness,
             write_type=self._write_type,
         )
+        self._write_counters["bytes_written"] += word_count * self._bytes_per_word
+        self._write_counters["write_transactions"] += self._count_transactions(word_count)
+
+        if readback_check and self._deferred_readback is not None:
+            if readback_base_address is None:
+                readback_base_address = base_address
+            written = self._memory[base_address : base_address + word_count]
+            self._device_memory[base_address : base_address + word_count] = written
+            self._deferred_readback["blocks_written"] += 1
+            block_id = self._deferred_readback["blocks_written"]
+            # A word written again later is only checked against the last value written to it
+            self._deferred_readback["last_write"].update(dict.fromkeys(range(base_address, base_address + word_count), block_id))
+            sample_fraction = self._deferred_readback["sample_fraction"]
+            if sample_fraction >= 1 or self._deferred_readback["random"].random() < sample_fraction:
+                self._deferred_readback["blocks"] += [(base_address, word_count, readback_base_address, written, block_id)]
+            return True
 
         if readback_check:
             if readback_base_address is None:
@@ -328,20 +365,142 @@ class Address_Space_Controller:
                 read_type=self._read_type,
             )
 
-            failed = []
-            for idx in range(word_count):
-                if self._memory[base_address + idx] != tmp[idx]:
-                    failed += [base_address + idx]
-                    self._memory[base_address + idx] = tmp[idx]
+            expected = self._memory[base_address : base_address + word_count]
+            failed = [base_address + idx for idx in range(word_count) if expected[idx] != tmp[idx]]
+            self._device_memory[base_address : base_address + word_count] = tmp[:word_count]
             if len(failed) != 0:
+                self._memory[base_address : base_address + word_count] = tmp[:word_count]
                 failed = ["0x{:0x}".format(i) for i in failed]
                 self._logger.error(
                     f"Failure to write memory block at address {base_address:#0x} with {word_count} words in the '{self._name}' address space (I2C address {self._i2c_address:#02x}). The following addresses failed to write: {', '.join(failed)}"
                 )
                 return False
+        else:
+            self._device_memory[base_address : base_address + word_count] = self._memory[base_address : base_address + word_count]
 
         return True
 
+    def start_deferred_readback(self, sample_fraction: float = 1.0, seed=None):
+        """Defer the readback check of the following block writes to a single pass in finish_deferred_readback.
+
+        Only a random sample_fraction of the written blocks is checked.
+        """
+        if self._deferred_readback is not None:
+            raise RuntimeError(f"A deferred readback is already active for the address space '{self._name}'")
+        self._deferred_readback = {
+            "sample_fraction": sample_fraction,
+            "random": random.Random(seed),
+            "blocks_written": 0,
+            "blocks": [],
+            "last_write": {},
+        }
+
+    def finish_deferred_readback(self, merge_gap_bytes: int = None):
+        """Read back all the blocks queued since start_deferred_readback and compare them with the values written.
+
+        The readback ranges are merged when they overlap or are separated by at most merge_gap_bytes
+        (by default the address overhead of a transaction), so that every range is read only once.
+        Words which were written again later are only checked with the last write. Words which do not match
+        are updated in the memory, as with the immediate readback check, unless they were changed in the memory
+        after the write or are read only by now (e.g. the broadcast addresses, which are only writable during the write).
+
+        Returns
+        -------
+        dict
+            The number of blocks written and checked, the number of words and reads used for the check,
+            the mismatches (a list of dicts with the address, the expected and the read value) and
+            whether the check succeeded
+        """
+        if self._deferred_readback is None:
+            raise RuntimeError(f"No deferred readback was started for the address space '{self._name}'")
+        pending = self._deferred_readback
+        self._deferred_readback = None
+
+        if merge_gap_bytes is None:
+            merge_gap_bytes = 1 + ceil(self._address_bitlength / 8)
+        merge_gap = merge_gap_bytes // self._bytes_per_word
+
+        blocks = sorted(pending["blocks"], key=lambda block: block[2])
+        read_ranges = []
+        for _, word_count, readback_base_address, _, _ in blocks:
+            if len(read_ranges) > 0 and readback_base_address <= read_ranges[-1][1] + merge_gap:
+                read_ranges[-1][1] = max(read_ranges[-1][1], readback_base_address + word_count)
+            else:
+                read_ranges += [[readback_base_address, readback_base_address + word_count]]
+
+        result = {
+            "blocks_written": pending["blocks_written"],
+            "blocks_checked": len(blocks),
+            "words_checked": sum(block[1] for block in blocks),
+            "reads": len(read_ranges),
+            "mismatches": [],
+            "success": True,
+        }
+        if len(blocks) == 0:
+            return result
+
+        if self._i2c_address is None:
+            self._logger.error(f"Unable to read address space '{self._name}' because the i2c address is not set")
+            result["success"] = False
+            return result
+
+        self._logger.info(
+            f"Checking {result['words_checked']} words of {result['blocks_checked']} blocks with {result['reads']} reads "
+            f"in the address space '{self._name}'"
+        )
+
+        range_idx = 0
+        read_data = None
+        last_write = pending["last_write"]
+        for base_address, word_count, readback_base_address, written, block_id in blocks:
+            while read_data is None or readback_base_address >= read_ranges[range_idx][1]:
+                if read_data is not None:
+                    range_idx += 1
+                read_data = self._i2c_connection.read_device_memory(
+                    self._i2c_address,
+                    read_ranges[range_idx][0],
+                    word_count=read_ranges[range_idx][1] - read_ranges[range_idx][0],
+                    address_bitlength=self._address_bitlength,
+                    address_endianness=self._address_endianness,
+                    word_bitlength=self._word_bitlength,
+                    word_endianness=self._word_endianness,
+                    read_type=self._read_type,
+                )
+
+            offset = readback_base_address - read_ranges[range_idx][0]
+            tmp = read_data[offset : offset + word_count]
+            for idx in range(word_count):
+                address = base_address + idx
+                if last_write[address] != block_id:
+                    continue
+                if written[idx] != tmp[idx]:
+                    result["mismatches"] += [{"address": address, "expected": written[idx], "read": tmp[idx]}]
+                if self._read_only_map[address]:
+                    continue
+                if self._memory[address] == written[idx]:
+                    self._memory[address] = tmp[idx]
+                self._device_memory[address] = tmp[idx]
+
+        if len(result["mismatches"]) != 0:
+            result["success"] = False
+            failed = ["0x{:0x}".format(mismatch["address"]) for mismatch in result["mismatches"]]
+            self._logger.error(
+                f"Failure to write {len(failed)} words in the '{self._name}' address space (I2C address {self._i2c_address:#02x}). "
+                f"The following addresses failed to write: {', '.join(failed)}"
+            )
+
+        return result
+
+    @contextmanager
+    def deferred_readback(self, sample_fraction: float = 1.0, seed=None):
+        """Context manager around start_deferred_readback and finish_deferred_readback, the result is filled in at the end."""
+        result = {}
+        self.start_deferred_readback(sample_fraction, seed)
+        try:
+            yield result
+        finally:
+            result.update(self.finish_deferred_readback())
+
     def write_memory_word(self, address, readback_check: bool = True, readback_address=None):
         if self._read_only_map[address]:
             self._logger.info(
@@ -354,20 +513,19 @@ class Address_Space_Controller:
     def write_memory_block_with_split_for_read_only(
         self, base_address, word_count, readback_check: bool = True, readback_base_address=None
     ):
-        start_address = None
         ranges = []
 
         if readback_base_address is None:
             readback_base_address = base_address
 
-        for idx in range(word_count):
-            if not self._read_only_map[base_address + idx] and start_address is None:
-                start_address = base_address + idx
-            if self._read_only_map[base_address + idx] and start_address is not None:
-                ranges += [(start_address, base_address + idx - start_address, start_address - base_address + readback_base_address)]
-                start_address = None
-        if start_address is not None:
-            ranges += [(start_address, base_address + idx - start_address + 1, start_address - base_address + readback_base_address)]
+        end_address = base_address + word_count
+        start_address = self._read_only_map.find(0, base_address, end_address)
+        while start_address != -1:
+            stop_address = self._read_only_map.find(1, start_address, end_address)
+            if stop_address == -1:
+                stop_address = end_address
+            ranges += [(start_address, stop_address - start_address, start_address - base_address + readback_base_address)]
+            start_address = self._read_only_map.find(0, stop_address, end_address)
 
         success = True
         self._logger.info(f"Found {len(ranges)} ranges without read only registers")
@@ -413,13 +571,87 @@ class Address_Space_Controller:
 
         self.read_memory_block(self._register_map[block_name + "/" + register_name], 1)
 
-    def write_all(self, readback_check: bool = True):
+    def get_dirty_addresses(self, base_address: int = 0, word_count: int = None):
+        """Addresses of the writable words whose value differs from the last known device state (or where it is unknown)."""
+        if word_count is None:
+            word_count = self._address_space_size - base_address
+        return [
+            address
+            for address in self._memory.diff(self._device_memory, base_address, base_address + word_count)
+            if not self._read_only_map[address]
+        ]
+
+    def plan_dirty_writes(self, base_address: int = 0, word_count: int = None, merge_gap_bytes: int = None):
+        """Merge the dirty words into the blocks to write, as (base address, word count) tuples.
+
+        Neighbouring dirty ranges are merged, rewriting the clean words in between, when that saves at
+        least one I2C transaction (taking max_seq_byte into account) and costs at most merge_gap_bytes
+        extra bytes. By default this is the overhead of a transaction: the device and register address bytes.
+        Gaps with read only or unknown words are never merged.
+        """
+        if merge_gap_bytes is None:
+            merge_gap_bytes = 1 + ceil(self._address_bitlength / 8)
+
+        ranges = []
+        for address in self.get_dirty_addresses(base_address, word_count):
+            if len(ranges) > 0 and ranges[-1][1] == address:
+                ranges[-1][1] = address + 1
+            else:
+                ranges += [[address, address + 1]]
+
+        plan = []
+        for start, stop in ranges:
+            if len(plan) > 0:
+                last_start, last_stop = plan[-1]
+                gap = start - last_stop
+                if (
+                    gap * self._bytes_per_word <= merge_gap_bytes
+                    and self._read_only_map.find(1, last_stop, start) == -1
+                    and None not in self._memory[last_stop:start]
+                    and self._count_transactions(stop - last_start)
+                    < self._count_transactions(last_stop - last_start) + self._count_transactions(stop - start)
+                ):
+                    plan[-1] = (last_start, stop)
+                    continue
+            plan += [(start, stop)]
+
+        return [(start, stop - start) for start, stop in plan]
+
+    def write_dirty(self, readback_check: bool = True, base_address: int = 0, word_count: int = None):
+        """Write only the words which changed since the last known device state, in as few I2C transactions as possible."""
+        if self._i2c_address is None:
+            self._logger.error(f"Unable to write address space '{self._name}' because the i2c address is not set")
+            return False
+
+        if word_count is None:
+            word_count = self._address_space_size - base_address
+
+        plan = self.plan_dirty_writes(base_address, word_count)
+        writable_words = word_count - self._read_only_map.count(1, base_address, base_address + word_count)
+        written_words = sum(count for _, count in plan)
+        self._write_counters["bytes_skipped"] += max(0, writable_words - written_words) * self._bytes_per_word
+
+        self._logger.info(
+            f"Writing {written_words} of {writable_words} writable words in {len(plan)} blocks in the address space '{self._name}'"
+        )
+
+        success = True
+        for block_address, block_count in plan:
+            if not self.write_memory_block(block_address, block_count, readback_check):
+                success = False
+
+        return success
+
+    def write_all(self, readback_check: bool = True, only_dirty: bool = False):
         # TODO: not seen?
         print("PYTHON PACKAGE: write_all method in Address_Space_Controller object")
         if self._i2c_address is None:
             self._logger.error(f"Unable to write address space '{self._name}' because the i2c address is not set")
             return False
 
+        if only_dirty:
+            return self.write_dirty(readback_check=readback_check)
+
         if self._has_readonly:
             self._logger.info(
                 f"Unable to write the full '{self._name}' address space because there are some read only registers, breaking it into smaller blocks"
@@ -466,8 +698,4 @@ class Address_Space_Controller:
         return self.write_memory_block(address, 1, readback_check, original_address)
 
     def reset_to_defaults(self):
-        # register_count = len(self._register_map)
-        # count = 0
-        for address in self._memory:
-            self._memory[address] = self._defaults[address]
-            # count += 1
+        self._memory.copy_from(self._defaults)
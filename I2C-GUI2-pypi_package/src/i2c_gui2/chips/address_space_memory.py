@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+# zlib License
+#
+# (C) 2024 Cristóvão Beirão da Cruz e Silva <cbeiraod@cern.ch>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty.  In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+# 1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+# 2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+# 3. This notice may not be removed or altered from any source distribution.
+#############################################################################
+"""The address_space_memory module
+
+Contains the Address_Space_Memory class, the compact storage behind the
+memory of an address space controller.
+
+"""
+
+from __future__ import annotations
+
+from array import array
+
+valid_typecodes = ['B', 'H', 'I', 'L', 'Q']
+
+
+class Address_Space_Memory:
+    """Fixed size word memory, which behaves like a list where unknown words are `None`.
+
+    The words are kept in a typed array, with the smallest type that fits a word, and a separate
+    validity map (one byte per word) tells whether a word holds a known value. Both support the
+    buffer protocol, so callers can get NumPy views of them with `as_numpy`.
+
+    Parameters
+    ----------
+    size
+        The number of words in the memory.
+
+    bytes_per_word
+        The number of bytes of each word.
+
+    Raises
+    ------
+    RuntimeError
+        If there is no array type large enough for the words
+    """
+
+    def __init__(self, size: int, bytes_per_word: int = 1):
+        typecode = None
+        for code in valid_typecodes:
+            if array(code).itemsize >= bytes_per_word:
+                typecode = code
+                break
+        if typecode is None:
+            raise RuntimeError(f"Words of {bytes_per_word} bytes are too large to be stored in the address space memory")
+
+        self._typecode = typecode
+        self._size = size
+        self._values = array(typecode, [0]) * size
+        self._valid = bytearray(size)
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return f"Address_Space_Memory({list(self)!r})"
+
+    def __eq__(self, other):
+        if isinstance(other, Address_Space_Memory):
+            return self._valid == other._valid and self._values == other._values
+        return list(self) == other
+
+    def _slice_length(self, index: slice):
+        return len(range(*index.indices(self._size)))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [value if valid else None for value, valid in zip(self._values[index], self._valid[index])]
+        if self._valid[index]:
+            return self._values[index]
+        return None
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = list(value)
+            length = self._slice_length(index)
+            if len(value) != length:
+                raise ValueError(f"Can not assign {len(value)} words to a memory slice of {length} words")
+            if None in value:
+                self._valid[index] = bytes(0 if word is None else 1 for word in value)
+                self._values[index] = array(self._typecode, [0 if word is None else word for word in value])
+            else:
+                self._valid[index] = b'\x01' * length
+                self._values[index] = array(self._typecode, value)
+        elif value is None:
+            self._valid[index] = 0
+            self._values[index] = 0
+        else:
+            self._values[index] = value
+            self._valid[index] = 1
+
+    def __iter__(self):
+        for value, valid in zip(self._values, self._valid):
+            yield value if valid else None
+
+    def copy_from(self, other: Address_Space_Memory):
+        """Copy the full contents of another memory of the same size and word type into this one."""
+        if other._size != self._size or other._typecode != self._typecode:
+            raise RuntimeError("Only memories with the same size and word type can be copied")
+        self._values[:] = other._values
+        self._valid[:] = other._valid
+
+    def diff(self, other: Address_Space_Memory, start: int = 0, stop: int = None, chunk: int = 64):
+        """Return the addresses in [start, stop) of the valid words which are unknown or different in another memory.
+
+        The memories are compared chunk by chunk with array comparisons, only the chunks which differ
+        are checked word by word.
+        """
+        if stop is None:
+            stop = self._size
+
+        addresses = []
+        for chunk_start in range(start, stop, chunk):
+            chunk_stop = min(chunk_start + chunk, stop)
+            if (
+                self._values[chunk_start:chunk_stop] == other._values[chunk_start:chunk_stop]
+                and self._valid[chunk_start:chunk_stop] == other._valid[chunk_start:chunk_stop]
+            ):
+                continue
+            for address in range(chunk_start, chunk_stop):
+                if self._valid[address] and (not other._valid[address] or self._values[address] != other._values[address]):
+                    addresses += [address]
+
+        return addresses
+
+    def invalidate(self, start: int = 0, stop: int = None):
+        """Mark the words in [start, stop) as unknown."""
+        if stop is None:
+            stop = self._size
+        self._valid[start:stop] = bytes(stop - start)
+        self._values[start:stop] = array(self._typecode, [0]) * (stop - start)
+
+    def as_numpy(self):
+        """Return NumPy views of the word values and of the validity map.
+
+        The views share the memory, so changes made through them are seen by the address space.
+        The values of the words which are not valid are 0.
+
+        Returns
+        -------
+        tuple[numpy.ndarray, numpy.ndarray]
+            The word values and the validity map (as booleans)
+        """
+        import numpy
+
+        return numpy.frombuffer(self._values, dtype=self._typecode), numpy.frombuffer(self._valid, dtype=bool)
@@ -26,6 +26,7 @@ from __future__ import annotations
 import itertools
 import logging
 import pickle
+from contextlib import contextmanager
 
 from ..i2c_connection_helper import I2C_Connection_Helper
 from .address_space_controller import Address_Space_Controller
@@ -309,6 +310,55 @@ class Base_Chip:
         address_space: Address_Space_Controller = self._address_space[address_space_name]
         return address_space.write_all(readback_check=readback_check)
 
+    def write_dirty_address_space(self, address_space_name: str, readback_check: bool = True, no_message: bool = True):
+        if not no_message:
+            self._logger.info("Writing the changed registers of address space: {}".format(address_space_name))
+        address_space: Address_Space_Controller = self._address_space[address_space_name]
+        return address_space.write_dirty(readback_check=readback_check)
+
+    def write_dirty(self, readback_check: bool = True):
+        success = True
+        for address_space in self._address_space:
+            if not self.write_dirty_address_space(address_space, readback_check=readback_check):
+                success = False
+
+        return success
+
+    def write_dirty_block(
+        self, address_space_name: str, block_name: str, full_array: bool = True, readback_check: bool = True, no_message: bool = True
+    ):
+        block_ref, _ = self._gen_block_ref_from_indexers(
+            address_space_name=address_space_name,
+            block_name=block_name,
+            full_array=full_array,
+        )
+        if not no_message:
+            self._logger.info("Writing the changed registers of block {} from address space {}".format(block_ref, address_space_name))
+        address_space: Address_Space_Controller = self._address_space[address_space_name]
+        block_info = address_space._blocks[block_ref]
+        return address_space.write_dirty(
+            readback_check=readback_check, base_address=block_info["Base Address"], word_count=block_info["Length"]
+        )
+
+    @contextmanager
+    def deferred_readback(self, sample_fraction: float = 1.0, seed=None):
+        """Defer the readback checks of all the address spaces to a single pass when the context exits.
+
+        The yielded dict is filled, per address space, with the result of finish_deferred_readback.
+        """
+        results = {}
+        started = []
+        try:
+            for address_space_name in self._address_space:
+                self._address_space[address_space_name].start_deferred_readback(sample_fraction, seed)
+                started += [address_space_name]
+            yield results
+        finally:
+            for address_space_name in started:
+                results[address_space_name] = self._address_space[address_space_name].finish_deferred_readback()
+                if not results[address_space_name]["success"]:
+                    self._logger.error(f"Readback check failed for the address space: {address_space_name}")
+
     def read_all_block(self, address_space_name: str, block_name: str, full_array: bool = False, no_message: bool = True):
         # TODO: DEF SEEN
         #print("PYTHON PACKAGE: read_all_block method in Base_Chip object")
@@ -519,12 +569,7 @@ class Base_Chip:
             address_space: Address_Space_Controller = self._address_space[address_space_name]
             size = address_space._address_space_size
 
-            conf = [None for _ in range(size)]
-
-            for idx in range(size):
-                conf[idx] = address_space._memory[idx]
-
-            info[address_space_name] = conf
+            info[address_space_name] = address_space._memory[0:size]
 
         self.save_pickle_file(config_file, info)
 
@@ -535,8 +580,7 @@ class Base_Chip:
             address_space: Address_Space_Controller = self._address_space[address_space_name]
             size = address_space._address_space_size
 
-            for idx in range(size):
-                address_space._memory[idx] = info[address_space_name][idx]
+            address_space._memory[0:size] = info[address_space_name][0:size]
 
     def reset_config_to_default(self):
         for name in self._address_space:
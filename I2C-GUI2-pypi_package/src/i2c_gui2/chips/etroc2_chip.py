@@ -1752,6 +1752,142 @@ class ETROC2_Chip(Base_Chip):
         else:
             return super().write_all_address_space(address_space_name, readback_check=readback_check, no_message=no_message)
 
+    def _propagate_broadcast(self, address_space: Address_Space_Controller, block: str, offset: int, values: list[int]):
+        # A broadcast write sets the registers of all the pixels, so the memory and the known device state of
+        # every pixel are updated too, otherwise a later write_dirty would undo the broadcast
+        if block != "Pixel Config":
+            return
+        for column in range(16):
+            for row in range(16):
+                address = etroc2_column_row_to_base_address(block, column, row) + offset
+                address_space._memory[address : address + len(values)] = values
+                address_space._device_memory[address : address + len(values)] = values
+
+    def plan_pixel_broadcast(self, block: str = "Pixel Config"):
+        """Find the pixel registers which are cheaper to write with a broadcast followed by per-pixel fix-ups.
+
+        For each register offset of the pixel block, the most common value in the memory of the 256 pixels is
+        compared with the pending changes: if the pixels which would need a fix-up after broadcasting that value
+        are fewer than the pixels which need to be written anyway (minus the broadcast write itself), the offset
+        is broadcast. Offsets where some pixel has an unknown value are never broadcast.
+
+        Returns
+        -------
+        dict[int, int]
+            The value to broadcast for each selected register offset
+        """
+        address_space: Address_Space_Controller = self._address_space["ETROC2"]
+        block_length = address_space._blocks[f"{block}:0:0"]["Length"]
+        base_addresses = [etroc2_column_row_to_base_address(block, column, row) for column in range(16) for row in range(16)]
+        first_address = min(base_addresses)
+        last_address = max(base_addresses) + block_length
+        memory = address_space._memory[first_address:last_address]
+        device_memory = address_space._device_memory[first_address:last_address]
+
+        plan = {}
+        for offset in range(block_length):
+            if address_space._read_only_map[base_addresses[0] + offset]:
+                continue
+            values = [memory[address - first_address + offset] for address in base_addresses]
+            if None in values:
+                continue
+            dirty = sum(1 for address, value in zip(base_addresses, values) if device_memory[address - first_address + offset] != value)
+            if dirty == 0:
+                continue
+            counts = {}
+            for value in values:
+                counts[value] = counts.get(value, 0) + 1
+            value = max(counts, key=counts.get)
+            exceptions = len(values) - counts[value]
+            if exceptions + 1 < dirty:
+                plan[offset] = value
+
+        return plan
+
+    def write_pixel_broadcast(self, block: str = "Pixel Config", readback_check: bool = True, no_message: bool = True):
+        """Broadcast the pixel registers selected by plan_pixel_broadcast, without writing the per-pixel fix-ups.
+
+        Consecutive offsets are broadcast in a single block write. After a successful broadcast the known device
+        state of every pixel is updated, so a following write_dirty only writes the pixels which differ from the
+        broadcast value. The memory of the pixels is not changed.
+        """
+        plan = self.plan_pixel_broadcast(block)
+        if len(plan) == 0:
+            return True
+
+        address_space: Address_Space_Controller = self._address_space["ETROC2"]
+        broadcast_base_address = etroc2_column_row_to_base_address(block, 0, 0, broadcast=True)
+
+        runs = []
+        for offset in sorted(plan):
+            if len(runs) > 0 and runs[-1][0] + runs[-1][1] == offset:
+                runs[-1][1] += 1
+            else:
+                runs += [[offset, 1]]
+
+        if not no_message:
+            self._logger.info(
+                "Broadcast writing {} registers in {} writes to block {} of chip {}".format(len(plan), len(runs), block, self._chip_name)
+            )
+
+        success = True
+        for offset, length in runs:
+            values = [plan[offset + idx] for idx in range(length)]
+            broadcast_address = broadcast_base_address + offset
+
+            # Temporarily disable the read-only property on the broadcast address
+            address_space._read_only_map[broadcast_address : broadcast_address + length] = b'\x00' * length
+            address_space._memory[broadcast_address : broadcast_address + length] = values
+
+            if address_space.write_memory_block(broadcast_address, length, readback_check=readback_check):
+                for column in range(16):
+                    for row in range(16):
+                        address = etroc2_column_row_to_base_address(block, column, row) + offset
+                        address_space._device_memory[address : address + length] = values
+            else:
+                success = False
+
+            # Re-enable the read-only on the broadcast address
+            address_space._read_only_map[broadcast_address : broadcast_address + length] = b'\x01' * length
+            address_space._memory[broadcast_address : broadcast_address + length] = [None] * length
+            address_space._device_memory[broadcast_address : broadcast_address + length] = [None] * length
+
+        return success
+
+    #  The pixel configuration is usually changed in the same way for all the pixels, so the changed pixel registers
+    # are broadcast first whenever that saves writes and only the remaining differences are written per pixel
+    def write_dirty_address_space(
+        self, address_space_name: str, readback_check: bool = True, no_message: bool = True, auto_broadcast: bool = True
+    ):
+        if address_space_name == "ETROC2" and auto_broadcast:
+            # A failed broadcast leaves the device state of the pixels untouched, so they are written one by one below
+            self.write_pixel_broadcast("Pixel Config", readback_check=readback_check, no_message=no_message)
+        return super().write_dirty_address_space(address_space_name, readback_check=readback_check, no_message=no_message)
+
+    def write_dirty_block(
+        self,
+        address_space_name: str,
+        block_name: str,
+        full_array: bool = True,
+        readback_check: bool = True,
+        no_message: bool = True,
+        auto_broadcast: bool = True,
+    ):
+        if (
+            address_space_name == "ETROC2"
+            and "Indexer" in self._register_model[address_space_name]["Register Blocks"][block_name]
+            and full_array
+            and auto_broadcast
+        ):
+            self.write_pixel_broadcast(block_name, readback_check=readback_check, no_message=no_message)
+        return super().write_dirty_block(
+            address_space_name=address_space_name,
+            block_name=block_name,
+            full_array=full_array,
+            readback_check=readback_check,
+            no_message=no_message,
+        )
+
     #  We need to overload the write block method so that we intercept the call for the broadcast feature
     def write_all_block(
         self, address_space_name: str, block_name: str, full_array: bool = False, readback_check: bool = True, no_message: bool = True
@@ -1792,6 +1928,10 @@ class ETROC2_Chip(Base_Chip):
                 address_space._memory[broadcast_address] = address_space._memory[base_address + offset]
 
             return_status = address_space.write_memory_block(broadcast_base_address, block_length, readback_check=readback_check)
+            if return_status:
+                self._propagate_broadcast(
+                    address_space, params['block'], 0, address_space._memory[broadcast_base_address : broadcast_base_address + block_length]
+                )
 
             # Re-enable the read-only on the broadcast address
             for offset in range(block_length):
@@ -1850,6 +1990,8 @@ class ETROC2_Chip(Base_Chip):
             address_space._memory[broadcast_address] = address_space._memory[base_address + offset]
 
             return_status = address_space.write_memory_block(broadcast_address, 1, readback_check=readback_check)
+            if return_status:
+                self._propagate_broadcast(address_space, params['block'], offset, [address_space._memory[broadcast_address]])
 
             # Re-enable the read-only on the broadcast address
             address_space._read_only_map[broadcast_address] = True
@@ -380,7 +380,7 @@ class I2C_Connection_Helper:
                     else:  # if word_endianness == 'little':
                         byte_data = [42] + byte_data
             else:
-                byte_data = [i for i in range(word_count * word_bytes)]
+                byte_data = [i & 0xFF for i in range(word_count * word_bytes)]
             self._logger.debug("Software emulation (no connect) is enabled, so returning dummy values: {}".format(repr(byte_data)))
         elif self._max_seq_byte is None:
             word_address = address_to_phys(word_address, address_bitlength, address_endianness)
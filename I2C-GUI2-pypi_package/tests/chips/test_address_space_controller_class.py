@@ -174,3 +174,156 @@ def test_update_i2c_address_none(caplog, asc_name, asc_test):
     assert log_tuples[0][1] == logging.INFO
     assert asc_name in log_tuples[0][2]
     assert "Reset" in log_tuples[0][2]
+
+
+def test_reset_to_defaults(asc_test):
+    asc_test._defaults[2] = 7
+    asc_test._memory[2] = 3
+    asc_test._memory[4] = 3
+    asc_test.reset_to_defaults()
+    assert asc_test._memory[2] == 7
+    assert asc_test._memory[4] is None
+
+
+def test_write_split_for_read_only(asc_test):
+    asc_test._read_only_map[0:10] = b'\x01\x00\x00\x01\x01\x00\x01\x00\x00\x00'
+    with patch.object(asc_test, 'write_memory_block', return_value=True) as mock_write:
+        assert asc_test.write_memory_block_with_split_for_read_only(0, 10, False)
+    assert [c.args for c in mock_write.call_args_list] == [(1, 2, False, 1), (5, 1, False, 5), (7, 3, False, 7)]
+
+
+@pytest.mark.parametrize('asc_address_space_size', [40])
+def test_dirty_addresses(asc_test):
+    asc_test._read_only_map[0:40] = bytes(40)
+    asc_test._read_only_map[7] = 1
+    asc_test._memory[0:40] = [0] * 40
+    asc_test._device_memory[0:40] = [0] * 40
+    asc_test._memory[3] = 1
+    asc_test._memory[7] = 1
+    asc_test._memory[20] = None
+    asc_test._device_memory[30] = None
+    assert asc_test.get_dirty_addresses() == [3, 30]
+
+
+@pytest.mark.parametrize('asc_address_space_size', [40])
+def test_plan_dirty_writes(asc_test):
+    asc_test._read_only_map[0:40] = bytes(40)
+    asc_test._read_only_map[14] = 1
+    asc_test._memory[0:40] = [0] * 40
+    asc_test._device_memory[0:40] = [0] * 40
+    for address in [1, 2, 4, 12, 16, 24, 25, 26, 27, 28, 29, 30, 31, 33]:
+        asc_test._memory[address] = 1
+    # 1-2 and 4 are merged, 12 and 16 are not because of the read only word in between
+    # and 24-31 fill a full transaction of max_seq_byte, so 33 is written separately
+    assert asc_test.plan_dirty_writes() == [(1, 4), (12, 1), (16, 1), (24, 8), (33, 1)]
+
+
+@pytest.mark.parametrize('asc_address_space_size', [40])
+def test_write_dirty(asc_test):
+    asc_test._i2c_connection._is_connected = True
+    asc_test._read_only_map[0:40] = bytes(40)
+    asc_test._memory[0:40] = [0] * 40
+
+    assert asc_test.write_dirty(readback_check=False)
+    assert asc_test.get_write_counters() == {"bytes_written": 40, "bytes_skipped": 0, "write_transactions": 5}
+    assert asc_test.get_dirty_addresses() == []
+
+    asc_test.reset_write_counters()
+    asc_test._memory[5] = 3
+    assert asc_test.write_dirty(readback_check=False)
+    assert asc_test.get_write_counters() == {"bytes_written": 1, "bytes_skipped": 39, "write_transactions": 1}
+
+    asc_test.update_i2c_address(0x22)
+    assert len(asc_test.get_dirty_addresses()) == 40
+
+
+@pytest.mark.parametrize('asc_address_space_size', [40])
+def test_deferred_readback(asc_test):
+    asc_test._i2c_connection._is_connected = True
+    asc_test._read_only_map[0:40] = bytes(40)
+    asc_test._memory[0:40] = list(range(40))
+
+    device = list(range(40))
+    device[3] = 0xFF
+    device[17] = 0xFE
+
+    def read_device_memory(device_address, memory_address, word_count, **kwargs):
+        return device[memory_address : memory_address + word_count]
+
+    with patch.object(asc_test._i2c_connection, "read_device_memory", side_effect=read_device_memory) as read_patch:
+        with asc_test.deferred_readback() as result:
+            for address in range(0, 40, 8):
+                assert asc_test.write_memory_block(address, 8, readback_check=True)
+            read_patch.assert_not_called()
+
+        read_patch.assert_called_once()
+
+    assert result["blocks_written"] == 5
+    assert result["blocks_checked"] == 5
+    assert result["words_checked"] == 40
+    assert result["reads"] == 1
+    assert not result["success"]
+    assert result["mismatches"] == [
+        {"address": 3, "expected": 3, "read": 0xFF},
+        {"address": 17, "expected": 17, "read": 0xFE},
+    ]
+    assert asc_test._memory[3] == 0xFF
+    assert asc_test._memory[17] == 0xFE
+
+
+@pytest.mark.parametrize('asc_address_space_size', [40])
+def test_deferred_readback_changed_after_write(asc_test):
+    asc_test._i2c_connection._is_connected = True
+    asc_test._read_only_map[0:40] = bytes(40)
+    asc_test._memory[0:40] = list(range(40))
+
+    device = list(range(40))
+    device[5] = 0xFF
+
+    def write_device_memory(device_address, memory_address, data, **kwargs):
+        device[memory_address : memory_address + len(data)] = data
+
+    def read_device_memory(device_address, memory_address, word_count, **kwargs):
+        return device[memory_address : memory_address + word_count]
+
+    with patch.object(asc_test._i2c_connection, "write_device_memory", side_effect=write_device_memory):
+        with patch.object(asc_test._i2c_connection, "read_device_memory", side_effect=read_device_memory):
+            with asc_test.deferred_readback() as result:
+                assert asc_test.write_memory_block(0, 8, readback_check=True)
+                # changed after the write, but not written yet
+                asc_test._memory[2] = 0x42
+                # written again, only the last write is checked
+                asc_test._memory[3] = 0x43
+                assert asc_test.write_memory_block(3, 1, readback_check=True)
+                # the device does not follow the write
+                device[5] = 0xFF
+                asc_test._memory[5] = 0x45
+
+    assert result["blocks_checked"] == 2
+    assert result["mismatches"] == [{"address": 5, "expected": 5, "read": 0xFF}]
+    assert asc_test._memory[2] == 0x42
+    assert asc_test._device_memory[2] == 2
+    assert asc_test._memory[3] == 0x43
+    assert asc_test._memory[5] == 0x45
+    assert asc_test._device_memory[5] == 0xFF
+
+
+@pytest.mark.parametrize('asc_address_space_size', [40])
+def test_deferred_readback_sampling(asc_test):
+    asc_test._i2c_connection._is_connected = True
+    asc_test._read_only_map[0:40] = bytes(40)
+    asc_test._memory[0:40] = [0] * 40
+
+    with patch.object(asc_test._i2c_connection, "read_device_memory", side_effect=lambda d, a, word_count, **kwargs: [0] * word_count):
+        asc_test.start_deferred_readback(sample_fraction=0)
+        for address in range(0, 40, 8):
+            assert asc_test.write_memory_block(address, 8, readback_check=True)
+        result = asc_test.finish_deferred_readback()
+
+    assert result["blocks_written"] == 5
+    assert result["blocks_checked"] == 0
+    assert result["reads"] == 0
+    assert result["success"]
+
+    with pytest.raises(RuntimeError):
+        asc_test.finish_deferred_readback()
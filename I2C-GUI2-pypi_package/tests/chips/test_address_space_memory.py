@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+# zlib License
+#
+# (C) 2024 Cristóvão Beirão da Cruz e Silva <cbeiraod@cern.ch>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty.  In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+# 1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+# 2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+# 3. This notice may not be removed or altered from any source distribution.
+#############################################################################
+
+import pytest
+
+from i2c_gui2.chips.address_space_memory import Address_Space_Memory
+
+
+@pytest.fixture
+def memory():
+    yield Address_Space_Memory(10)
+
+
+def test_init(memory):
+    assert len(memory) == 10
+    for index in range(10):
+        assert memory[index] is None
+
+
+@pytest.mark.parametrize('bytes_per_word', [1, 2, 4, 8])
+def test_init_word_size(bytes_per_word):
+    memory = Address_Space_Memory(4, bytes_per_word)
+    memory[0] = 2 ** (8 * bytes_per_word) - 1
+    assert memory[0] == 2 ** (8 * bytes_per_word) - 1
+
+
+def test_init_word_too_large():
+    with pytest.raises(RuntimeError, match="too large"):
+        Address_Space_Memory(4, 16)
+
+
+def test_setitem(memory):
+    memory[3] = 20
+    assert memory[3] == 20
+    memory[3] = 0
+    assert memory[3] == 0
+    memory[3] = None
+    assert memory[3] is None
+    memory[-1] = 5
+    assert memory[9] == 5
+
+
+def test_slice(memory):
+    memory[2:5] = [1, 2, 3]
+    assert memory[0:6] == [None, None, 1, 2, 3, None]
+    memory[3:5] = [None, 7]
+    assert memory[2:5] == [1, None, 7]
+
+
+def test_slice_wrong_length(memory):
+    with pytest.raises(ValueError):
+        memory[2:5] = [1, 2]
+    assert memory[0:10] == [None] * 10
+
+
+def test_iter_and_eq(memory):
+    memory[1] = 4
+    assert list(memory) == [None, 4] + [None] * 8
+    assert memory == [None, 4] + [None] * 8
+
+
+def test_copy_from(memory):
+    other = Address_Space_Memory(10)
+    other[0:3] = [1, 2, 3]
+    memory[5] = 10
+    memory.copy_from(other)
+    assert memory == other
+    assert memory[5] is None
+
+
+def test_as_numpy(memory):
+    numpy = pytest.importorskip("numpy")
+    memory[0:3] = [1, 2, 3]
+    values, valid = memory.as_numpy()
+    assert values.dtype == numpy.uint8
+    assert list(values[:4]) == [1, 2, 3, 0]
+    assert list(valid[:4]) == [True, True, True, False]
+    values[4] = 9
+    valid[4] = True
+    assert memory[4] == 9
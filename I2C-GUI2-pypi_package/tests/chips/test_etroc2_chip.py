@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+# zlib License
+#
+# (C) 2024 Cristóvão Beirão da Cruz e Silva <cbeiraod@cern.ch>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty.  In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+# 1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+# 2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+# 3. This notice may not be removed or altered from any source distribution.
+#############################################################################
+
+from unittest.mock import patch
+
+import pytest
+
+from i2c_gui2.chips.etroc2_chip import ETROC2_Chip
+from i2c_gui2.chips.etroc2_chip import etroc2_column_row_to_base_address
+from i2c_gui2.i2c_connection_helper import I2C_Connection_Helper
+
+
+@pytest.fixture
+def etroc2_test(logger):
+    conn = I2C_Connection_Helper(max_seq_byte=8, no_connect=True)
+    conn._is_connected = True
+    chip = ETROC2_Chip(0x60, 0x40, conn, logger)
+    address_space = chip._address_space["ETROC2"]
+    for column in range(16):
+        for row in range(16):
+            address = etroc2_column_row_to_base_address("Pixel Config", column, row)
+            address_space._memory[address : address + 32] = [0] * 32
+            address_space._device_memory[address : address + 32] = [0] * 32
+    yield chip
+
+
+def test_plan_pixel_broadcast(etroc2_test):
+    address_space = etroc2_test._address_space["ETROC2"]
+    assert etroc2_test.plan_pixel_broadcast() == {}
+
+    for column in range(16):
+        for row in range(16):
+            address = etroc2_column_row_to_base_address("Pixel Config", column, row)
+            address_space._memory[address + 3] = 0x12
+            address_space._memory[address + 4] = 0x34
+            if column < 2:
+                address_space._memory[address + 7] = 0x56
+
+    assert etroc2_test.plan_pixel_broadcast() == {3: 0x12, 4: 0x34}
+
+    exception = etroc2_column_row_to_base_address("Pixel Config", 5, 6)
+    address_space._memory[exception + 3] = None
+    assert etroc2_test.plan_pixel_broadcast() == {4: 0x34}
+
+
+def test_write_dirty_broadcast(etroc2_test):
+    address_space = etroc2_test._address_space["ETROC2"]
+    for column in range(16):
+        for row in range(16):
+            address = etroc2_column_row_to_base_address("Pixel Config", column, row)
+            address_space._memory[address + 3] = 0x12
+            address_space._memory[address + 4] = 0x34
+    exception = etroc2_column_row_to_base_address("Pixel Config", 5, 6)
+    address_space._memory[exception + 4] = 0x35
+
+    connection = etroc2_test._i2c_connection
+    with patch.object(connection, "write_device_memory", wraps=connection.write_device_memory) as write_patch:
+        assert etroc2_test.write_dirty_block("ETROC2", "Pixel Config", readback_check=False)
+
+    written = [call.args[1] for call in write_patch.call_args_list]
+    broadcast_address = etroc2_column_row_to_base_address("Pixel Config", 0, 0, broadcast=True)
+    assert broadcast_address + 3 in written
+    assert exception + 4 in written
+    assert len(written) == 2
+
+    assert address_space.get_dirty_addresses(0x8000, 0x4000) == []
+    assert address_space._memory[exception + 4] == 0x35
+    assert address_space._memory[broadcast_address + 3] is None
+    assert address_space._read_only_map[broadcast_address + 3]
+
+
+def test_write_dirty_broadcast_deferred_readback(etroc2_test):
+    address_space = etroc2_test._address_space["ETROC2"]
+    for column in range(16):
+        for row in range(16):
+            address = etroc2_column_row_to_base_address("Pixel Config", column, row)
+            address_space._memory[address + 3] = 0x12
+
+    device = {}
+
+    def write_device_memory(device_address, memory_address, data, **kwargs):
+        for idx, value in enumerate(data):
+            device[memory_address + idx] = value
+
+    def read_device_memory(device_address, memory_address, word_count, **kwargs):
+        return [device.get(memory_address + idx, 0) for idx in range(word_count)]
+
+    connection = etroc2_test._i2c_connection
+    with patch.object(connection, "write_device_memory", side_effect=write_device_memory):
+        with patch.object(connection, "read_device_memory", side_effect=read_device_memory):
+            with address_space.deferred_readback() as result:
+                assert etroc2_test.write_dirty_block("ETROC2", "Pixel Config", readback_check=True)
+
+    broadcast_address = etroc2_column_row_to_base_address("Pixel Config", 0, 0, broadcast=True)
+    assert result["blocks_checked"] == 1
+    assert result["success"]
+    assert result["mismatches"] == []
+    assert address_space._memory[broadcast_address + 3] is None
+    assert address_space._device_memory[broadcast_address + 3] is None
+    assert address_space.get_dirty_addresses(0x8000, 0x4000) == []
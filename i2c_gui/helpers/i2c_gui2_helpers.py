@@ -541,9 +541,7 @@ class i2c_connection():
         if(chip==None):
             chip: i2c_gui2.ETROC2_Chip = self.get_chip_i2c_connection(chip_address)
 
-        chip.row = 0
-        chip.col = 0
-        chip.read_all_block("ETROC2", "Pixel Config")
+        chip.read_all_block("ETROC2", "Pixel Config", full_array=True)
 
         # Define pixel configuration settings
         pixel_config = {
@@ -569,25 +567,27 @@ class i2c_connection():
             "DAC": 0x3ff,  # Max DAC
         }
 
-        # Set pixel configuration values on the chip
-        for key, value in pixel_config.items():
-            chip.set_decoded_value("ETROC2", "Pixel Config", key, value)
+        # Set pixel configuration values of all the pixels, the chip broadcasts the registers which are the same everywhere
+        for row in range(16):
+            for col in range(16):
+                chip.row = row
+                chip.col = col
+                for key, value in pixel_config.items():
+                    chip.set_decoded_value("ETROC2", "Pixel Config", key, value)
 
         try:
-            chip.broadcast = True
-            chip.write_all_block("ETROC2", "Pixel Config")
-            chip.broadcast = False
+            if not chip.write_dirty_block("ETROC2", "Pixel Config"):
+                raise RuntimeError("Failed to write the pixel configuration")
             print(f"Disabled pixels (Bypass, TH-3f DAC-3ff) for chip: {hex(chip_address)}")
 
             # Verify broadcast
             print('Verifying Broadcast results')
+            chip.read_all_block("ETROC2", "Pixel Config", full_array=True)
             for row in tqdm(range(16), desc="Checking broadcast for row", position=0):
                 for col in range(16):
                     chip.row = row
                     chip.col = col
 
-                    chip.read_all_block("ETROC2", "Pixel Config")
-
                     for key, value in pixel_config.items():
                         if chip.get_decoded_value("ETROC2", "Pixel Config", key) != value:
                             raise RuntimeError("Failed to verify broadcast results")
@@ -873,24 +873,24 @@ class i2c_connection():
         if(chip==None):
             chip: i2c_gui2.ETROC2_Chip = self.get_chip_i2c_connection(chip_address)
 
-        chip.row = 0
-        chip.col = 0
-
-        chip.read_decoded_value("ETROC2", "Pixel Config", "TH_offset")
-        chip.set_decoded_value("ETROC2", "Pixel Config", "TH_offset", offset)
+        chip.read_all_block("ETROC2", "Pixel Config", full_array=True)
+        for row in range(16):
+            for col in range(16):
+                chip.row = row
+                chip.col = col
+                chip.set_decoded_value("ETROC2", "Pixel Config", "TH_offset", offset)
 
         try:
-            chip.broadcast = True
-            chip.write_decoded_value("ETROC2", "Pixel Config", "TH_offset")
-            chip.broadcast = False
+            if not chip.write_dirty_block("ETROC2", "Pixel Config"):
+                raise RuntimeError("Failed to write the pixel offsets")
 
             print('Verifying Broadcast results')
+            chip.read_all_block("ETROC2", "Pixel Config", full_array=True)
             for row in tqdm(range(16), desc="Checking broadcast for row", position=0):
                 for col in range(16):
                     chip.row = row
                     chip.col = col
 
-                    chip.read_decoded_value("ETROC2", "Pixel Config", "TH_offset")
                     if chip.get_decoded_value("ETROC2", "Pixel Config", "TH_offset") != offset:
                         raise RuntimeError("Failed to verify broadcast results")
 
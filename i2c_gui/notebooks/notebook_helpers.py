@@ -27,6 +27,7 @@ import time
 import threading
 import numpy as np
 import os, sys
+import io
 from queue import Queue
 from collections import deque
 import queue
@@ -37,6 +38,7 @@ import logging
 import pickle
 import matplotlib.pyplot as plt
 import multiprocessing
+import atexit
 from pathlib import Path
 os.chdir(f'/home/{os.getlogin()}/ETROC2/ETROC_DAQ')
 import run_script
@@ -1144,6 +1146,143 @@ class i2c_connection():
 #--------------------------------------------------------------------------#
 #  Functions separate from the i2c_conn class
 
+class DAQWorker():
+    '''
+    Long-lived process that runs run_script.main_process for one scan point after the other.
+    Starting a new process per DAC point and reconfiguring the FPGA every time dominates the
+    scan time, so the worker is started once and the firmware is only configured again when the
+    firmware settings (hostname, -s, -d, -a, -p) change.
+    Commands and results are passed over a pair of multiprocessing queues, tagged with a sequence number:
+    if a run is interrupted (e.g. a notebook cell is stopped), the worker still finishes it, and its
+    late result is dropped by the next run instead of being taken for that run's result.
+    '''
+    def __init__(self):
+        self.command_queue = multiprocessing.Queue()
+        self.result_queue = multiprocessing.Queue()
+        self.firmware = None
+        self.sequence = 0
+        self.process = multiprocessing.Process(target=_daq_worker_main, args=(self.command_queue, self.result_queue))
+        self.process.start()
+        # registered after multiprocessing's own exit handler, so it runs before the children are joined
+        atexit.register(self.close)
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def run(self, args, log_file, firmware=None, ipc_commands=None, run_time=0, stop_commands=None):
+        '''
+        Run main_process with the options in args, and wait until it is done.
+        firmware holds the firmware options, the FPGA is only configured (-f) if they differ from the last run.
+        ipc_commands are sent right after the start, stop_commands after run_time seconds; if
+        either is given the run is ended with 'allow threads to exit', like in run_daq.
+        '''
+        if firmware is not None:
+            args = f"{'-f ' if firmware != self.firmware else ''}{firmware} {args}"
+        self.sequence += 1
+        self.command_queue.put((self.sequence, args, log_file, ipc_commands, run_time, stop_commands))
+        try:
+            while True:
+                try:
+                    sequence, status, message = self.result_queue.get(timeout=1)
+                except queue.Empty:
+                    if not self.process.is_alive():
+                        raise RuntimeError(f"DAQ worker died with exit code {self.process.exitcode}")
+                    continue
+                # results of earlier, interrupted runs are dropped
+                if sequence == self.sequence:
+                    break
+            if status != 'done':
+                raise RuntimeError(f"DAQ worker failed:\n{message}")
+        except BaseException:
+            # also for KeyboardInterrupt: the FPGA state is unknown, configure it again on the next run
+            self.firmware = None
+            raise
+        if firmware is not None:
+            self.firmware = firmware
+
+    def take_counts(self, args, log_file, data_dir, firmware=None):
+        '''
+        Run a counter (--nodaq) measurement and return the first and last line of every
+        FPGA_Data.dat file in data_dir, split at the commas.
+        '''
+        self.run(args, log_file, firmware=firmware)
+        return read_fpga_data(data_dir)
+
+    def close(self):
+        if self.process.is_alive():
+            self.command_queue.put(None)
+            self.process.join(timeout=10)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+def _daq_worker_main(command_queue, result_queue):
+    import traceback
+    parser = parser_arguments.create_parser()
+    while True:
+        command = command_queue.get()
+        if command is None:
+            break
+        sequence, args, log_file, ipc_commands, run_time, stop_commands = command
+        try:
+            (options, _) = parser.parse_args(args=args.split())
+            IPC_queue = multiprocessing.Queue()
+            feeder = None
+            if ipc_commands is not None or stop_commands is not None:
+                feeder = threading.Thread(target=_daq_worker_feed, args=(IPC_queue, ipc_commands or [], run_time, stop_commands or []), daemon=True)
+                feeder.start()
+            run_script.main_process(IPC_queue, options, log_file)
+            if feeder is not None:
+                feeder.join()
+            result_queue.put((sequence, 'done', ''))
+        except Exception:
+            result_queue.put((sequence, 'failed', traceback.format_exc()))
+
+def _daq_worker_feed(IPC_queue, ipc_commands, run_time, stop_commands):
+    # sleep while waiting, main_process runs in the same process and needs the GIL
+    def wait_empty():
+        while not IPC_queue.empty():
+            time.sleep(0.001)
+    for cmd in ipc_commands:
+        IPC_queue.put(cmd)
+    wait_empty()
+    time.sleep(run_time)
+    for cmd in stop_commands:
+        IPC_queue.put(cmd)
+    wait_empty()
+    IPC_queue.put('allow threads to exit')
+
+_daq_worker = None
+
+def get_daq_worker():
+    '''
+    Return the DAQ worker shared by all scans of this notebook, (re)starting it if needed.
+    The FPGA is configured again on the first run after this call, so every scan starts from a known state.
+    '''
+    global _daq_worker
+    if _daq_worker is None or not _daq_worker.is_alive():
+        _daq_worker = DAQWorker()
+    _daq_worker.firmware = None
+    return _daq_worker
+
+def stop_daq_worker():
+    global _daq_worker
+    if _daq_worker is not None:
+        _daq_worker.close()
+        _daq_worker = None
+
+def read_fpga_data(data_dir):
+    '''
+    First and last line of every *FPGA_Data.dat file in data_dir, split at the commas.
+    '''
+    lines = []
+    for file_name in sorted(Path(data_dir).glob("*FPGA_Data.dat")):
+        with open(file_name) as infile:
+            file_lines = infile.readlines()
+        if len(file_lines) == 0: continue
+        lines.append((file_lines[0].split(','), file_lines[-1].split(',')))
+    return lines
+
 def pixel_turnon_points(i2c_conn: i2c_connection, chip_address, chip_figname, s_flag, d_flag, a_flag, p_flag, scan_list, verbose=False, attempt='', today='', calibrate=False, hostname = "192.168.2.3", power_mode="high"):
     scan_name = chip_figname+"_VRef_SCurve_BinarySearch_TurnOn"
     fpga_time = 3
@@ -1154,6 +1293,8 @@ def pixel_turnon_points(i2c_conn: i2c_connection, chip_address, chip_figname, s_
     base_dir.mkdir(exist_ok=True)
 
     chip: i2c_gui2.ETROC2_Chip = i2c_conn.get_chip_i2c_connection(chip_address)
+    daq_worker = get_daq_worker()
+    firmware = f"--hostname {hostname} -s {s_flag} -d {d_flag} -a {a_flag} -p {p_flag}"
 
     BL_map_THCal,NW_map_THCal,_,_ = i2c_conn.get_auto_cal_maps(chip_address)
     for row, col in tqdm(scan_list, leave=False):
@@ -1166,12 +1307,7 @@ def pixel_turnon_points(i2c_conn: i2c_connection, chip_address, chip_figname, s_
         chip.row = row
         chip.col = col
         threshold_name = scan_name+f'_Pixel_C{col}_R{row}'+attempt
-        parser = parser_arguments.create_parser()
-        (options, args) = parser.parse_args(args=f"-f --useIPC --hostname {hostname} -o {threshold_name} -v -w -s {s_flag} -d {d_flag} -a {a_flag} -p {p_flag} --counter_duration 0x0001 --fpga_data_time_limit {int(fpga_time)} --fpga_data_QInj --nodaq".split())
-        IPC_queue = multiprocessing.Queue()
-        process = multiprocessing.Process(target=run_script.main_process, args=(IPC_queue, options, f'process_outputs/main_process_link'))
-        process.start()
-        process.join()
+        daq_worker.run(f"--useIPC -o {threshold_name} -v -w --counter_duration 0x0001 --fpga_data_time_limit {int(fpga_time)} --fpga_data_QInj --nodaq", f'process_outputs/main_process_link', firmware=firmware)
 
         a = 0
         b = BL_map_THCal[row][col] + 3*(NW_map_THCal[row][col])
@@ -1179,45 +1315,25 @@ def pixel_turnon_points(i2c_conn: i2c_connection, chip_address, chip_figname, s_
             DAC = int(np.floor((a+b)/2))
             # Set the DAC to the value being scanned
             i2c_conn.pixel_decoded_register_write("DAC", format(DAC, '010b'), chip=chip)
-            (options, args) = parser.parse_args(args=f"--useIPC --hostname {hostname} -o {threshold_name} -v --counter_duration 0x0001 --fpga_data_time_limit {int(fpga_time)} --fpga_data_QInj --nodaq --DAC_Val {int(DAC)}".split())
-            IPC_queue = multiprocessing.Queue()
-            process = multiprocessing.Process(target=run_script.main_process, args=(IPC_queue, options, f'process_outputs/main_process_{DAC}'))
-            process.start()
-            process.join()
+            fpga_data = daq_worker.take_counts(f"--useIPC --hostname {hostname} -o {threshold_name} -v --counter_duration 0x0001 --fpga_data_time_limit {int(fpga_time)} --fpga_data_QInj --nodaq --DAC_Val {int(DAC)}", f'process_outputs/main_process_{DAC}', base_dir / threshold_name)
 
             continue_flag = False
-            root = '../ETROC-Data'
-            file_pattern = "*FPGA_Data.dat"
-            path_pattern = f"*{today}_Array_Test_Results/{threshold_name}"
-            file_list = []
-            for path, subdirs, files in os.walk(root):
-                if not fnmatch(path, path_pattern): continue
-                for name in files:
-                    pass
-                    if fnmatch(name, file_pattern):
-                        file_list.append(os.path.join(path, name))
-            for file_index, file_name in enumerate(file_list):
-                with open(file_name) as infile:
-                    lines = infile.readlines()
-                    last_line = lines[-1]
-                    first_line = lines[0]
-                    text_list = last_line.split(',')
-                    FPGA_state = text_list[0]
-                    line_DAC = int(text_list[-1])
-                    if(FPGA_state==0 or line_DAC!=DAC):
-                        continue_flag=True
-                        continue
-                    TDC_tb = int(text_list[-2])
-                    turnon_point = line_DAC
-                    # Condition handling for Binary Search
-                    if(TDC_tb>0):
-                        b = DAC
-                    else:
-                        a = DAC
+            for first_line, text_list in fpga_data:
+                FPGA_state = text_list[0]
+                line_DAC = int(text_list[-1])
+                if(FPGA_state==0 or line_DAC!=DAC):
+                    continue_flag=True
+                    continue
+                TDC_tb = int(text_list[-2])
+                turnon_point = line_DAC
+                # Condition handling for Binary Search
+                if(TDC_tb>0):
+                    b = DAC
+                else:
+                    a = DAC
             if(continue_flag): continue
         i2c_conn.disable_pixel(row=row, col=col, verbose=verbose, chip_address=chip_address, chip=chip)
         if(verbose): print(f"Turn-On point for Pixel ({row},{col}) for chip {hex(chip_address)} is found to be DAC:{turnon_point}")
-        del IPC_queue, process, parser
 
 def trigger_bit_noisescan(i2c_conn: i2c_connection, chip_address, chip_figname, s_flag, d_flag, a_flag, p_flag, scan_list, verbose=False, pedestal_scan_step = 1, attempt='', today='', busyCB=False, tp_tag='', neighbors=False, allon=False, hostname = "192.168.2.3", override_baseline=None, power_mode="high"):
     root = '../ETROC-Data'
@@ -1231,6 +1347,8 @@ def trigger_bit_noisescan(i2c_conn: i2c_connection, chip_address, chip_figname,
     base_dir.mkdir(exist_ok=True)
     BL_map_THCal,NW_map_THCal,_,_ = i2c_conn.get_auto_cal_maps(chip_address)
     chip: i2c_gui2.ETROC2_Chip = i2c_conn.get_chip_i2c_connection(chip_address)
+    daq_worker = get_daq_worker()
+    firmware = f"--hostname {hostname} -s {s_flag} -d {d_flag} -a {a_flag} -p {p_flag}"
     if(allon):
         for first_idx in tqdm(range(16), leave=False):
             for second_idx in range(16):
@@ -1269,12 +1387,7 @@ def trigger_bit_noisescan(i2c_conn: i2c_connection, chip_address, chip_figname,
         chip.row = row
         chip.col = col
         threshold_name = scan_name+f'_Pixel_C{col}_R{row}'+attempt
-        parser = parser_arguments.create_parser()
-        (options, args) = parser.parse_args(args=f"-f --useIPC --hostname {hostname} -o {threshold_name} -v -w --counter_duration 0x0001 --fpga_data_time_limit {int(fpga_time)} --fpga_data --nodaq -s {s_flag} -d {d_flag} -a {a_flag} -p {p_flag}".split())
-        IPC_queue = multiprocessing.Queue()
-        process = multiprocessing.Process(target=run_script.main_process, args=(IPC_queue, options, f'process_outputs/main_process_noiseOnly'))
-        process.start()
-        process.join()
+        daq_worker.run(f"--useIPC -o {threshold_name} -v -w --counter_duration 0x0001 --fpga_data_time_limit {int(fpga_time)} --fpga_data --nodaq", f'process_outputs/main_process_noiseOnly', firmware=firmware)
 
         for DAC in tqdm(thresholds, desc=f'DAC Loop for Chip {hex(chip_address)} Pixel ({row},{col})', leave=False):
         # for DAC in thresholds:
@@ -1283,11 +1396,7 @@ def trigger_bit_noisescan(i2c_conn: i2c_connection, chip_address, chip_figname,
                 threshold = 1
             # triggerbit_full_Scurve[row][col][threshold] = 0
             i2c_conn.pixel_decoded_register_write("DAC", format(threshold, '010b'), chip=chip)
-            (options, args) = parser.parse_args(args=f"--useIPC --hostname {hostname} -o {threshold_name} -v --counter_duration 0x0001 --fpga_data_time_limit {int(fpga_time)} --fpga_data --nodaq --DAC_Val {int(threshold)}".split())
-            IPC_queue = multiprocessing.Queue()
-            process = multiprocessing.Process(target=run_script.main_process, args=(IPC_queue, options, f'process_outputs/main_process_NoiseOnly_{threshold}'))
-            process.start()
-            process.join()
+            daq_worker.run(f"--useIPC --hostname {hostname} -o {threshold_name} -v --counter_duration 0x0001 --fpga_data_time_limit {int(fpga_time)} --fpga_data --nodaq --DAC_Val {int(threshold)}", f'process_outputs/main_process_NoiseOnly_{threshold}')
 
         if(not allon):
             i2c_conn.disable_pixel(row=row, col=col, verbose=verbose, chip_address=chip_address, chip=chip)
@@ -1302,7 +1411,6 @@ def trigger_bit_noisescan(i2c_conn: i2c_connection, chip_address, chip_figname,
                         i2c_conn.disable_pixel(row=row_nb, col=col_nb, verbose=verbose, chip_address=chip_address, chip=chip)
         else:
             i2c_conn.enable_pixel_modular(row=row, col=col, verbose=verbose, chip_address=chip_address, chip=chip, QInjEn=False, Bypass_THCal=False, triggerWindow=False, cbWindow=True, power_mode=power_mode)
-        del IPC_queue, process, parser
     if(allon):
         for first_idx in tqdm(range(16), leave=False):
             for second_idx in range(16):
@@ -1563,6 +1671,8 @@ def pixel_turnoff_points(i2c_conn: i2c_connection, chip_address, chip_figname, s
     base_dir.mkdir(exist_ok=True)
 
     chip: i2c_gui2.ETROC2_Chip = i2c_conn.get_chip_i2c_connection(chip_address)
+    daq_worker = get_daq_worker()
+    firmware = f"--hostname {hostname} -s {s_flag} -d {d_flag} -a {a_flag} -p {p_flag}"
 
     BL_map_THCal,_,_,_ = i2c_conn.get_auto_cal_maps(chip_address)
     for row, col in scan_list:
@@ -1575,12 +1685,7 @@ def pixel_turnoff_points(i2c_conn: i2c_connection, chip_address, chip_figname, s
         for QInj in tqdm(QInjEns, desc=f'QInj Loop for Chip {hex(chip_address)} Pixel ({row},{col})', leave=False):
             i2c_conn.pixel_decoded_register_write("QSel", format(QInj, '05b'), chip=chip)
             threshold_name = scan_name+f'_Pixel_C{col}_R{row}_QInj_{QInj}'+attempt
-            parser = parser_arguments.create_parser()
-            (options, args) = parser.parse_args(args=f"-f --useIPC --hostname {hostname} -o {threshold_name} -v -w -s {s_flag} -d {d_flag} -a {a_flag} -p {p_flag} --counter_duration 0x0001 --fpga_data_time_limit {int(fpga_time)} --fpga_data_QInj --nodaq".split())
-            IPC_queue = multiprocessing.Queue()
-            process = multiprocessing.Process(target=run_script.main_process, args=(IPC_queue, options, f'process_outputs/main_process_link'))
-            process.start()
-            process.join()
+            daq_worker.run(f"--useIPC -o {threshold_name} -v -w --counter_duration 0x0001 --fpga_data_time_limit {int(fpga_time)} --fpga_data_QInj --nodaq", f'process_outputs/main_process_link', firmware=firmware)
 
             a = BL_map_THCal[row][col]
             b = DAC_scan_max
@@ -1589,52 +1694,32 @@ def pixel_turnoff_points(i2c_conn: i2c_connection, chip_address, chip_figname, s
                 DAC = int(np.floor((a+b)/2.0))
                 # Set the DAC to the value being scanned
                 i2c_conn.pixel_decoded_register_write("DAC", format(DAC, '010b'), chip=chip)
-                (options, args) = parser.parse_args(args=f"--useIPC --hostname {hostname} -o {threshold_name} -v --counter_duration 0x0001 --fpga_data_time_limit {int(fpga_time)} --fpga_data_QInj --nodaq --DAC_Val {DAC}".split())
-                IPC_queue = multiprocessing.Queue()
-                process = multiprocessing.Process(target=run_script.main_process, args=(IPC_queue, options, f'process_outputs/main_process_{QInj}_{DAC}'))
-                process.start()
-                process.join()
+                fpga_data = daq_worker.take_counts(f"--useIPC --hostname {hostname} -o {threshold_name} -v --counter_duration 0x0001 --fpga_data_time_limit {int(fpga_time)} --fpga_data_QInj --nodaq --DAC_Val {DAC}", f'process_outputs/main_process_{QInj}_{DAC}', base_dir / threshold_name)
 
                 continue_flag = False
-                root = '../ETROC-Data'
-                file_pattern = "*FPGA_Data.dat"
-                path_pattern = f"*{today}_Array_Test_Results/{threshold_name}"
-                file_list = []
-                for path, subdirs, files in os.walk(root):
-                    if not fnmatch(path, path_pattern): continue
-                    for name in files:
-                        pass
-                        if fnmatch(name, file_pattern):
-                            file_list.append(os.path.join(path, name))
-                for file_index, file_name in enumerate(file_list):
-                    with open(file_name) as infile:
-                        lines = infile.readlines()
-                        last_line = lines[-1]
-                        first_line = lines[0]
-                        header_max = int(first_line.split(',')[4])
-                        text_list = last_line.split(',')
-                        FPGA_state = text_list[0]
-                        line_DAC = int(text_list[-1])
-                        # if(FPGA_state==0 or line_DAC!=DAC):
-                        if(FPGA_state==0 or line_DAC==-1):
-                            continue_flag=True
-                            continue
-                        # Condition handling for Binary Search
-                        # TDC_data = int(text_list[3])
-                        # if(TDC_data>=header_max/2.):
-                        if(triggerbit):
-                            Triggerbits = int(text_list[-2])
-                        else:
-                            Triggerbits = int(text_list[3])
-                        # print(a,b,header_max,Triggerbits,Triggerbits>=(header_max/2.),line_DAC)
-                        if(Triggerbits>=(header_max/2.)):
-                            a = DAC
-                        else:
-                            b = DAC
+                for first_line, text_list in fpga_data:
+                    header_max = int(first_line[4])
+                    FPGA_state = text_list[0]
+                    line_DAC = int(text_list[-1])
+                    # if(FPGA_state==0 or line_DAC!=DAC):
+                    if(FPGA_state==0 or line_DAC==-1):
+                        continue_flag=True
+                        continue
+                    # Condition handling for Binary Search
+                    # TDC_data = int(text_list[3])
+                    # if(TDC_data>=header_max/2.):
+                    if(triggerbit):
+                        Triggerbits = int(text_list[-2])
+                    else:
+                        Triggerbits = int(text_list[3])
+                    # print(a,b,header_max,Triggerbits,Triggerbits>=(header_max/2.),line_DAC)
+                    if(Triggerbits>=(header_max/2.)):
+                        a = DAC
+                    else:
+                        b = DAC
                 if(continue_flag): continue
         i2c_conn.disable_pixel(row=row, col=col, verbose=verbose, chip_address=chip_address, chip=chip)
         if(verbose): print(f"Turn-Off points for Pixel ({row},{col}) for chip {hex(chip_address)} were found")
-        del parser, IPC_queue, process
 
 def charge_peakDAC_plot(i2c_conn: i2c_connection, chip_address, chip_figtitle, chip_figname, scan_list, QInjEns, attempt='', today='', tag=''):
     root = '../ETROC-Data'
@@ -1715,34 +1800,27 @@ def charge_peakDAC_plot(i2c_conn: i2c_connection, chip_address, chip_figtitle, c
     plt.close()
     del QInj_Peak_DAC_map
 
-def run_daq(timePerPixel, deadTime, dirname, s_flag, d_flag, a_flag, p_flag, today="test", hostname = "192.168.2.3", run_options="--compressed_translation --skip_binary", ssd_path = "/run/media/daq/T7/"):
+def run_daq(timePerPixel, deadTime, dirname, s_flag, d_flag, a_flag, p_flag, today="test", hostname = "192.168.2.3", run_options="--compressed_translation --skip_binary", ssd_path = "/run/media/daq/T7/", daq_worker: DAQWorker = None):
 
     total_scan_time = timePerPixel + deadTime
-
-    parser = parser_arguments.create_parser()
-    (options, args) = parser.parse_args(args=f"-f --useIPC --hostname {hostname} -t {int(total_scan_time)} -o {dirname} -v -w -s {s_flag} -p {p_flag} -d {d_flag} -a {a_flag} --start_DAQ_pulse --stop_DAQ_pulse --check_valid_data_start {run_options} --ssd_path {ssd_path} --run_name {today}".split())
-    IPC_queue = multiprocessing.Queue()
-    process = multiprocessing.Process(target=run_script.main_process, args=(IPC_queue, options, f'main_process'))
-    process.start()
-
-    IPC_queue.put('memoFC Start Triggerbit QInj L1A')
-    while not IPC_queue.empty():
-        pass
-    time.sleep(timePerPixel)
-    IPC_queue.put('stop DAQ')
-    IPC_queue.put('memoFC Triggerbit')
-    while not IPC_queue.empty():
-        pass
-    IPC_queue.put('allow threads to exit')
-
-    process.join()
+    # scans pass their worker, so that the FPGA is only configured for the first point
+    if daq_worker is None:
+        daq_worker = get_daq_worker()
+
+    daq_worker.run(
+        f"--useIPC -t {int(total_scan_time)} -o {dirname} -v -w --start_DAQ_pulse --stop_DAQ_pulse --check_valid_data_start {run_options} --ssd_path {ssd_path} --run_name {today}",
+        f'main_process',
+        firmware=f"--hostname {hostname} -s {s_flag} -p {p_flag} -d {d_flag} -a {a_flag}",
+        ipc_commands=['memoFC Start Triggerbit QInj L1A'],
+        run_time=timePerPixel,
+        stop_commands=['stop DAQ', 'memoFC Triggerbit'],
+    )
 
 def full_scurve_scan(i2c_conn: i2c_connection, chip_address, chip_figname, s_flag, d_flag, a_flag, p_flag, scan_list, verbose=False, QInjEns=[27], pedestal_scan_step=1, attempt='', tp_tag='', today='', allon=False, neighbors=False, hostname = "192.168.2.3", power_mode="high", upperlimit_turnoff=-1,timePerPixel=2, deadTime=1, run_options="--compressed_translation --skip_binary", ssd_path = "", BL_offset=5):
     if(ssd_path==""):
         root = '../ETROC-Data'
     else:
         root = ssd_path
-    file_pattern = "*FPGA_Data.dat"
     scan_name = chip_figname+"_VRef_SCurve_TDC"
     BL_map_THCal,NW_map_THCal,_,_ = i2c_conn.get_auto_cal_maps(chip_address)
 
@@ -1753,6 +1831,7 @@ def full_scurve_scan(i2c_conn: i2c_connection, chip_address, chip_figname, s_fla
     base_dir.mkdir(exist_ok=True)
 
     chip: i2c_gui2.ETROC2_Chip = i2c_conn.get_chip_i2c_connection(chip_address)
+    daq_worker = get_daq_worker()
 
     if(allon):
         for first_idx in tqdm(range(16), leave=False):
@@ -1775,20 +1854,9 @@ def full_scurve_scan(i2c_conn: i2c_connection, chip_address, chip_figname, s_fla
         # for QInj in tqdm(QInjEns, desc=f'QInj Loop for Chip {hex(chip_address)} Pixel ({row},{col})', leave=False):
         for QInj in QInjEns:
             turning_point = -1
-            path_pattern = f"*{today}_Array_Test_Results/"+chip_figname+"_VRef_SCurve_BinarySearch_TurnOff"+f'_Pixel_C{col}_R{row}_QInj_{QInj}'+tp_tag
-            file_list = []
-            for path, subdirs, files in os.walk(root):
-                if not fnmatch(path, path_pattern): continue
-                for name in files:
-                    pass
-                    if fnmatch(name, file_pattern):
-                        file_list.append(os.path.join(path, name))
-            for file_index, file_name in enumerate(file_list):
-                with open(file_name) as infile:
-                    last_line = infile.readlines()[-1]
-                    text_list = last_line.split(',')
-                    DAC = int(text_list[-1])
-                    turning_point = DAC
+            for _, text_list in read_fpga_data(base_dir / (chip_figname+"_VRef_SCurve_BinarySearch_TurnOff"+f'_Pixel_C{col}_R{row}_QInj_{QInj}'+tp_tag)):
+                DAC = int(text_list[-1])
+                turning_point = DAC
             if(isinstance(upperlimit_turnoff,int) and upperlimit_turnoff>0):
                 if(turning_point>1000): turning_point = upperlimit_turnoff
             if(isinstance(upperlimit_turnoff,dict)):
@@ -1805,7 +1873,7 @@ def full_scurve_scan(i2c_conn: i2c_connection, chip_address, chip_figname, s_fla
                 i2c_conn.pixel_decoded_register_write("DAC", format(threshold, '010b'), chip=chip)
                 # TH = i2c_conn.pixel_decoded_register_read("TH", "Status", pixel_connected_chip, need_int=True)
                 threshold_name = scan_name+f'_Pixel_C{col}_R{row}_QInj_{QInj}_Threshold_{threshold}'+attempt
-                run_daq(timePerPixel=timePerPixel, deadTime=deadTime, dirname=threshold_name, today=todaystub, s_flag=s_flag, d_flag=d_flag, a_flag=a_flag, p_flag=p_flag, hostname=hostname,run_options=run_options, ssd_path=os.path.abspath(Path(root)))
+                run_daq(timePerPixel=timePerPixel, deadTime=deadTime, dirname=threshold_name, today=todaystub, s_flag=s_flag, d_flag=d_flag, a_flag=a_flag, p_flag=p_flag, hostname=hostname,run_options=run_options, ssd_path=os.path.abspath(Path(root)), daq_worker=daq_worker)
 
         # Disable
         if(not allon):
@@ -1855,104 +1923,98 @@ def make_scurve_plot(QInjEns, scan_list, array, chip_figtitle, chip_figname, y_l
     plt.savefig(fig_path+"/"+chip_figname+save_name+"_"+datetime.datetime.now().strftime("%Y-%m-%d_%H-%M")+".png")
     plt.close()
 
-def process_scurves(chip_figtitle, chip_figname, QInjEns, scan_list, today='',attempt=""):
+def read_nem_hits(file_name, use_cache=True):
+    '''
+    TOA, TOT and CAL of all data ("D") lines of a translated .nem file, as int32 arrays.
+    The D lines are handed to the C tokenizer of pandas in one go. With use_cache, the columns
+    are kept in a .npz file next to the .nem file and reused as long as the mtime and size match.
+    '''
+    stat = os.stat(file_name)
+    cache_name = file_name + '.npz'
+    if use_cache and os.path.isfile(cache_name):
+        try:
+            with np.load(cache_name) as cache:
+                if cache['mtime_ns'] == stat.st_mtime_ns and cache['size'] == stat.st_size:
+                    return {key: cache[key] for key in ['TOA', 'TOT', 'CAL']}
+        except Exception:
+            pass
+    with open(file_name, 'rb') as infile:
+        data_lines = [line for line in infile.read().splitlines() if line.startswith(b'D ')]
+    if len(data_lines) > 0:
+        data = pandas.read_csv(io.BytesIO(b'\n'.join(data_lines)), sep=' ', header=None, usecols=[5, 6, 7], dtype=np.int32, engine='c').to_numpy()
+    else:
+        data = np.zeros((0, 3), dtype=np.int32)
+    hits = {'TOA': data[:, 0], 'TOT': data[:, 1], 'CAL': data[:, 2]}
+    if use_cache:
+        try:
+            np.savez(cache_name, mtime_ns=stat.st_mtime_ns, size=stat.st_size, **hits)
+        except OSError:
+            pass
+    return hits
+
+def _nem_file_stats(args):
+    file_name, use_cache = args
+    hits = read_nem_hits(file_name, use_cache=use_cache)
+    n_hits = len(hits['CAL'])
+    sums = [int(hits[key].sum(dtype=np.int64)) for key in ['CAL', 'TOA', 'TOT']]
+    sums_sq = [int(np.dot(hits[key].astype(np.int64), hits[key])) for key in ['CAL', 'TOA', 'TOT']]
+    return n_hits, sums, sums_sq
+
+def process_scurves(chip_figtitle, chip_figname, QInjEns, scan_list, today='',attempt="", workers=None, use_cache=True):
     if(today==''): today = datetime.date.today().isoformat()
-    scan_name = f"*{today}_Array_Test_Results/"+chip_figname+"_VRef_SCurve_TDC"
     root = '../ETROC-Data'
-    file_pattern = "*translated_[0-9]*.nem"
-    path_pattern = f"*{scan_name}*{attempt}*"
-    file_list = []
-    for path, subdirs, files in os.walk(root):
-        if not fnmatch(path, path_pattern): continue
-        for name in files:
-            pass
-            if fnmatch(name, file_pattern):
-                file_list.append(os.path.join(path, name))
-                print(file_list[-1])
-    hit_counts = return_empty_list(QInjEns, scan_list)
-    # hit_counts_exc = return_empty_list(QInjEns, scan_list)
-    CAL_sum = return_empty_list(QInjEns, scan_list)
-    CAL_sum_sq = return_empty_list(QInjEns, scan_list)
-    TOA_sum = return_empty_list(QInjEns, scan_list)
-    TOA_sum_sq = return_empty_list(QInjEns, scan_list)
-    TOT_sum = return_empty_list(QInjEns, scan_list)
-    TOT_sum_sq = return_empty_list(QInjEns, scan_list)
+    file_list = [str(f) for f in Path(root).glob(f"*{today}_Array_Test_Results/{chip_figname}_VRef_SCurve_TDC*{attempt}*/*translated_[0-9]*.nem")]
+    path_offset = attempt.split("_")
+    path_offset = np.array([len(po) for po in path_offset])
+    path_offset = len(path_offset[path_offset>0])
+    points = []
+    point_files = []
+    for file_name in file_list:
+        name_list = file_name.split('/')[-2].split('_')
+        col = int(name_list[-6-path_offset][1:])
+        row = int(name_list[-5-path_offset][1:])
+        QInj = int(name_list[-3-path_offset])
+        DAC = int(name_list[-1-path_offset])
+        if((row,col) not in scan_list): continue
+        if(QInj not in QInjEns): continue
+        points.append((row, col, QInj, DAC))
+        point_files.append(file_name)
+
+    # parse the files in parallel, every file only returns its hit count, sums and sums of squares
+    if workers is None:
+        workers = min(len(point_files), os.cpu_count())
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            stats_list = pool.map(_nem_file_stats, [(f, use_cache) for f in point_files], chunksize=max(1, len(point_files)//(4*workers)))
+    else:
+        stats_list = [_nem_file_stats((f, use_cache)) for f in point_files]
+
+    # several files of the same scan point are added up
+    point_keys, point_index = np.unique(np.array(points, dtype=np.int64).reshape(-1, 4), axis=0, return_inverse=True)
+    point_index = point_index.reshape(-1)
+    hit_counts_arr = np.zeros(len(point_keys), dtype=np.int64)
+    sums_arr = np.zeros((len(point_keys), 3), dtype=np.float64)
+    sums_sq_arr = np.zeros((len(point_keys), 3), dtype=np.float64)
+    if len(stats_list) > 0:
+        n_hits, sums, sums_sq = zip(*stats_list)
+        np.add.at(hit_counts_arr, point_index, n_hits)
+        np.add.at(sums_arr, point_index, np.array(sums, dtype=np.float64))
+        np.add.at(sums_sq_arr, point_index, np.array(sums_sq, dtype=np.float64))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_arr = sums_arr/hit_counts_arr[:, None]
+        std_arr = np.sqrt(sums_sq_arr/hit_counts_arr[:, None] - mean_arr**2)
+
     CAL_mean = return_empty_list(QInjEns, scan_list)
     CAL_std = return_empty_list(QInjEns, scan_list)
     TOA_mean = return_empty_list(QInjEns, scan_list)
     TOA_std = return_empty_list(QInjEns, scan_list)
     TOT_mean = return_empty_list(QInjEns, scan_list)
     TOT_std = return_empty_list(QInjEns, scan_list)
-    path_offset = attempt.split("_")
-    path_offset = np.array([len(po) for po in path_offset])
-    path_offset = len(path_offset[path_offset>0])
-    total_files = len(file_list)
-    for file_index, file_name in enumerate(file_list):
-        col = int(file_name.split('/')[-2].split('_')[-6-path_offset][1:])
-        row = int(file_name.split('/')[-2].split('_')[-5-path_offset][1:])
-        QInj = int(file_name.split('/')[-2].split('_')[-3-path_offset])
-        DAC = int(file_name.split('/')[-2].split('_')[-1-path_offset])
-        if((row,col) not in scan_list): continue
-        hit_counts[row, col, QInj][DAC] = 0
-        # hit_counts_exc[row, col, QInj][DAC] = 0
-        CAL_sum[row, col, QInj][DAC] = 0
-        CAL_sum_sq[row, col, QInj][DAC] = 0
-        TOA_sum[row, col, QInj][DAC] = 0
-        TOA_sum_sq[row, col, QInj][DAC] = 0
-        TOT_sum[row, col, QInj][DAC] = 0
-        TOT_sum_sq[row, col, QInj][DAC] = 0
-        CAL_mean[row, col, QInj][DAC] = 0
-        CAL_std[row, col, QInj][DAC] = 0
-        TOA_mean[row, col, QInj][DAC] = 0
-        TOA_std[row, col, QInj][DAC] = 0
-        TOT_mean[row, col, QInj][DAC] = 0
-        TOT_std[row, col, QInj][DAC] = 0
-        with open(file_name) as infile:
-            for line in infile:
-                text_list = line.split()
-                if text_list[0]=="H":
-                    current_bcid = int(text_list[4])
-                if text_list[0]=="T":
-                    previous_bcid = current_bcid
-                if text_list[0]!="D": continue
-                # col = int(text_list[3])
-                # row = int(text_list[4])
-                TOA = int(text_list[5])
-                TOT = int(text_list[6])
-                CAL = int(text_list[7])
-
-                # if(CAL<193 or CAL>196): continue
-                hit_counts[row, col, QInj][DAC] += 1
-                CAL_sum[row, col, QInj][DAC] += CAL
-                CAL_sum_sq[row, col, QInj][DAC] += CAL*CAL
-                # hit_counts_exc[row, col, QInj][DAC] += 1
-                TOA_sum[row, col, QInj][DAC] += TOA
-                TOA_sum_sq[row, col, QInj][DAC] += TOA*TOA
-                TOT_sum[row, col, QInj][DAC] += TOT
-                TOT_sum_sq[row, col, QInj][DAC] += TOT*TOT
-
-    for row, col, QInj in hit_counts:
-        for DAC in hit_counts[row, col, QInj]:
-            if(hit_counts[row, col, QInj][DAC]==0):
-                CAL_mean[row, col, QInj].pop(DAC)
-                CAL_std[row, col, QInj].pop(DAC)
-                TOA_mean[row, col, QInj].pop(DAC)
-                TOA_std[row, col, QInj].pop(DAC)
-                TOT_mean[row, col, QInj].pop(DAC)
-                TOT_std[row, col, QInj].pop(DAC)
-                continue
-            CAL_mean[row, col, QInj][DAC] = CAL_sum[row, col, QInj][DAC]/hit_counts[row, col, QInj][DAC]
-            CAL_std[row, col, QInj][DAC] = np.sqrt((CAL_sum_sq[row, col, QInj][DAC]/hit_counts[row, col, QInj][DAC]) - pow(CAL_mean[row, col, QInj][DAC], 2))
-            # if(CAL_std[row, col, QInj][DAC]<2):
-            TOA_mean[row, col, QInj][DAC] = TOA_sum[row, col, QInj][DAC]/hit_counts[row, col, QInj][DAC]
-            TOA_std[row, col, QInj][DAC] = np.sqrt((TOA_sum_sq[row, col, QInj][DAC]/hit_counts[row, col, QInj][DAC]) - pow(TOA_mean[row, col, QInj][DAC], 2))
-            TOT_mean[row, col, QInj][DAC] = TOT_sum[row, col, QInj][DAC]/hit_counts[row, col, QInj][DAC]
-            TOT_std[row, col, QInj][DAC] = np.sqrt((TOT_sum_sq[row, col, QInj][DAC]/hit_counts[row, col, QInj][DAC]) - pow(TOT_mean[row, col, QInj][DAC], 2))
-            # else:
-            #     TOA_mean[row, col, QInj][DAC] = np.nan
-            #     TOA_std[row, col, QInj][DAC] = np.nan
-            #     TOT_mean[row, col, QInj][DAC] = np.nan
-            #     TOT_std[row, col, QInj][DAC] = np.nan
+    # the keys are sorted, so the DAC values of every curve are in increasing order
+    for (row, col, QInj, DAC), n_hits, mean, std in zip(point_keys.tolist(), hit_counts_arr, mean_arr, std_arr):
+        if(n_hits==0): continue
+        CAL_mean[row, col, QInj][DAC], TOA_mean[row, col, QInj][DAC], TOT_mean[row, col, QInj][DAC] = mean
+        CAL_std[row, col, QInj][DAC], TOA_std[row, col, QInj][DAC], TOT_std[row, col, QInj][DAC] = std
 
     fig_outdir = Path('../ETROC-figures')
     fig_outdir = fig_outdir / (today + '_Array_Test_Results')
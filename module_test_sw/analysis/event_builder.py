@@ -2,7 +2,7 @@
 import os
 import awkward as ak
 import numpy as np
-import json
+from tamalero.utils import read_events
 
 import hist
 import matplotlib.pyplot as plt
@@ -12,6 +12,15 @@ plt.style.use(hep.style.CMS)
 
 here = os.path.dirname(os.path.abspath(__file__))
 
+def hit_map(events, chipid):
+    '''
+    Number of hits per pixel of one module, summed over all events.
+    '''
+    sel = events.chipid == chipid
+    hits = np.zeros([16, 16])
+    np.add.at(hits, (ak.to_numpy(ak.flatten(events.row[sel])), ak.to_numpy(ak.flatten(events.col[sel]))), 1)
+    return hits
+
 if __name__ == '__main__':
 
     mc = LinearSegmentedColormap.from_list("my_colormap", [(1,1,1), (219./255, 58./255, 52./255)])
@@ -22,10 +31,9 @@ if __name__ == '__main__':
     #for i in range(6307,6506):
     #for i in range(5707,6500):
     #for i in range(5707,5708):
-        in_file = f"{here}/../ETROC_output/{i}_merged.json"
-        if os.path.isfile(in_file):
-            with open(in_file, "r") as f:
-                all_events.append(ak.from_json(json.load(f)))
+        in_file = f"{here}/../ETROC_output/{i}_merged.parquet"
+        if os.path.isfile(in_file) or os.path.isfile(in_file.replace('.parquet', '.json')):
+            all_events.append(read_events(in_file, columns=['row', 'col', 'nhits', 'chipid', 'toa_code', 'cal_code']))
         else:
             print(f'Missing file: {in_file}')
 
@@ -46,16 +54,10 @@ if __name__ == '__main__':
     #
 
 
-    hits0 = np.zeros([16, 16])
-    hits1 = np.zeros([16, 16])
-    hits2 = np.zeros([16, 16])
-    for ev in all_layer_hit_candidates[all_layer_hit_candidates_no_noise_selection]:
-        for row, col in zip(ev.row[ev.chipid==(38 << 2)], ev.col[ev.chipid==(38 << 2)]):
-            hits0[row,col]+=1
-        for row, col in zip(ev.row[ev.chipid==(36 << 2)], ev.col[ev.chipid==(36 << 2)]):
-            hits1[row,col]+=1
-        for row, col in zip(ev.row[ev.chipid==(37 << 2)], ev.col[ev.chipid==(37 << 2)]):
-            hits2[row,col]+=1
+    sel_events = all_layer_hit_candidates[all_layer_hit_candidates_no_noise_selection]
+    hits0 = hit_map(sel_events, 38 << 2)
+    hits1 = hit_map(sel_events, 36 << 2)
+    hits2 = hit_map(sel_events, 37 << 2)
 
     fig, ax = plt.subplots(1,3,figsize=(15,5))
     cax = ax[2].matshow(hits0, cmap=mc)
@@ -76,16 +78,10 @@ if __name__ == '__main__':
 
 
     all_layer_hit_candidates_single_pixel = (ak.num(all_layer_hit_candidates.col[((all_layer_hit_candidates.row[all_layer_hit_candidates.chipid==(38<<2)] ==1)&((all_layer_hit_candidates.col[all_layer_hit_candidates.chipid==(38<<2)] ==12)))]) >0)
-    hits0 = np.zeros([16, 16])
-    hits1 = np.zeros([16, 16])
-    hits2 = np.zeros([16, 16])
-    for ev in all_layer_hit_candidates[all_layer_hit_candidates_single_pixel]:
-        for row, col in zip(ev.row[ev.chipid==(38 << 2)], ev.col[ev.chipid==(38 << 2)]):
-            hits0[row,col]+=1
-        for row, col in zip(ev.row[ev.chipid==(36 << 2)], ev.col[ev.chipid==(36 << 2)]):
-            hits1[row,col]+=1
-        for row, col in zip(ev.row[ev.chipid==(37 << 2)], ev.col[ev.chipid==(37 << 2)]):
-            hits2[row,col]+=1
+    sel_events = all_layer_hit_candidates[all_layer_hit_candidates_single_pixel]
+    hits0 = hit_map(sel_events, 38 << 2)
+    hits1 = hit_map(sel_events, 36 << 2)
+    hits2 = hit_map(sel_events, 37 << 2)
 
 
     fig, ax = plt.subplots(1,3,figsize=(15,5))
@@ -1,21 +1,12 @@
 import argparse
-import struct
 import numpy as np
-import awkward as ak
 from tamalero.DataFrame import DataFrame
+from tamalero.utils import merge_words
 
 # DISCLAIMER
 # This is still work in progress, when finalized it should be included in the 
 # data_converter.py script
 
-def merge_words(res):
-    empty_frame_mask = np.array(res[0::2]) > (2**8)  # masking empty fifo entries
-    len_cut = min(len(res[0::2]), len(res[1::2]))  # ensuring equal length of arrays downstream
-    if len(res) > 0:
-        return list (np.array(res[0::2])[:len_cut][empty_frame_mask[:len_cut]] | (np.array(res[1::2]) << 32)[:len_cut][empty_frame_mask[:len_cut]])
-    else:
-        return []
-
 #Define XOR for same length bits 
 def xor(a, b):
     # initialize result
@@ -55,6 +46,101 @@ def mod2div(dividend, divisor):
     crc = tmp
     return crc
 
+CRC_POLY = 0x12F  # crc generator polynomial, '100101111'
+
+# Lookup tables for the CRC of whole frames, see crc_frames
+_crc_tables = {}
+
+def crc_table(poly=CRC_POLY):
+    '''
+    Remainder of b * x^8 modulo the polynomial, for every byte b
+    '''
+    table = np.zeros(256, dtype=np.uint8)
+    for b in range(256):
+        r = b << 8
+        for i in range(15, 7, -1):
+            if r & (1 << i):
+                r ^= poly << (i - 8)
+        table[b] = r
+    return table
+
+def get_crc_tables(n_words, poly=CRC_POLY):
+    '''
+    Returns the byte table, and a table with the remainder of r * x^(40*d) for d < n_words.
+    The tables are cached and extended when needed.
+    '''
+    if poly not in _crc_tables:
+        _crc_tables[poly] = (crc_table(poly), np.arange(256, dtype=np.uint8)[None, :])
+    table, shifts = _crc_tables[poly]
+    if len(shifts) < n_words:
+        # shifting by one 40 bit word is five byte shifts
+        shift40 = np.arange(256, dtype=np.uint8)
+        for i in range(5):
+            shift40 = table[shift40]
+        shifts = list(shifts)
+        while len(shifts) < n_words:
+            shifts.append(shift40[shifts[-1]])
+        shifts = np.array(shifts, dtype=np.uint8)
+        _crc_tables[poly] = (table, shifts)
+    return table, shifts
+
+def crc_frames(words, counts, poly=CRC_POLY):
+    '''
+    Vectorized, table driven version of mod2div for many frames at once.
+    words are the 40 bit words of all frames (header, data and trailer) back to back,
+    counts the number of words of every frame.
+    Returns the remainder of every frame as an array of uint8, i.e. int(mod2div(frame, poly), 2).
+    For frames with the CRC field of the trailer set to zero this is the CRC,
+    for frames with a correct CRC it is zero.
+    '''
+    words = np.asarray(words, dtype=np.uint64) & np.uint64(0xFFFFFFFFFF)
+    counts = np.asarray(counts, dtype=np.int64)
+    res = np.zeros(len(counts), dtype=np.uint8)
+    if len(words) == 0:
+        return res
+    table, shifts = get_crc_tables(int(counts.max()), poly)
+
+    # remainder of every single word, byte by byte starting with the most significant one
+    low = words.astype(np.uint32)
+    rem = (words >> np.uint64(32)).astype(np.uint8)
+    for shift in [24, 16, 8, 0]:
+        rem = table[rem] ^ ((low >> np.uint32(shift)) & np.uint32(0xFF)).astype(np.uint8)
+
+    # shift every word by the number of words that follow it in its frame, and add them up
+    ends = np.cumsum(counts)
+    frame = np.repeat(np.arange(len(counts)), counts)
+    following = ends[frame] - 1 - np.arange(len(words))
+    contributions = shifts[following, rem]
+    filled = counts > 0
+    res[filled] = np.bitwise_xor.reduceat(contributions, (ends - counts)[filled])
+    return res
+
+def check_frames(words, frame_type, frame_types, max_words=257):
+    '''
+    Check the CRC of all frames (header, data, trailer) in a stream of words,
+    with frame_type from DataFrame.read_block and frame_types the list of DataFrame.frame_types.
+    A frame runs from a header to a trailer, fillers in between are ignored.
+    Frames with more than max_words words can't be valid and are not computed.
+    Returns the index of the trailer of every frame, and whether its CRC is correct.
+    '''
+    words = np.asarray(words, dtype=np.uint64)
+    frame_type = np.asarray(frame_type)
+    header, data, trailer = (frame_types.index(t) for t in ['header', 'data', 'trailer'])
+    pos = np.nonzero((frame_type == header) | (frame_type == data) | (frame_type == trailer))[0]
+    ft = frame_type[pos]
+    idx = np.arange(len(pos))
+    last_header = np.maximum.accumulate(np.where(ft == header, idx, -1)) if len(pos) > 0 else idx
+    ends = idx[(ft == trailer) & (last_header >= 0)]
+    starts = last_header[ends]
+    counts = ends - starts + 1
+
+    ok = np.zeros(len(ends), dtype=bool)
+    short = counts <= max_words
+    counts = counts[short]
+    gather = np.repeat(starts[short] - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+    ok[short] = crc_frames(words[pos[gather]], counts) == 0
+    return pos[ends], ok
+
 if __name__ == '__main__':
 
     argParser = argparse.ArgumentParser(description = "Argument parser")
@@ -65,23 +151,8 @@ if __name__ == '__main__':
 
     with open(args.input, 'rb') as f:
         bin_data = f.read()
-        raw_data = struct.unpack('<{}I'.format(int(len(bin_data)/4)), bin_data)
-
-    merged_data = merge_words(raw_data)
-    #handy functions
-    etrocmask = np.vectorize(lambda x : x & 0xFFFFFFFFFF) #mask 64 bits words to 40bits
-    hexstr5=np.vectorize(lambda x: f'{x:05x}') #40bits 5 hex
-    binstr40=np.vectorize(lambda x: f'{x:040b}') #40bits
-    words = ak.Array(hexstr5(etrocmask(merged_data)))
-    bitwords = ak.Array(binstr40(etrocmask(merged_data)))
-    #FIXME vectorize this abomination
-    header_idx=[]
-    for i,word in enumerate(words):
-        if '3c5c' in word: header_idx.append(i)
-    header_idx.append(len(words))
-    dataframes = ak.unflatten(words,np.diff(header_idx))
-    bitframes = ak.unflatten(bitwords,np.diff(header_idx))
-    
-    merged_frames = ["".join(x) for x in bitframes]
-    poly = '100101111'
-    crc_checks = np.array([mod2div(frame,poly) for frame in merged_frames])
+
+    merged_data = merge_words(bin_data, empty=2**8)
+    block = df.read_block(merged_data)
+    trailers, crc_ok = check_frames(merged_data, block['frame_type'], df.frame_types)
+    print(f"Checked {len(crc_ok)} frames, {np.sum(~crc_ok)} of them have a wrong CRC.")
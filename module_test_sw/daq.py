@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
-import struct
 import os
+import sys
 import uhal
 import argparse
 import time
+import queue
+from array import array
+from threading import Thread, Condition
 from tamalero.utils import get_kcu
+from run_notify import notify_run_done
 from yaml import load, dump
 try:
     from yaml import CLoader as Loader, CDumper as Dumper
@@ -39,6 +43,128 @@ def stream_daq_multi(fun, args):
     t.start()
     return mon
 
+class StreamWriter:
+    '''
+    Writes the raw 32-bit words of a DAQ stream to disk from a background thread.
+    The DAQ loop hands over FIFO reads with put(), the words are written in chunks of chunk_size words.
+    At most max_queue bytes are queued, if the disk can't keep up put() waits for the writer
+    and a warning is printed the first time this happens.
+    With max_size (in bytes) or max_time (in seconds) set, a new file
+    <f_out>.part<i> is started whenever the current one gets too big or too old.
+    The suffix keeps the parts out of the rb* glob of data_dumper, which reads them
+    back as one continuous stream together with <f_out>.
+    '''
+    def __init__(self, f_out, chunk_size=2**18, max_queue=2**23, max_size=None, max_time=None):
+        self.f_out = f_out
+        self.chunk_size = chunk_size
+        self.max_queue = max_queue
+        self.max_size = max_size
+        self.max_time = max_time
+        self.files = []
+        self.n_words = 0
+        self.n_queue_full = 0
+        self.error = None
+        self.buffer = array('I')
+        self.queue = queue.Queue()
+        self.queued_bytes = 0
+        self.queue_cond = Condition()
+        self.open_file()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def open_file(self):
+        if len(self.files) == 0:
+            name = self.f_out
+        else:
+            name = f'{self.f_out}.part{len(self.files)}'
+        self.f = open(name, mode="wb")
+        self.files.append(name)
+        self.file_start = time.time()
+        self.file_size = 0
+
+    def put(self, read):
+        '''
+        read: list of words, or a uhal ValVector that has already been dispatched
+        '''
+        n_bytes = 4*len(read)
+        with self.queue_cond:
+            if self.queue_full(n_bytes):
+                # the disk can't keep up, wait for the writer rather than dropping data
+                self.n_queue_full += 1
+                if self.n_queue_full == 1:
+                    print(f"Warning: writing to disk can't keep up with the DAQ, waiting for {self.queued_bytes} queued bytes to be written")
+                while self.queue_full(n_bytes):
+                    self.queue_cond.wait()
+            if self.error is not None:
+                raise self.error
+            self.queued_bytes += n_bytes
+        self.queue.put(read)
+
+    def queue_full(self, n_bytes):
+        # a single read bigger than max_queue still goes through once the queue is empty
+        return self.error is None and self.queued_bytes > 0 and self.queued_bytes + n_bytes > self.max_queue
+
+    def rotation_due(self):
+        return (self.max_size is not None and self.file_size >= self.max_size) or \
+               (self.max_time is not None and time.time() - self.file_start >= self.max_time)
+
+    def run(self):
+        try:
+            while True:
+                try:
+                    read = self.queue.get(timeout=1)
+                except queue.Empty:
+                    # nothing coming in, but time based rotation still has to happen
+                    if self.rotation_due():
+                        self.write_buffer()
+                    continue
+                if read is None:
+                    break
+                self.buffer.extend(read if isinstance(read, list) else read.value())
+                with self.queue_cond:
+                    self.queued_bytes -= 4*len(read)
+                    self.queue_cond.notify_all()
+                if len(self.buffer) >= self.chunk_size or self.rotation_due():
+                    self.write_buffer()
+            self.write_buffer(rotate=False)
+        except Exception as e:
+            with self.queue_cond:
+                # wake up put(), which raises the error
+                self.error = e
+                self.queue_cond.notify_all()
+        finally:
+            self.f.close()
+
+    def write_buffer(self, rotate=True):
+        if len(self.buffer) > 0:
+            if sys.byteorder != 'little':
+                self.buffer.byteswap()
+            self.f.write(self.buffer.tobytes())
+            self.f.flush()
+            self.n_words += len(self.buffer)
+            self.file_size += 4*len(self.buffer)
+            self.buffer = array('I')
+        if rotate and self.file_size > 0 and self.rotation_due():
+            self.f.close()
+            self.open_file()
+
+    def close(self):
+        '''
+        Write everything that is still queued, and wait for the writer thread to finish.
+        '''
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.files
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 def get_kcu_flag(lock=os.path.expandvars('../ScopeHandler/Lecroy/Acquisition/running_acquitision.txt')):
     # NOTE where to put the locks?
     with open(lock) as f:
@@ -61,7 +187,14 @@ def get_occupancy(hw, rb):
         occ = 0
     return occ * 4  # not sure where the factor of 4 comes from, but it's needed
 
-def stream_daq(kcu=None, rb=0, l1a_rate=0, run_time=10, n_events=1000, superblock=100, block=128, run=1, ext_l1a=False, lock=None, verbose=False):
+def stream_daq(kcu=None, rb=0, l1a_rate=0, run_time=10, n_events=1000, superblock=100, block=128, run=1, ext_l1a=False, lock=None, verbose=False, max_file_size=None, max_file_time=None, run_done=True):
+    '''
+    Data is streamed to disk while it is taken, see StreamWriter.
+    max_file_size (bytes) and max_file_time (seconds) optionally start a new output file.
+    run_done=True marks the run as done in daq_log.txt at the end. When several readout boards
+    take data in the same run, pass False and call write_run_done once all of them are finished,
+    otherwise the run gets processed while the other boards are still writing.
+    '''
     uhal.disableLogging()
     hw = kcu.hw
     rate_setting = l1a_rate / 25E-9 / (0xffffffff) * 10000
@@ -90,15 +223,11 @@ def stream_daq(kcu=None, rb=0, l1a_rate=0, run_time=10, n_events=1000, superbloc
     log = {}
     start = time.time()
     log['start_time'] = start
-    len_data = 0
-    data = []
     occupancy = 0
     f_out = f"ETROC_output/output_run_{run}_rb{rb}.dat"
     log_out = f"ETROC_output/log_run_{run}_rb{rb}.yaml"
     #f_out = f"output/output_rb_{rb}_run_{run}_time_{start}.dat"  # USED TO BE THIS, keeping for reference and debugging
-    occupancy_block = []
-    reads = []
-    with open(f_out, mode="wb") as f:
+    with StreamWriter(f_out, max_size=max_file_size, max_time=max_file_time) as writer:
         if lock is not None:
             # External lock file based DAQ
             iteration = 0
@@ -116,26 +245,25 @@ def stream_daq(kcu=None, rb=0, l1a_rate=0, run_time=10, n_events=1000, superbloc
                 num_blocks_to_read = 0
                 occupancy = get_occupancy(hw, rb)
                 num_blocks_to_read = occupancy // block
-                occupancy_block.append(num_blocks_to_read)
 
                 # read the blocks
                 if (num_blocks_to_read)>0:
                     try:
                         for x in range(num_blocks_to_read):
-                            reads += [hw.getNode(f"DAQ_RB{rb}").readBlock(block)]
+                            read = hw.getNode(f"DAQ_RB{rb}").readBlock(block)
                             hw.dispatch()  # NOTE this is necessary
+                            writer.put(read)
                     except uhal._core.exception:
                         print("uhal UDP error in reading FIFO")
 
         else:
             while (start + run_time > time.time()):
                 # Time based DAQ
-                # We read the data into memory (small)
-                # and write to disk once we're done
+                # The data is handed to the writer thread,
+                # which writes it to disk in chunks
                 num_blocks_to_read = 0
                 occupancy = get_occupancy(hw, rb)
                 num_blocks_to_read = occupancy // block
-                occupancy_block.append(num_blocks_to_read)
 
                 # read the blocks
                 if (num_blocks_to_read)>0:
@@ -143,8 +271,9 @@ def stream_daq(kcu=None, rb=0, l1a_rate=0, run_time=10, n_events=1000, superbloc
                     #    print(occupancy, num_blocks_to_read)
                     try:
                         for x in range(num_blocks_to_read):
-                            reads += [hw.getNode(f"DAQ_RB{rb}").readBlock(block)]
+                            read = hw.getNode(f"DAQ_RB{rb}").readBlock(block)
                             hw.dispatch()  # NOTE this is necessary
+                            writer.put(read)
                     except uhal._core.exception:
                         print("uhal UDP error in reading FIFO")
 
@@ -160,17 +289,15 @@ def stream_daq(kcu=None, rb=0, l1a_rate=0, run_time=10, n_events=1000, superbloc
         remainder = occupancy % block
         if (num_blocks_to_read)>0:
             for x in range(num_blocks_to_read):
-                reads += [hw.getNode(f"DAQ_RB{rb}").readBlock(block)]
+                read = hw.getNode(f"DAQ_RB{rb}").readBlock(block)
                 hw.dispatch()
-            reads += [hw.getNode(f"DAQ_RB{rb}").readBlock(remainder)]
+                writer.put(read)
+            read = hw.getNode(f"DAQ_RB{rb}").readBlock(remainder)
         else:
-            reads += [hw.getNode(f"DAQ_RB{rb}").readBlock(occupancy)]
+            read = hw.getNode(f"DAQ_RB{rb}").readBlock(occupancy)
 
         hw.dispatch()
-        for i, read in enumerate(reads):
-            data+= read.value()
-
-        len_data += len(data)
+        writer.put(read)
         # The two prints below can be useful to check if we miss the first or last event
         # when we convert in the following steps
         #print(data[:10])
@@ -183,17 +310,20 @@ def stream_daq(kcu=None, rb=0, l1a_rate=0, run_time=10, n_events=1000, superbloc
             num_blocks_to_read = occupancy // block
             last_block = occupancy % block
             if (num_blocks_to_read or last_block):
-                reads = []
                 for x in range(num_blocks_to_read):
-                    reads += [hw.getNode(f"DAQ_RB{rb}").readBlock(block)]
+                    read = hw.getNode(f"DAQ_RB{rb}").readBlock(block)
                     hw.dispatch()
-                reads += [hw.getNode(f"DAQ_RB{rb}").readBlock(last_block)]
+                    writer.put(read)
+                read = hw.getNode(f"DAQ_RB{rb}").readBlock(last_block)
                 hw.dispatch()
-                for read in reads:
-                    data += read.value()
+                writer.put(read)
             occupancy = get_occupancy(hw, rb)
 
-        len_data += len(data)
+        # Everything has been handed over, wait for the last chunk to be written
+        files = writer.close()
+        len_data = writer.n_words
+        if writer.n_queue_full > 0:
+            print(f"Writing to disk could not keep up with the DAQ {writer.n_queue_full} times")
 
         # Get some stats
         timediff = time.time() - start
@@ -217,9 +347,6 @@ def stream_daq(kcu=None, rb=0, l1a_rate=0, run_time=10, n_events=1000, superbloc
         print("Packet rate = %d Hz" % rate_log)
         print("Speed = %f Mbps" % speed)
 
-        # Actually write to disk
-        f.write(struct.pack('<{}I'.format(len(data)), *data))
-
     hw.getClient().write(hw.getNode(f"READOUT_BOARD_{rb}.FIFO_RESET").getAddress(), 0x1)
     hw.dispatch()
 
@@ -234,13 +361,15 @@ def stream_daq(kcu=None, rb=0, l1a_rate=0, run_time=10, n_events=1000, superbloc
     log['lost_events'] = lost_events
     log['rate'] = rate_log
     log['speed'] = speed
+    log['files'] = files
     log['stop_time'] = time.time()
 
     with open(log_out, 'w') as f:
         dump(log, f)
 
     print(f"Data stored in {f_out}\n")
-    write_run_done(run=run)
+    if run_done:
+        write_run_done(run=run)
 
     return f_out
 
@@ -254,6 +383,8 @@ if __name__ == '__main__':
     argParser.add_argument('--n_events', action='store', default=1000, type=int, help="N events")
     argParser.add_argument('--lock', action='store', default=None, help="Lock file for the scope acquisition status (relative or absolute path)")
     argParser.add_argument('--run', action='store', default=1, type=int, help="Run number")
+    argParser.add_argument('--max_file_size', action='store', default=None, type=float, help="Start a new output file after this many MB")
+    argParser.add_argument('--max_file_time', action='store', default=None, type=float, help="Start a new output file after this many seconds")
     args = argParser.parse_args()
 
     start_time = time.time()
@@ -297,6 +428,9 @@ if __name__ == '__main__':
                     'ext_l1a':args.ext_l1a,
                     'lock': args.lock,
                     'verbose': True,
+                    'max_file_size': args.max_file_size*1E6 if args.max_file_size is not None else None,
+                    'max_file_time': args.max_file_time,
+                    'run_done': False,
                 },
             )
         )
@@ -308,6 +442,9 @@ if __name__ == '__main__':
        # stream_0._running or stream_1._running:
         time.sleep(1)
     print("Done with all streams")
+    write_run_done(run=args.run)
+    # start the processing right away, if processing_pipeline is running
+    notify_run_done(args.run)
 
     print(f"Run {args.run} has ended.")
     ## NOTE this would be the place to also dump the ETROC configs
@@ -1,19 +1,10 @@
 #!/usr/bin/env python3
-import struct
 import argparse
 import numpy as np
 import pandas as pd
 import awkward as ak
-# from tamalero.FIFO import merge_words
 from tamalero.DataFrame import DataFrame
-
-def merge_words(res): #TODO: Does this need to be it's own definition here, or can we use the one from tamalero.FIFO
-    empty_frame_mask = np.array(res[0::2]) > (2**8)  # masking empty fifo entries
-    len_cut = min(len(res[0::2]), len(res[1::2]))  # ensuring equal length of arrays downstream
-    if len(res) > 0:
-        return list (np.array(res[0::2])[:len_cut][empty_frame_mask[:len_cut]] | (np.array(res[1::2]) << 32)[:len_cut][empty_frame_mask[:len_cut]])
-    else:
-        return []
+from tamalero.utils import merge_words
 
 def event_merger(window_df,merged_idx):
     # Removing events that have been merged already from current window
@@ -61,9 +52,8 @@ if __name__ == '__main__':
     with open(args.input, 'rb') as f:
         print("Reading from {}".format(args.input))
         bin_data = f.read()
-        raw_data = struct.unpack('<{}I'.format(int(len(bin_data)/4)), bin_data)
 
-    merged_data = merge_words(raw_data)
+    merged_data = merge_words(bin_data, empty=2**8)
     unpacked_data = [ df.read(x) for x in merged_data ]
 
     import time
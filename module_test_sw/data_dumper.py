@@ -420,261 +420,420 @@
 
 
 #!/usr/bin/env python3
-import struct
 import argparse
+from collections import deque
 import numpy as np
 import pandas as pd
 import awkward as ak
-import json
+import pyarrow as pa
 import yaml
 from yaml import Dumper, Loader
 from tamalero.DataFrame import DataFrame
+from tamalero.utils import write_events, read_events, WordMerger, EventWriter, merge_rb_events
+from crcETROC import check_frames
 from emoji import emojize
 import os
 import glob
-
-def merge_words(res):
-    empty_frame_mask = np.array(res[0::2]) > (2**8)  # masking empty fifo entries
-    len_cut = min(len(res[0::2]), len(res[1::2]))  # ensuring equal length of arrays downstream
-    if len(res) > 0:
-        return list (np.array(res[0::2])[:len_cut][empty_frame_mask[:len_cut]] | (np.array(res[1::2]) << 32)[:len_cut][empty_frame_mask[:len_cut]])
-    else:
-        return []
-
-def data_dumper(
-        input_file,
-        #output_file,
-        verbose=False,
-        skip_trigger_check=False,
-        force=False,
-):
-    # NOTE find all files (i.e. layers) for the specified input file
-    df = DataFrame('ETROC2')
-
-    events_all_rb = []
-    all_runs_good = True
-    missing_l1counter = []
-
-    in_files = glob.glob(input_file.replace('rb0', 'rb*'))
-    print(in_files)
-    out_files = [x.replace('.dat', '.json') for x in in_files]
-
-    for irb, f_in in enumerate(in_files):
-        #f_in = f'{here}/ETROC_output/output_run_{args.input}_rb{rb}.dat'
-        with open(f_in, 'rb') as f:
-            print("Reading from {}".format(f_in))
-            bin_data = f.read()
-            raw_data = struct.unpack('<{}I'.format(int(len(bin_data)/4)), bin_data)
-
-        merged_data = merge_words(raw_data)
-        unpacked_data = map(df.read, merged_data)
-
-        event       = []
-        counter_h   = []  # double check the number of headers
-        counter_t   = []  # double check the number of trailers
-        l1counter   = []
-        row         = []
-        col         = []
-        tot_code    = []
-        toa_code    = []
-        cal_code    = []
-        elink       = []
-        raw         = []
-        nhits       = []
-        nhits_trail = []
-        chipid      = []
-        crc         = []
-        bcid        = []
-        counter_a   = []
-
-        header_counter = 0
-        trailer_counter = 0
-
-        headers = []
-        trailers = []
-        i = 0
-        l1a = -1
-        bcid_t = 9999
-        skip_event = False
-        skip_counter = 0
-        bad_run = False
-        last_missing = False
-        elink_report = {}
-
-        uuid = []
-        all_raw = []
-
-        t_tmp = None
-
-        for t, d in unpacked_data:
-            if d['elink'] not in elink_report:
-                elink_report[d['elink']] = {'nheader':0, 'nhits':0, 'ntrailer':0}
-            sus = False
-            if d['raw_full'] in all_raw[-50:] and not t in ['trailer', 'filler']:  # trailers often look the same
-                #print("Potential double counting", t, d)
-                #all_raw.append(d['raw_full'])
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+class EventBuilder:
+    '''
+    Builds events from the merged words of one readout board.
+    The words are decoded block by block with DataFrame.read_block, the state machine
+    only decides which event every word belongs to, and the event columns are gathered
+    from the decoded blocks in one go in pop_events.
+    '''
+    HEADER_NEW = 1    # first header of an event
+    HEADER_EXTRA = 2  # additional headers (other ETROCs) with the same L1A counter
+    HIT = 3
+    TRAILER = 4
+
+    def __init__(self, df, verbose=False, skip_trigger_check=False, word_window=50, event_window=150, max_hits=256):
+        self.df = df
+        self.verbose = verbose
+        self.skip_trigger_check = skip_trigger_check
+        self.event_window = event_window
+        self.max_hits = max_hits
+
+        self.n_events = 0
+        self.header_counter = 0
+        self.trailer_counter = 0
+        self.skip_counter = 0
+        self.missing_l1counter = []
+        self.elink_report = {}
+
+        # state of the event building
+        self.l1a = -1
+        self.bcid_t = 9999
+        self.skip_event = False
+        self.last_missing = False
+        self.hit_counter = 0
+        self.nhits = 0
+        self.t_tmp = None
+
+        # the last non trailer / filler words, to catch words that are read twice
+        self.recent_words = deque(maxlen=word_window)
+        self.recent_count = {}
+        # position of the last occurrence of every (L1A counter, BCID) in the list of accepted headers
+        self.uuid = {}
+        self.n_uuid = 0
+        self.n_popped = 0
+
+        # words of the frame that is still open at the end of a block, for the CRC check
+        self.open_frame = (np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int8))
+        self.crc_error_counter = 0
+
+        self.blocks = []
+
+    def add(self, words):
+        '''
+        Run the state machine over a block of merged words.
+        '''
+        block = self.df.read_block(words)
+        n = len(block['raw'])
+        types = self.df.frame_types
+        HEADER, DATA, TRAILER, FILLER = (types.index(t) for t in ['header', 'data', 'trailer', 'filler'])
+
+        # every word gets the event it belongs to and its role in that event
+        owner = np.full(n, -1, dtype=np.int64)
+        role = np.zeros(n, dtype=np.int8)
+        trailer_hits = np.zeros(n, dtype=np.int64)
+        duplicate = np.zeros(n, dtype=bool)
+
+        recent_words = self.recent_words
+        recent_count = self.recent_count
+        word_window = recent_words.maxlen
+        uuid = self.uuid
+        l1counter = block['l1counter'].tolist()
+        bcid = block['bcid'].tolist()
+
+        n_events = self.n_events
+        l1a = self.l1a
+        bcid_t = self.bcid_t
+        skip_event = self.skip_event
+        last_missing = self.last_missing
+        hit_counter = self.hit_counter
+        nhits = self.nhits
+        t_tmp = self.t_tmp
+
+        for k, (t, word) in enumerate(zip(block['frame_type'].tolist(), np.asarray(words, dtype=np.uint64).tolist())):
+            if t < 0:
                 continue
-            if t not in ['trailer', 'filler']:
-                all_raw.append(d['raw_full'])
-
-            if t == 'header':
-                elink_report[d['elink']]['nheader'] += 1
+            if t != TRAILER and t != FILLER:  # trailers often look the same
+                if word in recent_count:
+                    duplicate[k] = True
+                    continue
+                if len(recent_words) == word_window:
+                    old = recent_words[0]
+                    recent_count[old] -= 1
+                    if recent_count[old] == 0:
+                        del recent_count[old]
+                recent_words.append(word)
+                recent_count[word] = recent_count.get(word, 0) + 1
+
+            if t == HEADER:
                 hit_counter = 0
-                uuid_tmp = d['l1counter'] | d['bcid']<<8
-                headers.append(d['raw'])
-                header_counter += 1
-                #if (abs(d['bcid']-bcid_t)<50) and (d['bcid'] - bcid_t)>0 and not (d['bcid'] == bcid_t):
-                #    skip_event = True
-                #    print("Skipping event")
-                #    continue
-                if d['bcid'] != bcid_t and last_missing:
-                    missing_l1counter[-1].append(d['bcid'])
+                self.header_counter += 1
+                l1, bc = l1counter[k], bcid[k]
+                if bc != bcid_t and last_missing:
+                    self.missing_l1counter[-1].append(bc)
                     last_missing = False
 
-                if d['l1counter'] == l1a:
+                if l1 == l1a:
                     # this just skips additional headers for the same event
-                    counter_h[-1] += 1
-                    raw[-1].append(d['raw_full'])
+                    owner[k] = n_events - 1
+                    role[k] = self.HEADER_EXTRA
                     if skip_event:
-                        print("Skipping event (same l1a counter)", d['l1counter'], d['bcid'], bcid_t)
+                        print("Skipping event (same l1a counter)", l1, bc, bcid_t)
                         continue
-                    pass
-                #elif d['l1counter'] < l1a and d['l1counter']!=0:
-                # # NOTE this part is experimental, and removes duplicate events
-                # # However, we should instead re-implement full consistency checks of header - data - trailer style
-                #    skip_event = True
-                #    print("Skipping event", d['l1counter'], d['bcid'], bcid_t)
-
                 else:
-                    if abs(l1a - d['l1counter']) not in [1,255] and l1a>=0:
-                        missing_l1counter.append([d['l1counter'], d['bcid'], i, d['l1counter'] - l1a])  # this checks if we miss any event according to the counter
+                    if abs(l1a - l1) not in [1,255] and l1a>=0:
+                        self.missing_l1counter.append([l1, bc, n_events, l1 - l1a])  # this checks if we miss any event according to the counter
                         last_missing = True
-                    if uuid_tmp in uuid and abs(i - np.where(np.array(uuid) == uuid_tmp)[0][-1]) < 150:
+                    uuid_tmp = l1 | bc<<8
+                    if uuid_tmp in uuid and abs(n_events - uuid[uuid_tmp]) < self.event_window:
                         print("Skipping duplicate event")
-                        skip_counter += 1
+                        self.skip_counter += 1
                         skip_event = True
                         continue
-                    else:
-                        uuid.append(d['l1counter'] | d['bcid']<<8)
-                    #hit_counter = 0
-                    #if (abs(d['bcid']-bcid_t)<40) and (d['bcid'] - bcid_t)>0 and not (d['bcid'] == bcid_t):
-                    #if (abs(d['bcid']-bcid_t)<500) and (d['bcid'] - bcid_t)>0 and not (d['bcid'] == bcid_t):
-                    if (((abs(d['bcid']-bcid_t)<150) or (abs(d['bcid']+3564-bcid_t)<50)) and not (d['bcid'] == bcid_t) and not skip_trigger_check):
+                    uuid[uuid_tmp] = self.n_uuid
+                    self.n_uuid += 1
+                    if (((abs(bc-bcid_t)<150) or (abs(bc+3564-bcid_t)<50)) and not (bc == bcid_t) and not self.skip_trigger_check):
                         skip_event = True
-                        print("Skipping event", d['l1counter'], d['bcid'], bcid_t)
-                        skip_counter += 1
+                        print("Skipping event", l1, bc, bcid_t)
+                        self.skip_counter += 1
                         continue
-                    else:
-                        skip_event = False
-                    bcid_t = d['bcid']
-                    if (abs(l1a - d['l1counter'])>1) and abs(l1a - d['l1counter'])!=255 and verbose:
+                    skip_event = False
+                    bcid_t = bc
+                    sus = False
+                    if (abs(l1a - l1)>1) and abs(l1a - l1)!=255 and self.verbose:
                         print("SUS")
                         sus = True
-                    l1a = d['l1counter']
-                    event.append(i)
-                    counter_h.append(1)
-                    counter_t.append(0)
-                    l1counter.append(d['l1counter'])
-                    row.append([])
-                    col.append([])
-                    tot_code.append([])
-                    toa_code.append([])
-                    cal_code.append([])
-                    elink.append([])
-                    raw.append([d['raw_full']])
-                    nhits.append(0)
-                    nhits_trail.append([])
-                    chipid.append([])
-                    crc.append([])
-                    bcid.append([d['bcid']])
-                    counter_a.append([])
-                    i += 1
-                    if verbose or sus:
-                        print("New event:", l1a, i, d['bcid'])
-
-            if t == 'data':
-                elink_report[d['elink']]['nhits'] += 1
-            if t == 'trailer':
-                elink_report[d['elink']]['ntrailer'] += 1
-
-            if t == 'data' and not skip_event:
-                hit_counter += 1
-                if 'tot' in d:
-                    tot_code[-1].append(d['tot'])
-                    toa_code[-1].append(d['toa'])
-                    cal_code[-1].append(d['cal'])
-                elif 'counter_a' in d:
-                    bcid[-1].append(d['bcid'])
-                    counter_a[-1].append(d['counter_a'])
-                elif 'counter_b' in d:
-                    pass
-                row[-1].append(d['row_id'])
-                col[-1].append(d['col_id'])
-                elink[-1].append(d['elink'])
-                raw[-1].append(d['raw_full'])
-                nhits[-1] += 1
-                if nhits[-1] > 256:
-                    print("This event already has more than 256 hits. Skipping event.")
-                    skip_event = True
-                    continue
-                    #bad_run = True
-                    #break
+                    l1a = l1
+                    owner[k] = n_events
+                    role[k] = self.HEADER_NEW
+                    n_events += 1
+                    nhits = 0
+                    if self.verbose or sus:
+                        print("New event:", l1a, n_events, bc)
+
+            elif t == DATA:
+                if not skip_event and n_events > 0:
+                    hit_counter += 1
+                    owner[k] = n_events - 1
+                    role[k] = self.HIT
+                    nhits += 1
+                    if nhits > self.max_hits:
+                        print(f"This event already has more than {self.max_hits} hits. Skipping event.")
+                        skip_event = True
+                        continue
 
-            if t == 'trailer' and t_tmp != 'trailer':
-                trailers.append(d['raw_full'])
-                trailer_counter += 1
+            elif t == TRAILER and t_tmp != TRAILER:
+                self.trailer_counter += 1
                 if not skip_event:
-                    try:
-                        counter_t[-1] += 1
-                        if hit_counter > 0:
-                            #print(hit_counter)
-                            #chipid[-1].append(hit_counter*d['chipid'])
-                            chipid[-1] += hit_counter*[d['chipid']]
-                            #print(l1counter[-1], bcid[-1], chipid[-1])
-                        #else:
-                        #    chipid[-1].append()
-                        nhits_trail[-1].append(d['hits'])
-                        raw[-1].append(d['raw'])
-                        crc[-1].append(d['crc'])
-                    except IndexError:
+                    if n_events > 0:
+                        owner[k] = n_events - 1
+                        role[k] = self.TRAILER
+                        trailer_hits[k] = hit_counter
+                    else:
                         print("Data stream started with a trailer, that is weird.")
 
             t_tmp = t
 
-        if (not bad_run or force) and event:
-            print("Zipping")
-            events = ak.Array({
-                'event': event,
-                'l1counter': l1counter,
-                'nheaders': counter_h,
-                'ntrailers': counter_t,
-                'row': row,
-                'col': col,
-                'tot_code': tot_code,
-                'toa_code': toa_code,
-                'cal_code': cal_code,
-                'elink': elink,
-                'raw': raw,
-                'crc': crc,
-                'chipid': chipid,
-                'bcid': bcid,
-                'counter_a': counter_a,
-                'nhits': ak.singletons(nhits),
-                'nhits_trail': ak.sum(ak.Array(nhits_trail), axis=-1),
-            })
-
-            total_events = len(events)
+        self.n_events = n_events
+        self.l1a = l1a
+        self.bcid_t = bcid_t
+        self.skip_event = skip_event
+        self.last_missing = last_missing
+        self.hit_counter = hit_counter
+        self.nhits = nhits
+        self.t_tmp = t_tmp
+
+        if len(uuid) > 100*self.event_window:
+            # entries this far behind can't be duplicates of any future event
+            self.uuid = {k: pos for k, pos in uuid.items() if pos > n_events - self.event_window}
+
+        # CRC check of every frame, without the words that were read twice
+        valid = (block['frame_type'] >= 0) & ~duplicate
+        n_open = len(self.open_frame[0])
+        crc_words = np.concatenate([self.open_frame[0], np.asarray(words, dtype=np.uint64)[valid]])
+        crc_types = np.concatenate([self.open_frame[1], block['frame_type'][valid]])
+        trailer_pos, crc_ok = check_frames(crc_words, crc_types, types)
+        new_trailers = trailer_pos >= n_open
+        crc_error = np.zeros(n, dtype=bool)
+        crc_error[np.nonzero(valid)[0][trailer_pos[new_trailers] - n_open]] = ~crc_ok[new_trailers]
+        last_header = np.nonzero(crc_types == HEADER)[0][-1:]
+        start = last_header[0] if len(last_header) else len(crc_types)
+        self.open_frame = (crc_words[start:], crc_types[start:])
+        self.crc_error_counter += int(np.sum(~crc_ok[new_trailers]))
+
+        # elink report, in order of appearance of the elinks
+        counted = (block['frame_type'] >= 0) & ~duplicate
+        elinks, first = np.unique(block['elink'][block['frame_type'] >= 0], return_index=True)
+        for e in elinks[np.argsort(first)].tolist():
+            self.elink_report.setdefault(e, {'nheader':0, 'nhits':0, 'ntrailer':0})
+        for t, key in [(HEADER, 'nheader'), (DATA, 'nhits'), (TRAILER, 'ntrailer')]:
+            elinks, counts = np.unique(block['elink'][counted & (block['frame_type'] == t)], return_counts=True)
+            for e, c in zip(elinks.tolist(), counts.tolist()):
+                self.elink_report[e][key] += c
+
+        # only keep what is needed for the events
+        used = role > 0
+        keep = ['data_type', 'raw', 'l1counter', 'bcid', 'row_id', 'col_id', 'elink', 'tot', 'toa', 'cal', 'counter_a', 'chipid', 'hits', 'crc']
+        res = {d: block[d][used] for d in keep}
+        res['word'] = np.asarray(words, dtype=np.uint64)[used]
+        res['owner'] = owner[used]
+        res['role'] = role[used]
+        res['trailer_hits'] = trailer_hits[used]
+        res['crc_error'] = crc_error[used]
+        self.blocks.append(res)
+
+    def summary(self):
+        '''
+        Counters and reports of the event building, without the decoded blocks.
+        '''
+        return {
+            'n_events': self.n_events,
+            'header_counter': self.header_counter,
+            'trailer_counter': self.trailer_counter,
+            'skip_counter': self.skip_counter,
+            'missing_l1counter': self.missing_l1counter,
+            'elink_report': self.elink_report,
+            'crc_error_counter': self.crc_error_counter,
+        }
+
+    def pop_events(self, final=False):
+        '''
+        Zip the events that are done into an awkward array, and forget about them.
+        The last event can still get words from the next block, it is only returned with final.
+        '''
+        n_done = self.n_events if final else max(self.n_events - 1, self.n_popped)
+        first = self.n_popped
+        self.n_popped = n_done
+
+        res = {d: np.concatenate([b[d] for b in self.blocks]) for d in self.blocks[0]}
+        done = res['owner'] < n_done
+        self.blocks = [{d: values[~done] for d, values in res.items()}]
+        res = {d: values[done] for d, values in res.items()}
+        owner, role = res['owner'] - first, res['role']
+        n = n_done - first
+
+        def count(sel):
+            return np.bincount(owner[sel], minlength=n)
+
+        def jagged(sel, values):
+            return ak.unflatten(values.astype(np.int64), count(sel))
+
+        new = role == self.HEADER_NEW
+        headers = new | (role == self.HEADER_EXTRA)
+        hits = role == self.HIT
+        trailers = role == self.TRAILER
+        tdc = hits & (res['data_type'] == 0)
+        counter = hits & (res['data_type'] == 1)
+        # bcid of the event, followed by the ones of the counter_a data
+        with_bcid = new | counter
+
+        # the raw words of headers and hits, and the 40 bits of the trailers
+        raw = np.where(trailers, res['raw'], res['word'])
+        raw = ak.unflatten(ak.from_arrow(pa.array([hex(x) for x in raw.tolist()], type=pa.large_string())), count(slice(None)))
+
+        chipid = np.repeat(res['chipid'][trailers], res['trailer_hits'][trailers])
+        chipid_owner = np.repeat(owner[trailers], res['trailer_hits'][trailers])
+
+        return ak.Array({
+            'event': np.arange(first, n_done, dtype=np.int64),
+            'l1counter': res['l1counter'][new].astype(np.int64),
+            'nheaders': count(headers),
+            'ntrailers': count(trailers),
+            'row': jagged(hits, res['row_id'][hits]),
+            'col': jagged(hits, res['col_id'][hits]),
+            'tot_code': jagged(tdc, res['tot'][tdc]),
+            'toa_code': jagged(tdc, res['toa'][tdc]),
+            'cal_code': jagged(tdc, res['cal'][tdc]),
+            'elink': jagged(hits, res['elink'][hits]),
+            'raw': raw,
+            'crc': jagged(trailers, res['crc'][trailers]),
+            'chipid': ak.unflatten(chipid.astype(np.int64), np.bincount(chipid_owner, minlength=n)),
+            'bcid': jagged(with_bcid, res['bcid'][with_bcid]),
+            'counter_a': jagged(counter, res['counter_a'][counter]),
+            'nhits': ak.singletons(count(hits)),
+            'nhits_trail': np.bincount(owner[trailers], weights=res['hits'][trailers], minlength=n).astype(np.int64),
+            'ncrc_errors': count(trailers & res['crc_error']),
+        })
+
+def get_file_parts(f_in):
+    '''
+    The raw data file f_in, followed by the files the DAQ continued it in
+    (<f_in>.part<i>, see StreamWriter in daq.py), in the order they were written.
+    '''
+    parts = [f for f in glob.glob(glob.escape(f_in) + '.part*') if f.rsplit('.part', 1)[1].isdigit()]
+    return [f_in] + sorted(parts, key=lambda f: int(f.rsplit('.part', 1)[1]))
+
+def read_chunks(in_files, chunk_size):
+    '''
+    Read a list of files as one continuous stream, in chunks of up to chunk_size bytes.
+    '''
+    for f_in in in_files:
+        with open(f_in, 'rb') as f:
+            while True:
+                data = f.read(chunk_size)
+                if len(data) == 0:
+                    break
+                yield data
+
+def dump_file(f_in, f_out, df, verbose=False, skip_trigger_check=False, chunk_size=2**24):
+    '''
+    Build the events of one raw data file and its continuation parts, reading them
+    in chunks of chunk_size bytes, and write them to f_out as soon as they are done.
+    Returns the summary of the event builder (counters and reports), the hit map,
+    and the number of events with CRC errors. These are small, so that
+    dump_file can run in a worker process, the events only go through f_out.
+    '''
+    builder = EventBuilder(df, verbose=verbose, skip_trigger_check=skip_trigger_check)
+    merger = WordMerger(empty=2**8)
+    hits = np.zeros([16, 16])
+    n_crc_events = 0
+    with EventWriter(f_out) as writer:
+        # an empty chunk at the end flushes the remaining events
+        for data in itertools.chain(read_chunks(get_file_parts(f_in), chunk_size), [b'']):
+            if len(data) > 0:
+                builder.add(merger.merge(data))
+            elif not builder.blocks:
+                break  # empty file
+            events = builder.pop_events(final=len(data)==0)
+            if len(events) > 0:
+                writer.write(events)
+                np.add.at(hits, (ak.to_numpy(ak.flatten(events.row)), ak.to_numpy(ak.flatten(events.col))), 1)
+                n_crc_events += int(ak.sum(events.ncrc_errors>0))
+            if len(data) == 0:
+                break
+    return builder.summary(), hits, n_crc_events
+
+def data_dumper(
+        input_file,
+        #output_file,
+        verbose=False,
+        skip_trigger_check=False,
+        force=False,
+        chunk_size=2**24,
+        workers=None,
+):
+    # NOTE find all files (i.e. layers) for the specified input file
+    df = DataFrame('ETROC2')
+
+    events_all_rb = []
+    all_runs_good = True
+    n_events_out = 0
+    events_file = None
+    missing_l1counter = []
+
+    in_files = sorted(glob.glob(input_file.replace('rb0', 'rb*')))
+    print(in_files)
+    out_files = [x.replace('.dat', '.parquet') for x in in_files]
+
+    # NOTE the RBs are independent, so they are decoded in parallel, one worker process each.
+    # The workers write the events to the parquet files, and only hand back the summaries.
+    if workers is None:
+        workers = min(len(in_files), os.cpu_count() or 1)
+    dump_args = [(f_in, out_files[irb], df, verbose, skip_trigger_check, chunk_size) for irb, f_in in enumerate(in_files)]
+    for f_in in in_files:
+        print("Reading from {}".format(', '.join(get_file_parts(f_in))))
+    if workers > 1 and len(in_files) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(dump_file, *zip(*dump_args)))
+    else:
+        results = [dump_file(*a) for a in dump_args]
+
+    for irb, f_in in enumerate(in_files):
+        #f_in = f'{here}/ETROC_output/output_run_{args.input}_rb{rb}.dat'
+        summary, hits, n_crc_events = results[irb]
+        if len(in_files) > 1:
+            print(f"Results for {f_in}")
+        missing_l1counter += summary['missing_l1counter']
+        header_counter = summary['header_counter']
+        trailer_counter = summary['trailer_counter']
+        elink_report = summary['elink_report']
+        bad_run = False
+
+        if (not bad_run or force) and summary['n_events']:
+            total_events = summary['n_events']
             # NOTE the check below is only valid for single ETROC
             #consistent_events = len(events[((events.nheaders==2)&(events.ntrailers==2)&(events.nhits==events.nhits_trail))])
             #print(total_events, consistent_events)
 
-            print(f"Done with {len(events)} events. " + emojize(":check_mark_button:"))
+            print(f"Done with {total_events} events. " + emojize(":check_mark_button:"))
             #print(f" - skipped {skip_counter/events.nheaders[0]} events that were identified as double-triggered " + emojize(":check_mark_button:"))
             if header_counter == trailer_counter:
                 print(f" - found same number of headers and trailers!: {header_counter} " + emojize(":check_mark_button:"))
             else:
                 print(f" - found {header_counter} headers and {trailer_counter} trailers. Please check. " + emojize(":warning:"))
 
+            if summary['crc_error_counter'] == 0:
+                print(f" - all frames have a correct CRC " + emojize(":check_mark_button:"))
+            else:
+                print(f" - found {summary['crc_error_counter']} frames with a wrong CRC, in {n_crc_events} events. " + emojize(":warning:"))
+
             print(f" - found {len(missing_l1counter)} missing events (irregular increase of L1counter).")
             if len(missing_l1counter)>0:
                 print("   L1counter, BCID, event number and step size of these events are:")
@@ -697,18 +856,20 @@ def data_dumper(
             print(f" - elink report:")
             print(pd.DataFrame(elink_report))
 
-            with open(out_files[irb], "w") as f:
-                json.dump(ak.to_json(events), f)
+            print(f" - wrote events to {out_files[irb]}")
+            n_events_out = total_events
+            events_file = out_files[irb]
             #with open(f"ETROC_output/{args.input}_rb{rb}.json", "w") as f:
             #    json.dump(ak.to_json(events), f)
-            events_all_rb.append(events)
+            if len(in_files) > 1:
+                # the events of all RBs are needed for merging
+                events_all_rb.append(read_events(out_files[irb]))
 
             # make some plots
             import matplotlib.pyplot as plt
             import mplhep as hep
             plt.style.use(hep.style.CMS)
 
-            hits = np.zeros([16, 16])
             #if rb=='2':
             #    mask = [(11,5)]
             mask = []
@@ -716,10 +877,8 @@ def data_dumper(
             #    mask = [(2,4), (3,4), (4,6), (3,11), (6,12)]
             #if rb=='1':
             #    mask = [(4,0)]
-            for ev in events:
-                for row, col in zip(ev.row, ev.col):
-                    if (row, col) not in mask:
-                        hits[row][col] += 1
+            for row, col in mask:
+                hits[row][col] = 0
 
             fig, ax = plt.subplots(1,1,figsize=(7,7))
             cax = ax.matshow(hits)
@@ -739,103 +898,28 @@ def data_dumper(
             total_hits = np.sum(hits)
             print("Total number of hits:", total_hits)
         else:
-            print("Bad run detected. Not creating a json file.")
+            print("Bad run detected. Not creating an output file.")
             all_runs_good = False
             #if os.path.isfile(f"{here}/ETROC_output/output_run_{args.input}_rb{rb}.json"):
             #    os.remove(f"{here}/ETROC_output/output_run_{args.input}_rb{rb}.json")
 
     if len(events_all_rb)>1: #or True:
-        event_number = []
-        bcid = []
-        nhits = []
-        row = []
-        col = []
-        chipid = []
-
-        #sel = ak.flatten(events_all_rb[0].nhits>0)
-        #sel = ak.flatten(ak.ones_like(events_all_rb[0].nhits))
-        sel = ak.flatten(ak.ones_like(events_all_rb[0].nhits, dtype=bool))
-        events_with_hits = len(events_all_rb[0][sel])
-
-        for rb, events in enumerate(events_all_rb):
-            if rb == 0:
-                #sel = ak.flatten(events.nhits)>0
-                event_number = ak.to_list(events[sel].event)
-                l1counter = ak.to_list(events[sel].l1counter)
-                bcid = ak.to_list(events[sel].bcid)
-                nhits = ak.to_list(events[sel].nhits)
-                row = ak.to_list(events[sel].row)
-                col = ak.to_list(events[sel].col)
-                toa = ak.to_list(events[sel].toa_code)
-                tot = ak.to_list(events[sel].tot_code)
-                cal = ak.to_list(events[sel].cal_code)
-                elink = ak.to_list(events[sel].elink)
-                chipid = ak.to_list(events[sel].chipid)
-            else:
-                # loop through rb0 events, and find corresponding entries in the other layers
-                print(f"Merging events from RB {rb}")
-                from tqdm import tqdm
-                with tqdm(total=events_with_hits, bar_format='{l_bar}{bar:20}{r_bar}{bar:-20b}') as pbar:
-                    for i, ev in enumerate(event_number):
-                        # print(i, ev)
-                        for j, tmp_evt in enumerate(events_all_rb[rb][ak.flatten(events_all_rb[rb].bcid + 1 == events_all_rb[0].bcid[ev])]):
-                            # print(j,tmp_evt)
-                        #for j in events_all_rb[rb].event:
-                            if abs(tmp_evt.event - ev)<100:
-                            #if events_all_rb[rb].l1counter[j] == events_all_rb[0].l1counter[i] and events_all_rb[rb].bcid[j] == events_all_rb[0].bcid[i] and abs(j-i) < 100:
-                            #if events_all_rb[rb].bcid[j] == events_all_rb[0].bcid[ev] and abs(j-ev) < 100:
-                                nhits[i] += ak.to_list(tmp_evt.nhits)
-                                row[i] += ak.to_list(tmp_evt.row)
-                                col[i] += ak.to_list(tmp_evt.col)
-                                tot[i] += ak.to_list(tmp_evt.tot_code)
-                                toa[i] += ak.to_list(tmp_evt.toa_code)
-                                cal[i] += ak.to_list(tmp_evt.cal_code)
-                                elink[i] += ak.to_list(tmp_evt.elink)
-                                chipid[i] += ak.to_list(tmp_evt.chipid)
-                                #print("--------------------------")
-                                #print(f"Found matching event for event {i} in rb {rb} stream")
-                                break
-                        pbar.update()
-
-                #for j in events.event:
-                #    if events.l1counter[j] == events_all_rb[0].l1counter[j] and events.bcid[j] == events_all_rb[0].bcid[j]:
-                #        nhits[j].append(events.nhits)
-                #        row[j].append(events.row)
-                #        col[j].append(events.col)
-                #        chipid[j].append(events.chipid)
-
-        print("Zipping again")
-        events = ak.Array({
-            'event': event_number,
-            'l1counter': l1counter,
-            #'nheaders': counter_h,
-            #'ntrailers': counter_t,
-            'row': row,
-            'col': col,
-            'tot_code': tot,
-            'toa_code': toa,
-            'cal_code': cal,
-            'elink': elink,
-            #'raw': raw,
-            #'crc': crc,
-            'chipid': chipid,
-            'bcid': bcid,
-            #'counter_a': counter_a,
-            'nhits': nhits,
-            #'nhits_trail': ak.sum(ak.Array(nhits_trail), axis=-1),
-        })
-        with open(out_files[0].replace('rb0', 'merged'), "w") as f:
-            json.dump(ak.to_json(events), f)
+        print("Merging events of all RBs")
+        events, merge_report = merge_rb_events(events_all_rb)
+        print(f" - merge report:")
+        print(pd.DataFrame(merge_report))
+        write_events(events, out_files[0].replace('rb0', 'merged'))
         # make a copy that is called rb0 for the merger
-        with open(out_files[0], "w") as f:
-            json.dump(ak.to_json(events), f)
+        write_events(events, out_files[0])
+        n_events_out = len(events)
+        events_file = out_files[0]
         print("Done.")
 
-    if not bad_run and in_files and events_all_rb:
-        return len(events), events
+    if in_files and not bad_run and n_events_out > 0:
+        return n_events_out, events_file
     else:
-        print(f"NO EVENTS for {in_files}, NOT MAKING JSON AND HITMAPS...")
-        return 0, []
+        print(f"NO EVENTS for {in_files}, NOT MAKING OUTPUT FILE AND HITMAPS...")
+        return 0, None
 
 if __name__ == '__main__':
     argParser = argparse.ArgumentParser(description = "Argument parser")
@@ -845,14 +929,18 @@ if __name__ == '__main__':
     argParser.add_argument('--dump_mask', action='store_true', help="Skip the double trigger check.")
     argParser.add_argument('--verbose', action='store_true', help="Print every event number.")
     argParser.add_argument('--force', action='store_true', help="Don't care about inconsistencies, force produce output.")
+    argParser.add_argument('--chunk_size', action='store', default=16, type=int, help="Size of the chunks (in MB) that the raw data is read in.")
+    argParser.add_argument('--workers', action='store', default=None, type=int, help="Number of processes used to decode the RBs in parallel. Defaults to one per RB, up to the number of cores.")
     args = argParser.parse_args()
 
     rbs = args.rbs.split(',')
 
-    nevents, events = data_dumper(
+    nevents, events_file = data_dumper(
         args.input_file,
         #output_file,
         verbose=args.verbose,
         skip_trigger_check=args.skip_trigger_check,
         force=args.force,
+        chunk_size=args.chunk_size*2**20,
+        workers=args.workers,
     )
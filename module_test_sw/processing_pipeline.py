@@ -1,82 +1,180 @@
 #!/usr/bin/env python3
+import argparse
+import os
+import socket
+import sqlite3
 import subprocess
 import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from run_notify import PIPELINE_PORT
 from yaml import load
 try:
     from yaml import CLoader as Loader, CDumper as Dumper
 except ImportError:
     from yaml import Loader, Dumper
-import shutil
 
-if __name__ == '__main__':
-    which_root = shutil.which("root")
-    if which_root == "/cvmfs/sft.cern.ch/lcg/releases/LCG_103/ROOT/6.28.00/x86_64-ubuntu2004-gcc9-opt/bin/root":
-        print("Found expected ROOT version")
-    else:
-        print("This script relies on pyROOT, but found unexpected root version.")
-        print(" > In case of issues, run:")
-        print(" > source /cvmfs/sft.cern.ch/lcg/releases/LCG_103/ROOT/6.28.00/x86_64-ubuntu2004-gcc9-opt/ROOT-env.sh")
+class RunDB:
+    '''
+    State of every run (new, running, done, skipped, failed) and the times of the processing steps,
+    kept in a small sqlite database.
+    '''
+    def __init__(self, f_db='process_log.db'):
+        self.con = sqlite3.connect(f_db)
+        with self.con:
+            self.con.execute('''CREATE TABLE IF NOT EXISTS runs (
+                run INTEGER PRIMARY KEY, state TEXT, t_found REAL, t_start REAL, t_stop REAL,
+                t_run_end REAL, n_events INTEGER, message TEXT)''')
+            self.con.execute('CREATE INDEX IF NOT EXISTS runs_state ON runs (state)')
+
+    def add(self, run, state='new'):
+        '''
+        Add a run, if it is not known yet. Returns True for new runs.
+        '''
+        with self.con:
+            cur = self.con.execute('INSERT OR IGNORE INTO runs (run, state, t_found) VALUES (?, ?, ?)', (run, state, time.time()))
+        return cur.rowcount > 0
+
+    def update(self, run, **kwargs):
+        with self.con:
+            self.con.execute(
+                f"UPDATE runs SET {', '.join(f'{k}=?' for k in kwargs)} WHERE run=?",
+                (*kwargs.values(), run),
+            )
+
+    def get(self, run):
+        cur = self.con.execute('SELECT * FROM runs WHERE run=?', (run,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return dict(zip([c[0] for c in cur.description], row))
 
+    def runs(self, state):
+        return [x[0] for x in self.con.execute('SELECT run FROM runs WHERE state=? ORDER BY run', (state,))]
+
+def read_runs(log, offset=0):
+    '''
+    Read the run numbers that were appended to a log file since offset (in bytes).
+    Returns the runs and the new offset, an incomplete last line is left for the next call.
+    '''
+    if not os.path.isfile(log):
+        return [], offset
+    with open(log, 'r') as f:
+        f.seek(offset)
+        lines = f.read()
+    if not lines.endswith('\n'):
+        lines = lines[:lines.rfind('\n')+1]
+    runs = [int(x) for x in lines.split()]
+    return runs, offset + len(lines)
+
+def process_run(run, data_dir='./ETROC_output/', td02_dir='/home/daq/ETROC_output/', skip_stageout=True):
+    '''
+    Convert a run from binary to parquet to root, and optionally stage out the root file.
+    Returns the state of the run, the number of events, the end time of the run (from the DAQ log) and a message.
+    '''
     from root_dumper import dump_to_root
     from data_dumper import data_dumper
 
-    skip_stageout = True
+    print(f"\n\n >>> Starting to process run {run} <<<")
+    print(f" > Trying to load DAQ log")
+    log = None
+    try:
+        with open(data_dir + f"/log_run_{run}_rb0.yaml", "r") as f:
+            log = load(f, Loader=Loader)
+        print(f" > Nevents according to log: {log['nevents']}")
+        if log['lost_events'] > 0:
+            print(" > Lost events detected, will not process the data.")
+            return 'skipped', 0, log.get('stop_time'), 'lost events'
+        if log['nevents'] < 1:
+            print(" > Empty run detected, can't process any data.")
+            return 'skipped', 0, log.get('stop_time'), 'empty run'
+    except FileNotFoundError:
+        print("Couldn't find log")
+    run_end = log.get('stop_time') if log else None
+
+    print(f" > Converting binary to parquet")
+    # the runs are already processed in parallel, so the RBs of a run are not
+    n_events, events_file = data_dumper(
+        f"{data_dir}/output_run_{run}_rb0.dat",
+        skip_trigger_check=True,
+        workers=1,
+    )
+    continue_processing = n_events==log['nevents'] if log else n_events > 0
+    #print("Number of L1A and events in agreement?", continue_processing)
+
+    if not continue_processing:
+        print(" ! Data and number of L1As not in agreement, did not further process!")
+        return 'skipped', n_events, run_end, 'number of events and L1As not in agreement'
+
+    outfile = f'ETROC_merged_run_{run}.root'
+    print(f" > Converting parquet to root")
+    dump_to_root(f'{data_dir}/{outfile}', f'{data_dir}/output_run_{run}_rb0.parquet')
+    if not skip_stageout:
+        print(f" > Stage out root file.")
+        subprocess.call(f"scp {data_dir}/{outfile} daq@timingdaq02.dhcp.fnal.gov:{td02_dir}/{outfile}", shell=True)
+        #print(f" > Backup of raw data to EOS")
+    print(f" > Done.")
+    return 'done', n_events, run_end, ''
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser(description = "Argument parser")
+    argParser.add_argument('--workers', action='store', default=2, type=int, help="Number of runs that are processed in parallel")
+    argParser.add_argument('--data_dir', action='store', default='./ETROC_output/', help="Directory with the DAQ output")
+    argParser.add_argument('--stageout', action='store_true', help="Copy the root files to timingdaq02")
+    argParser.add_argument('--port', action='store', default=PIPELINE_PORT, type=int, help="Local UDP port for notifications of finished runs")
+    argParser.add_argument('--poll', action='store', default=1, type=float, help="Interval (in s) for checking daq_log.txt, in case a notification was missed")
+    args = argParser.parse_args()
+
     td02_dir = '/home/daq/ETROC_output/'
-    data_dir = './ETROC_output/'
 
-    while True:
-        with open('daq_log.txt', 'r') as f:
-            available_runs = f.readlines()
-            available_runs = [int(x) for x in available_runs]
+    db = RunDB('process_log.db')
+    # runs processed by earlier versions of the pipeline are only recorded in process_log.txt
+    Path('process_log.txt').touch()
+    for run in read_runs('process_log.txt')[0]:
+        db.add(run, state='done')
+    for run in db.runs('running'):
+        # interrupted while processing
+        db.update(run, state='new')
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', args.port))
+    sock.settimeout(args.poll)
 
-        Path('process_log.txt').touch()
-        with open('process_log.txt', 'r') as f:
-            processed_runs = f.readlines()
-            processed_runs = [int(x) for x in processed_runs]
+    daq_log_offset = 0
+    running = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        while True:
+            new_runs, daq_log_offset = read_runs('daq_log.txt', daq_log_offset)
+            for run in new_runs:
+                db.add(run)
 
-        for run in available_runs:
-            if run not in processed_runs:
+            for run in db.runs('new'):
+                print(f" > Submitting run {run}")
+                db.update(run, state='running', t_start=time.time())
+                running[run] = pool.submit(process_run, run, data_dir=args.data_dir, td02_dir=td02_dir, skip_stageout=not args.stageout)
 
-                print(f"\n\n >>> Starting to process run {run} <<<")
-                print(f" > Trying to load DAQ log")
+            for run, future in list(running.items()):
+                if not future.done():
+                    continue
+                del running[run]
                 try:
-                    with open(data_dir + f"/log_run_{run}_rb0.yaml", "r") as f:
-                        log = load(f, Loader=Loader)
-                    print(f" > Nevents according to log: {log['nevents']}")
-                    if log['lost_events'] > 0:
-                        print(" > Lost events detected, will not process the data.")
-                        with open('process_log.txt', 'a') as f:
-                            f.write(f'{run}\n')
-                        continue
-                    if log['nevents'] < 1:
-                        print(" > Empty run detected, can't process any data.")
-                        with open('process_log.txt', 'a') as f:
-                            f.write(f'{run}\n')
-                        continue
-                except FileNotFoundError:
-                    print("Couldn't find log")
-                print(f" > Converting binary to json")
-                n_events, events = data_dumper(
-                    f"{data_dir}/output_run_{run}_rb0.dat",
-                    skip_trigger_check=True,
-                )
-                continue_processing = n_events==log['nevents']
-                #print("Number of L1A and events in agreement?", continue_processing)
-
-                if continue_processing:
-                    #subprocess.call(f"python3 data_dumper.py --input {run} --rbs 0 --skip_trigger_check", shell=True)
-                    outfile = f'ETROC_merged_run_{run}.root'
-                    print(f" > Converting json to root")
-                    dump_to_root(f'{data_dir}/{outfile}', f'{data_dir}/output_run_{run}_rb0.json')
-                else:
-                    print(" ! Data and number of L1As not in agreement, did not further process!")
-                if not skip_stageout:
-                    print(f" > Stage out root file.")
-                    subprocess.call(f"scp {data_dir}/{outfile} daq@timingdaq02.dhcp.fnal.gov:{td02_dir}/{outfile}", shell=True)
-                    #print(f" > Backup of raw data to EOS")
+                    state, n_events, run_end, message = future.result()
+                except Exception as e:
+                    state, n_events, run_end, message = 'failed', 0, None, repr(e)
+                db.update(run, state=state, t_stop=time.time(), t_run_end=run_end, n_events=n_events, message=message)
                 with open('process_log.txt', 'a') as f:
                     f.write(f'{run}\n')
-                print(f" > Done.")
-        print("Done with all runs, sleeping for 1min")
-        time.sleep(60)
+                res = db.get(run)
+                t_ref = res['t_run_end'] if res['t_run_end'] is not None else res['t_found']
+                print(f" > Run {run} {state}{' (' + message + ')' if message else ''}: started {res['t_start']-t_ref:.1f}s and finished {res['t_stop']-t_ref:.1f}s after the end of the run")
+
+            # wait for the next notification, or for the poll interval
+            try:
+                data = sock.recv(1024)
+                for run in data.split():
+                    if db.add(int(run)):
+                        print(f" > Got notified about run {int(run)}")
+            except socket.timeout:
+                pass
+            except ValueError:
+                print(f" ! Could not read notification {data}")
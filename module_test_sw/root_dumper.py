@@ -1,97 +1,77 @@
 #!/usr/bin/env python3
-import json
-import ROOT as rt
-from array import array
+import awkward as ak
+import numpy as np
+import uproot
 import os
 import re
 import time
+from tamalero.utils import read_events
 
-def setVector(v_, l_):
-    v_.clear()
-    for i in l_:
-        v_.push_back(i)
+# the columns of the data_dumper output that end up in the tree
+COLUMNS = ['event', 'l1counter', 'row', 'col', 'tot_code', 'toa_code', 'cal_code', 'elink', 'chipid', 'bcid', 'nhits']
 
-def dump_to_root(output, input_file):
+# one value per event
+SCALAR_BRANCHES = ['event', 'l1counter', 'bcid']
+# one value per hit (or per ETROC for nhits)
+JAGGED_BRANCHES = ['row', 'col', 'tot_code', 'toa_code', 'cal_code', 'elink', 'chipid', 'nhits', 'nhits_trail']
+
+def get_branches(events):
+    '''
+    Convert events of data_dumper into the arrays of the branches of the tree:
+    unsigned 32 bit for the scalar branches, like the event/I leaves of the PyROOT version,
+    and int32 for the jagged branches, like its std::vector<int> branches.
+    '''
+    branches = {
+        'event': ak.to_numpy(events.event).astype(np.uint32),
+        'l1counter': ak.to_numpy(events.l1counter).astype(np.uint32),
+        'bcid': ak.to_numpy(ak.fill_none(ak.firsts(events.bcid), 0)).astype(np.uint32),
+    }
+    for branch in JAGGED_BRANCHES:
+        if branch in events.fields:
+            branches[branch] = ak.values_astype(events[branch], np.int32)
+        else:
+            # nhits_trail is not filled (yet), keep the branch with empty entries
+            branches[branch] = ak.unflatten(np.zeros(0, dtype=np.int32), np.zeros(len(events), dtype=np.int64))
+    return branches
+
+def dump_to_root(output, input_file, basket_size=100000):
+    '''
+    Write the events of data_dumper into the "pulse" tree of a ROOT file, basket_size events at a time.
+
+    Format change with respect to the PyROOT version of this function, for the readers of these files
+    (e.g. the merger of the ETROC and scope data): uproot can not write std::vector<int>, so the jagged
+    branches (row, col, ..., nhits_trail) are variable size int32 arrays, with a counter branch each
+    (nrow for row, ncol for col, ...). Branch names and values are the same. RDataFrame and uproot read
+    both as arrays per event (ROOT::RVec<int>). TTree::SetBranchAddress needs an int array instead
+    of a std::vector<int>*, plus the counter branch for the number of entries.
+    '''
     # Create an empty root file so that the merger step is always happy and does not get stuck
     filename = os.path.basename(input_file)
     name, ext = os.path.splitext(filename)
-    if ext != '.json':
-        raise ValueError("Inputted file needs to be json from data dumper")
+    if ext not in ['.parquet', '.json']:
+        raise ValueError("Inputted file needs to be parquet (or json) from data dumper")
+
+    branch_types = {branch: np.uint32 for branch in SCALAR_BRANCHES}
+    branch_types.update({branch: 'var * int32' for branch in JAGGED_BRANCHES})
 
-    f = rt.TFile(output, "RECREATE")
-    tree = rt.TTree("pulse", "pulse")
-    print(output)
+    with uproot.recreate(output) as f:
+        tree = f.mktree("pulse", branch_types, title="pulse")
+        print(output)
 
-    if os.path.isfile(input_file):
-        with open(input_file) as f_in:
+        if os.path.isfile(input_file) or os.path.isfile(input_file.replace('.parquet', '.json')):
             print("Now reading from {}".format(input_file))
-            jsonString = json.load(f_in)
-            jsonData = json.loads(jsonString)
-
-            event_       = array('I',[0])
-            l1counter_   = array('I',[0])
-            row_         = rt.std.vector[int]()
-            col_         = rt.std.vector[int]()
-            tot_code_    = rt.std.vector[int]()
-            toa_code_    = rt.std.vector[int]()
-            cal_code_    = rt.std.vector[int]()
-            elink_       = rt.std.vector[int]()
-            #raw_         = rt.std.vector[rt.std.string]()
-            #crc_         = rt.std.vector[int]()
-            chipid_      = rt.std.vector[int]()
-            #bcid_        = rt.std.vector[int]()
-            bcid_        = array("I",[0]) # rt.std.vector[int]()
-            #counter_a_   = rt.std.vector[int]()
-            nhits_       = rt.std.vector[int]()
-            nhits_trail_ = rt.std.vector[int]()
-
-            tree.Branch("event",       event_, "event/I")
-            tree.Branch("l1counter",   l1counter_, "l1counter/I")
-            tree.Branch("row",         row_)
-            tree.Branch("col",         col_)
-            tree.Branch("tot_code",    tot_code_)
-            tree.Branch("toa_code",    toa_code_)
-            tree.Branch("cal_code",    cal_code_)
-            tree.Branch("elink",       elink_)
-            #tree.Branch("raw",         raw_)
-            #tree.Branch("crc",         crc_)
-            tree.Branch("chipid",      chipid_)
-            tree.Branch("bcid",        bcid_, "bcid/I")
-            #tree.Branch("counter_a",   counter_a_)
-            # tree.Branch("nhits",       nhits_, "nhits/I")
-            tree.Branch("nhits",       nhits_)
-            tree.Branch("nhits_trail", nhits_trail_)
-
-            for i, event in enumerate(jsonData):
-                # print(event["bcid"])
-                event_[0] =             event["event"]
-                l1counter_[0] =         event["l1counter"]
-                setVector(row_,         event["row"])
-                setVector(col_,         event["col"])
-                setVector(tot_code_,    event["tot_code"])
-                setVector(toa_code_,    event["toa_code"])
-                setVector(cal_code_,    event["cal_code"])
-                setVector(elink_,       event["elink"])
-                # setVector(raw_,         event["raw"])
-                #setVector(crc_,         event["crc"])
-                setVector(chipid_,      event["chipid"])
-                # print(event["bcid"])
-                bcid_[0] =              int(event["bcid"][0])
-                # setVector(bcid_,        event["bcid"])
-                #setVector(counter_a_,   event["counter_a"])
-                setVector(nhits_,           event["nhits"])
-                # setVector(nhits_trail_, event["nhits_trail"])
-
-                tree.Fill()
-    
-        print(f"Found {i+1} events")
-        f.WriteObject(tree, "pulse")
-        print(f"Output written to {output} ...")
-    else:
-        print("-----File does not exist-----")
+            events = read_events(input_file, columns=COLUMNS)
+
+            for start in range(0, len(events), basket_size):
+                tree.extend(get_branches(events[start:start+basket_size]))
+
+            print(f"Found {len(events)} events")
+            print(f"Output written to {output} ...")
+        else:
+            print("-----File does not exist-----")
 
 def get_run_number(path: str) -> int:
-    pattern = r'output_run_(\d+)_rb0\.json'
+    pattern = r'output_run_(\d+)_rb0\.(?:parquet|json)'
     match = re.search(pattern, path)
     if match:
         return int(match.group(1))
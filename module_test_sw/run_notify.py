@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+'''
+Notifications of finished runs, sent from the DAQ to processing_pipeline.
+'''
+import socket
+
+# local UDP port the pipeline listens on for finished runs, see notify_run_done
+PIPELINE_PORT = 50601
+
+def notify_run_done(run, port=PIPELINE_PORT):
+    '''
+    Tell a running processing pipeline that a run is finished, so that it starts right away.
+    Nothing happens if no pipeline is listening, it then picks up the run from daq_log.txt.
+    '''
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        try:
+            s.sendto(f'{run}\n'.encode(), ('127.0.0.1', port))
+        except OSError:
+            pass
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import os
+import numpy as np
 
 from yaml import load, dump
 
@@ -15,6 +16,9 @@ class DataFrame:
         with open(os.path.expandvars(f'{here}/../configs/dataformat.yaml'), 'r') as f:
             self.format = load(f, Loader=Loader)[version]
         self.type = 0
+        self.frame_types = list(self.format['identifiers'].keys())
+        # field lists of the different data word types, ETROC1 only has one
+        self.data_types = self.format.get('types', {0: list(self.format['data']['data'].keys())})
 
     def get_bytes(self, word, format):
         bytes = []
@@ -75,6 +79,122 @@ class DataFrame:
         #print (res)
         return data_type, res
 
+    def get_fields(self):
+        '''
+        All fields that read can return, with the smallest unsigned dtype that fits all of their masks.
+        '''
+        fields = {}
+        for data_type in self.frame_types:
+            if data_type == 'data':
+                names = set(d for t in self.data_types for d in self.data_types[t])
+            else:
+                names = self.format['data'][data_type]
+            for d in names:
+                field = self.format['data'][data_type][d]
+                n_bits = (field['mask'] >> field['shift']).bit_length()
+                fields[d] = max(fields.get(d, 0), n_bits)
+        return {d: np.min_scalar_type(2**n_bits-1) for d, n_bits in fields.items()}
+
+    def read_block(self, words):
+        '''
+        Vectorized version of read, for an array of (merged) words.
+        Returns a dictionary of arrays with one entry per word:
+        - frame_type: index of the frame type in self.frame_types, -1 if the word was not identified
+        - data_type: type of the last header (for data words, 0 otherwise)
+        - raw, meta: the 40 bit word and the 24 bits of meta data above it
+        - every field that read can return. Fields that do not belong to the frame
+          (or data) type of a word are 0.
+        Like read, the data type of the last header is kept for the next block.
+        '''
+        words = np.asarray(words, dtype=np.uint64)
+        n = len(words)
+        # work on 32 bit halves where possible, that's a lot faster than uint64
+        low = words.astype(np.uint32)
+        high = (words >> np.uint64(32)).astype(np.uint32)
+        tmp = np.empty(n, dtype=np.uint32)
+
+        def matches(mask, frame):
+            res = None
+            for part, shift in ((low, 0), (high, 32)):
+                m = (mask >> shift) & 0xFFFFFFFF
+                if m:
+                    np.bitwise_and(part, np.uint32(m), out=tmp)
+                    match = tmp == np.uint32((frame >> shift) & 0xFFFFFFFF)
+                    res = match if res is None else res & match
+            return res if res is not None else np.ones(n, dtype=bool)
+
+        # the first matching identifier wins, like in read
+        frame_type = np.full(n, -1, dtype=np.int8)
+        for i in reversed(range(len(self.frame_types))):
+            identifier = self.format['identifiers'][self.frame_types[i]]
+            frame_type[matches(identifier['mask'], identifier['frame'])] = i
+
+        # data words are decoded according to the type of the last header
+        data_type = np.full(n, self.type, dtype=np.int8)
+        if 'header' in self.frame_types and 'type' in self.format['data']['header']:
+            field = self.format['data']['header']['type']
+            headers = np.nonzero(frame_type == self.frame_types.index('header'))[0]
+            if len(headers) > 0:
+                header_type = ((words[headers] >> np.uint64(field['shift'])) & np.uint64(field['mask'] >> field['shift'])).astype(np.int8)
+                data_type = np.repeat(
+                    np.concatenate([[self.type], header_type]).astype(np.int8),
+                    np.diff(np.concatenate([[0], headers, [n]])),
+                )
+                self.type = int(header_type[-1])
+        # unknown types are read like type 0
+        data_type[(data_type < 0) | (data_type >= len(self.data_types))] = 0
+
+        # Every word gets a code for the set of fields it has:
+        # frame types first, then one code per data type (numbered from 0), and the last one for unidentified words.
+        n_codes = len(self.frame_types) + len(self.data_types) + 1
+        code = frame_type.copy()
+        code[frame_type < 0] = n_codes - 1
+        if 'data' in self.frame_types:
+            is_data = frame_type == self.frame_types.index('data')
+            code = np.where(is_data, data_type + len(self.frame_types), code).astype(np.int8)
+            data_type[~is_data] = 0
+        else:
+            data_type[:] = 0
+        field_sets = [(t, self.format['data'][t] if t != 'data' else []) for t in self.frame_types]
+        field_sets += [('data', self.data_types[t]) for t in range(len(self.data_types))]
+        field_sets += [(None, [])]
+        code_bit = np.left_shift(np.uint32(1), code.astype(np.uint32))
+
+        res = {
+            'frame_type': frame_type,
+            'data_type': data_type,
+            'raw': words & np.uint64(0xFFFFFFFFFF),
+            'meta': (words >> np.uint64(40)) & np.uint64(0xFFFFFF),
+        }
+        has_field = {}
+        for d, dtype in self.get_fields().items():
+            # most fields sit at the same bits for all the frame types that have them
+            bits = {}
+            for i, (t, names) in enumerate(field_sets):
+                if d in names:
+                    field = self.format['data'][t][d]
+                    bits[(field['mask'], field['shift'])] = bits.get((field['mask'], field['shift']), 0) | (1 << i)
+            res[d] = None
+            for (mask, shift), codes in bits.items():
+                if codes not in has_field:
+                    np.bitwise_and(code_bit, np.uint32(codes), out=tmp)
+                    has_field[codes] = tmp.astype(bool)
+                if shift >= 32:
+                    value = np.right_shift(high, np.uint32(shift - 32), out=tmp).astype(dtype)
+                elif mask < 2**32:
+                    value = np.right_shift(low, np.uint32(shift), out=tmp).astype(dtype)
+                else:
+                    value = (words >> np.uint64(shift)).astype(dtype)
+                if (mask >> shift) != np.iinfo(dtype).max:
+                    value &= dtype.type(mask >> shift)
+                value *= has_field[codes]
+                if res[d] is None:
+                    res[d] = value
+                else:
+                    res[d] |= value
+
+        return res
+
 if __name__ == '__main__':
 
     test_words = [
@@ -2,6 +2,7 @@
 For ETROC control
 """
 import time
+import threading
 import numpy as np
 from tamalero.utils import load_yaml, ffs, bit_count
 from tamalero.colors import red, green, yellow
@@ -19,6 +20,9 @@ if TYPE_CHECKING:
     from tamalero.ReadoutBoard import ReadoutBoard
 here = os.path.dirname(os.path.abspath(__file__))
 
+# row / column bits of all 256 in-pixel addresses
+PIXEL_OFFSETS = np.array([(row << 5) | (col << 9) for col in range(16) for row in range(16)])
+
 class ETROC():
     def __init__(
             self,
@@ -38,9 +42,14 @@ class ETROC():
             no_init = False,
             hard_reset = False,
             no_hard_reset_on_init = False,
+            i2c_cache = False,
     ):
         self.QINJ_delay = 504  # this is a fixed value for the default settings of ETROC2
         self.isfake = False
+        # opt-in shadow memory of the ETROC2 address space, see wr_adr / rd_adr
+        self.i2c_cache = i2c_cache
+        self.reset_cache_stats()
+        self.invalidate_cache()
         self.I2C_master = rb.DAQ_LPGBT if master.lower() == 'lpgbt' else rb.SCA
         self.master = master
         self.rb = rb
@@ -157,11 +166,76 @@ class ETROC():
                 self.regs[reg]['pixel'] << 15 )
         return tmp
 
+    # ==========================
+    # === SHADOW I2C MEMORY ====
+    # ==========================
+    # With i2c_cache=True every configuration byte that is read from or written to the chip
+    # is kept in a shadow copy of the 16 bit address space (-1 means unknown).
+    # Reads of configuration registers are served from the shadow memory,
+    # writes that would not change the content are skipped.
+    # Status registers are never cached.
+
+    def is_status_adr(self, adr):
+        if adr & 0x8000:
+            return bool(adr & 0x4000)  # in-pixel status
+        return bool(adr & 0x100)  # periphery status
+
+    def get_shadow_adrs(self, adr):
+        '''
+        returns the shadow memory addresses that are touched when writing to adr.
+        A broadcast write ends up in all 256 pixels.
+        '''
+        if adr & 0x8000 and adr & 0x2000:
+            return (adr & ~0x3FE0) | PIXEL_OFFSETS
+        return adr
+
+    def invalidate_cache(self, region='all'):
+        '''
+        forget the content of the shadow memory.
+        region - 'all', 'periphery' or 'pixel'
+        '''
+        if region == 'all' or not hasattr(self, 'shadow'):
+            self.shadow = np.full(2**16, -1, dtype=np.int16)
+        elif region == 'periphery':
+            self.shadow[:0x8000] = -1
+        elif region == 'pixel':
+            self.shadow[0x8000:] = -1
+        else:
+            raise ValueError(f"Unknown cache region {region}, choose between 'all', 'periphery' and 'pixel'")
+
+    def enable_cache(self):
+        self.invalidate_cache()
+        self.i2c_cache = True
+
+    def disable_cache(self):
+        self.i2c_cache = False
+        self.invalidate_cache()
+
+    def reset_cache_stats(self):
+        self.cache_stats = {
+            'hits': 0,
+            'misses': 0,
+            'skipped_writes': 0,
+            'i2c_reads': 0,
+            'i2c_writes': 0,
+        }
+
+    def get_cache_stats(self):
+        stats = dict(self.cache_stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits']/lookups if lookups > 0 else 0.
+        stats['i2c_transactions'] = stats['i2c_reads'] + stats['i2c_writes']
+        return stats
+
     def wr_adr(self, adr, val):
         if self.isfake:
             #print ("writing fake")
             self.write_adr(adr, val)
         else:
+            if self.i2c_cache and not self.is_status_adr(adr):
+                if (self.shadow[self.get_shadow_adrs(adr)] == val).all():
+                    self.cache_stats['skipped_writes'] += 1
+                    return
             success = False
             start_time = time.time()
             while not success:
@@ -172,22 +246,216 @@ class ETROC():
                     #print(f"I2C write has failed in ETROC {self.chip_id}, retrying")
                     if time.time() - start_time > 2:
                         print(f"I2C write has failed in ETROC {self.chip_id} and retries have timed out.")
+                        if self.i2c_cache:
+                            self.shadow[self.get_shadow_adrs(adr)] = -1
                         return 0
+            self.cache_stats['i2c_writes'] += 1
+            if self.i2c_cache and not self.is_status_adr(adr):
+                self.shadow[self.get_shadow_adrs(adr)] = val
 
     def rd_adr(self, adr):
         if self.isfake:
             #print ("reading fake")
             return self.read_adr(adr)
         else:
+            cached = self.i2c_cache and not self.is_status_adr(adr)
+            if cached:
+                # reading a broadcast address returns the addressed pixel
+                val = self.shadow[adr & ~0x2000]
+                if val >= 0:
+                    self.cache_stats['hits'] += 1
+                    return int(val)
+                self.cache_stats['misses'] += 1
             start_time = time.time()
             while True:
                 try:
-                    return self.I2C_read(adr)
+                    val = self.I2C_read(adr)
+                    break
                 except:
                     #print(f"I2C read has failed in ETROC {self.chip_id}, retrying")
                     if time.time() - start_time > 2:
                         print(f"I2C read has failed in ETROC {self.chip_id} and retries have timed out")
                         return 0
+            self.cache_stats['i2c_reads'] += 1
+            if cached:
+                self.shadow[adr & ~0x2000] = val
+            return val
+
+    def wr_adrs(self, adr_vals):
+        '''
+        adr_vals - list of (address, value) pairs
+        Write many registers in one go. Consecutive addresses within the same
+        block of 32 registers are merged into multi-byte writes, which are
+        sent with LPGBT.I2C_write_multi.
+        '''
+        if self.isfake or self.master.lower() != 'lpgbt':
+            for adr, val in adr_vals:
+                self.wr_adr(adr, val)
+            return
+
+        transactions = []
+        queued = {}
+        for adr, val in adr_vals:
+            if self.i2c_cache and not self.is_status_adr(adr):
+                # compare to the last queued value, the shadow memory is only updated once everything is written
+                if adr in queued:
+                    unchanged = queued[adr] == val
+                else:
+                    unchanged = (self.shadow[self.get_shadow_adrs(adr)] == val).all()
+                if unchanged:
+                    self.cache_stats['skipped_writes'] += 1
+                    continue
+            queued[adr] = val
+            if transactions:
+                last_adr, last_vals = transactions[-1]
+                # the lpGBT can write up to 16 bytes, two of which are the register address
+                if adr == last_adr + len(last_vals) and (adr >> 5) == (last_adr >> 5) and len(last_vals) < 14:
+                    last_vals.append(val)
+                    continue
+            transactions.append((adr, [val]))
+
+        if not transactions:
+            return
+
+        try:
+            self.I2C_master.I2C_write_multi(
+                transactions,
+                master=self.i2c_channel,
+                slave_addr=self.i2c_adr,
+            )
+        except:
+            # fall back to single writes, which come with their own retries
+            for adr, vals in transactions:
+                for i, val in enumerate(vals):
+                    if self.i2c_cache:
+                        self.shadow[self.get_shadow_adrs(adr + i)] = -1
+                    self.wr_adr(adr + i, val)
+            return
+
+        self.cache_stats['i2c_writes'] += len(transactions)
+        if self.i2c_cache:
+            for adr, vals in transactions:
+                for i, val in enumerate(vals):
+                    if not self.is_status_adr(adr + i):
+                        self.shadow[self.get_shadow_adrs(adr + i)] = val
+
+    def rd_adrs(self, adrs):
+        '''
+        adrs - list of addresses
+        Read many registers in one go. Consecutive addresses within the same
+        block of 32 registers are merged into multi-byte reads, which are
+        sent with LPGBT.I2C_read_batch.
+        '''
+        if self.isfake or self.master.lower() != 'lpgbt':
+            return [self.rd_adr(adr) for adr in adrs]
+
+        vals = {}
+        transactions = []
+        for adr in sorted(set(adrs)):
+            cached = self.i2c_cache and not self.is_status_adr(adr)
+            if cached:
+                val = self.shadow[adr & ~0x2000]
+                if val >= 0:
+                    self.cache_stats['hits'] += 1
+                    vals[adr] = int(val)
+                    continue
+                self.cache_stats['misses'] += 1
+            if transactions:
+                last_adr, nbytes = transactions[-1]
+                # the lpGBT can read up to 16 bytes
+                if adr == last_adr + nbytes and (adr >> 5) == (last_adr >> 5) and nbytes < 16:
+                    transactions[-1] = (last_adr, nbytes + 1)
+                    continue
+            transactions.append((adr, 1))
+
+        if transactions:
+            try:
+                reads = self.I2C_master.I2C_read_batch(
+                    transactions,
+                    master=self.i2c_channel,
+                    slave_addr=self.i2c_adr,
+                )
+                self.cache_stats['i2c_reads'] += len(transactions)
+            except:
+                # fall back to single reads, which come with their own retries
+                reads = [[self.rd_adr(adr + i) for i in range(nbytes)] for adr, nbytes in transactions]
+            for (adr, nbytes), read in zip(transactions, reads):
+                for i, val in enumerate(read):
+                    vals[adr + i] = val
+                    if self.i2c_cache and not self.is_status_adr(adr + i):
+                        self.shadow[(adr + i) & ~0x2000] = val
+
+        return [vals[adr] for adr in adrs]
+
+    def get_reg_adr_vals(self, reg, val, row=0, col=0, broadcast=False, queued=None):
+        '''
+        Returns the (address, value) pairs that write val to register reg, to be sent with wr_adrs.
+        queued - dict of address values that are already queued to be written, which are used
+        instead of the content of the chip. It is updated with the new values.
+        '''
+        masks    = self.regs[reg]['mask']
+        shifts   = list(map(ffs, masks))
+        n_bits   = [0] + list(map(bit_count, masks))
+        if val > 2**(sum(n_bits))-1:
+            raise RuntimeError(f"Value {val} is larger than the number of bits of register {reg} allow ({sum(n_bits)})")
+        if queued is None:
+            queued = {}
+
+        adr_vals = []
+        n_bits_total = 0
+        for i, a in enumerate(self.get_adr(reg, row=row, col=col, broadcast=broadcast)):
+            read = queued[a] if a in queued else self.rd_adr(a)
+            value = (((val >> (n_bits[i] + n_bits_total)) << shifts[i]) & masks[i]) | (read & ~masks[i])
+            n_bits_total += n_bits[i]
+            queued[a] = value
+            adr_vals.append((a, value))
+        return adr_vals
+
+    def get_pixel_adr_vals(self, pixels, regs):
+        '''
+        Read all addresses of the in-pixel registers regs for the pixels in one go with rd_adrs.
+        Returns a dict of the values, e.g. as queued for get_reg_adr_vals.
+        '''
+        adrs = sorted({a for row, col in pixels for reg in regs for a in self.get_adr(reg, row=row, col=col)})
+        return dict(zip(adrs, self.rd_adrs(adrs)))
+
+    def rd_reg_pixels(self, reg, pixels):
+        '''
+        reg - Register name of an in-pixel register
+        pixels - list of (row, col) tuples
+        Same as calling rd_reg for every pixel, but all the reads are sent with rd_adrs.
+        Returns an array with the values of the pixels.
+        '''
+        masks    = self.regs[reg]['mask']
+        shifts   = list(map(ffs, masks))
+        n_bits   = [0] + list(map(bit_count, masks))
+        adrs = [self.get_adr(reg, row=row, col=col) for row, col in pixels]
+        reads = iter(self.rd_adrs([a for adr in adrs for a in adr]))
+        res = []
+        for adr in adrs:
+            tmp = 0
+            n_bits_total = 0
+            for i, a in enumerate(adr):
+                read = (next(reads) & masks[i]) >> shifts[i]
+                tmp |= (read << (n_bits[i]+n_bits_total))
+                n_bits_total += n_bits[i]
+            res.append(tmp)
+        return np.array(res, dtype=int)
+
+    def wr_reg_pixels(self, reg, vals):
+        '''
+        reg - Register name of an in-pixel register
+        vals - 16x16 matrix of values to write, indexed as vals[row][col]
+        Same as calling wr_reg for every pixel, but the registers are read with rd_adrs
+        and all the writes are sent with wr_adrs.
+        Enabling the I2C cache avoids the read-back of the registers.
+        '''
+        pixels = [(row, col) for row in range(16) for col in range(16)]
+        queued = self.get_pixel_adr_vals(pixels, [reg])
+        adr_vals = []
+        for row, col in pixels:
+            adr_vals += self.get_reg_adr_vals(reg, int(vals[row][col]), row=row, col=col, queued=queued)
+        self.wr_adrs(adr_vals)
 
     # read & write using register name & pix num
     def wr_reg(self, reg, val, row=0, col=0, broadcast=False):
@@ -253,11 +521,13 @@ class ETROC():
             print("{:20s}".format(reg), [hex(x) for x in self.regs[reg]['address']], "DOC:", self.regs[reg]['doc'])
 
     def reset_perif(self):
+        self.invalidate_cache('periphery')
         for reg in self.regs:
             if self.regs[reg]['stat'] == 0 and self.regs[reg]['pixel'] == 0:
                 self.wr_reg(reg, self.regs[reg]['default'])
 
     def reset_pixel(self):
+        self.invalidate_cache('pixel')
         for reg in self.regs:
             if self.regs[reg]['stat'] == 0 and self.regs[reg]['pixel'] == 1:
                 self.wr_reg(reg, self.regs[reg]['default'], broadcast=True)
@@ -387,6 +657,7 @@ class ETROC():
                     self.rb.DAQ_LPGBT.set_gpio(self.reset_pin, 0)
                     time.sleep(0.05)
                     self.rb.DAQ_LPGBT.set_gpio(self.reset_pin, 1)
+                self.invalidate_cache()  # a hard reset brings back the power-up defaults
 
             else:
                 if self.is_connected():
@@ -624,9 +895,7 @@ class ETROC():
                 if thresholds == None :
                     self.run_threshold_scan(offset=offset, out_dir=out_dir)
                 else:
-                    for row in range(16):
-                        for col in range(16):
-                            self.wr_reg('DAC', int(thresholds[row][col]), row=row, col=col) # want to get some noise
+                    self.wr_reg_pixels('DAC', thresholds) # want to get some noise
             else:
                 self.disable_data_readout(broadcast=True)
                 self.wr_reg("workMode", 0, broadcast=True)
@@ -765,10 +1034,7 @@ class ETROC():
         else:
             return self.get_QInj(row=row, col=col)
 
-    def run_threshold_scan(self, offset='auto', use=True, out_dir=None):
-        print('Executing run_threshold_scan()...')
-        # isolate
-        #print(self.rd_reg('Bypass_THCal', row=1, col=1))
+    def prepare_threshold_scan(self):
         print('Isolating ETROC and setting max values for DAC and TH_offset')
         self.wr_reg('Bypass_THCal', 1, broadcast=True)
         self.wr_reg("disDataReadout", 0x1, broadcast=True) # Daniel = 0x0
@@ -777,24 +1043,12 @@ class ETROC():
         self.wr_reg("DAC", 1023, broadcast=True) # New (24/03/2025)
         self.wr_reg("TH_offset", 63, broadcast=True) # New (24/03/2025)
         #self.wr_reg('Bypass_THCal', 1, broadcast=True)
-        #
-        from tqdm import tqdm
-        baseline = np.empty([16, 16])
-        noise_width = np.empty([16, 16])
 
         print(f"VRefGen_PD: {self.rd_reg('VRefGen_PD')}")
         print(f"VRefGen_PD: {self.rd_reg('VRefGen_PD')}")
         print(f"VRefGen_PD: {self.rd_reg('VRefGen_PD')}")
-        print("Running threshold scan")
-        with tqdm(total=256, bar_format='{l_bar}{bar:20}{r_bar}{bar:-20b}') as pbar:
-            for pixel in range(256):
-                row = pixel & 0xF
-                col = (pixel & 0xF0) >> 4
-                #print(pixel, row, col)
-                baseline[row][col], noise_width[row][col] = self.auto_threshold_scan(row=row, col=col, broadcast=False, offset=offset, use=use)
-                #print(pixel)
-                pbar.update()
-        #
+
+    def finish_threshold_scan(self, baseline, noise_width, offset='auto', out_dir=None):
         print('Enabling data readout and trigger path...')
         self.wr_reg("disDataReadout", 0x0, broadcast=True) # Daniel = 0x1 
         self.wr_reg("disTrigPath", 0x0, broadcast=True) # New (24/03/2025)
@@ -813,9 +1067,7 @@ class ETROC():
             for col in range(16):
                 if int(thresholds[row][col]) > 1023:
                     print('Bad value (', int(thresholds[row][col]), ')! Setting to 1023')
-                    self.wr_reg('DAC', 1023, row=row, col=col)
-                else:
-                    self.wr_reg('DAC', int(thresholds[row][col]), row=row, col=col) # want to get some noise
+        self.wr_reg_pixels('DAC', np.clip(thresholds, 0, 1023)) # want to get some noise
         if out_dir is not None:
             with open(f'{out_dir}/thresholds_module_{self.module_id}_etroc_{self.chip_no}.yaml', 'w') as f:
                 dump(thresholds.tolist(), f, Dumper=Dumper,)
@@ -826,6 +1078,14 @@ class ETROC():
 
         return baseline, noise_width
 
+    def run_threshold_scan(self, offset='auto', use=True, out_dir=None, batch=1):
+        '''
+        Automatic threshold calibration of all pixels, batch pixels at a time.
+        See run_threshold_scans.
+        '''
+        print('Executing run_threshold_scan()...')
+        return run_threshold_scans([self], offset=offset, use=use, out_dir=out_dir, batch=batch)[0]
+
     def plot_threshold(self, outdir='../results/', noise_width=False):
         from matplotlib import pyplot as plt
         plt.style.use(hep.style.CMS)
@@ -970,6 +1230,64 @@ class ETROC():
 
         return baseline, noise_width
 
+    def arm_threshold_scan(self, pixels):
+        '''
+        Start the automatic threshold calibration of several pixels, see auto_threshold_scan.
+        pixels - list of (row, col) tuples
+        The register writes for all pixels are sent in one go with wr_adrs.
+        '''
+        regs = [
+            ("CLKEn_THCal", 1),
+            ("Bypass_THCal", 0),
+            ("BufEn_THCal", 1),
+            ("RSTn_THCal", 0),
+            ("RSTn_THCal", 1),
+            ("ScanStart_THCal", 1),
+            ("ScanStart_THCal", 0),
+        ]
+        queued = self.get_pixel_adr_vals(pixels, [reg for reg, val in regs])
+        adr_vals = []
+        for row, col in pixels:
+            for reg, val in regs:
+                adr_vals += self.get_reg_adr_vals(reg, val, row=row, col=col, queued=queued)
+        self.wr_adrs(adr_vals)
+
+    def collect_threshold_scan(self, pixels, offset='auto', time_out=3, verbose=False, use=True):
+        '''
+        Wait for the automatic threshold calibration of pixels started with arm_threshold_scan,
+        read the baselines and noise widths, and set the pixels back like auto_threshold_scan.
+        Returns arrays with the baseline and noise width of every pixel.
+        '''
+        pending = list(pixels)
+        start_time = time.time()
+        while pending:
+            done = self.rd_reg_pixels("ScanDone", pending)
+            pending = [pix for pix, d in zip(pending, done) if not d]
+            if not pending:
+                break
+            if time.time() - start_time > time_out:
+                if verbose:
+                    print(f"Auto threshold scan timed out for pixels {pending}")
+                break
+            time.sleep(0.01)
+
+        noise_width = self.rd_reg_pixels('NW', pixels)
+        baseline = self.rd_reg_pixels('BL', pixels)
+
+        queued = self.get_pixel_adr_vals(pixels, ['Bypass_THCal', 'DAC', 'TH_offset', "CLKEn_THCal", 'BufEn_THCal'])
+        adr_vals = []
+        for (row, col), bl, nw in zip(pixels, baseline, noise_width):
+            regs = [('Bypass_THCal', 1)]
+            if use:
+                regs.append(('DAC', int(min(bl + (nw if offset == 'auto' else offset), 1023))))
+            # From Murtaza: DAC/TH_offset to the maximum, turn off cal clk and buffer
+            regs += [('DAC', 1023), ('TH_offset', 63), ("CLKEn_THCal", 0), ('BufEn_THCal', 0)]
+            for reg, val in regs:
+                adr_vals += self.get_reg_adr_vals(reg, val, row=row, col=col, queued=queued)
+        self.wr_adrs(adr_vals)
+
+        return baseline, noise_width
+
     def setup_accumulator(self, row=0, col=0):
         self.wr_reg("CLKEn_THCal", 1, row=row, col=col, broadcast=False)
         self.wr_reg("BufEn_THCal", 1, row=row, col=col, broadcast=False)
@@ -1764,6 +2082,7 @@ class ETROC():
     # Reset power sequencer controller, active high
     def reset_Power(self):
         self.wr_reg('softBoot', 1)
+        self.invalidate_cache()
 
     # The register controlling the SCLK pulse width, ranging ranges from 3 us to 10 us with step of 0.5 us.
     # The default value is 4 corresponding to 5 us pulse width. Debugging use only.
@@ -2110,3 +2429,63 @@ class ETROC():
     # 32-bit EFuse output
     def get_EFuseOut(self):
         return self.rd_reg('EFuseQ')
+
+
+def run_threshold_scans(etrocs, offset='auto', use=True, out_dir=None, batch=1, time_out=3):
+    '''
+    Automatic threshold calibration of all pixels of several ETROCs.
+    The ETROCs on different lpGBT I2C masters are calibrated in separate threads, so that their
+    I2C transactions overlap. On every master, the calibration is started on batch pixels of
+    every ETROC before waiting for the results, so that the scans of these ETROCs run at the same time.
+    batch=1 (the default) calibrates the pixels of an ETROC one after the other, like auto_threshold_scan.
+    Larger batches run the in-pixel calibration of several pixels of the same ETROC at the same time,
+    which has not been validated on hardware yet.
+    Returns a list with the baseline and noise width matrices of every ETROC.
+    '''
+    from tqdm import tqdm
+    for etroc in etrocs:
+        etroc.prepare_threshold_scan()
+
+    baselines = [np.empty([16, 16]) for etroc in etrocs]
+    noise_widths = [np.empty([16, 16]) for etroc in etrocs]
+    pixels = [(pixel & 0xF, (pixel & 0xF0) >> 4) for pixel in range(256)]
+
+    # the I2C masters of the lpGBT work independently, everything else goes through a single thread
+    masters = {}
+    for i, etroc in enumerate(etrocs):
+        if etroc.isfake or etroc.master.lower() != 'lpgbt':
+            key = None
+        else:
+            key = (id(etroc.I2C_master), etroc.i2c_channel)
+        masters.setdefault(key, []).append(i)
+
+    print("Running threshold scan")
+    with tqdm(total=256*len(etrocs), bar_format='{l_bar}{bar:20}{r_bar}{bar:-20b}') as pbar:
+        def scan(indices):
+            for i in range(0, 256, batch):
+                batch_pixels = pixels[i:i+batch]
+                rows, cols = np.array(batch_pixels).T
+                for j in indices:
+                    etrocs[j].arm_threshold_scan(batch_pixels)
+                for j in indices:
+                    baselines[j][rows, cols], noise_widths[j][rows, cols] = etrocs[j].collect_threshold_scan(batch_pixels, offset=offset, time_out=time_out, use=use)
+                    pbar.update(len(batch_pixels))
+
+        if len(masters) == 1:
+            scan(list(masters.values())[0])
+        else:
+            errors = []
+            def run(indices):
+                try:
+                    scan(indices)
+                except Exception as e:
+                    errors.append(e)
+            threads = [threading.Thread(target=run, args=(indices,)) for indices in masters.values()]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if errors:
+                raise errors[0]
+
+    return [etroc.finish_threshold_scan(baseline, noise_width, offset=offset, out_dir=out_dir) for etroc, baseline, noise_width in zip(etrocs, baselines, noise_widths)]
@@ -7,7 +7,7 @@ import os
 
 from tamalero.utils import load_yaml, ffs, bit_count
 from tamalero.ETROC import ETROC
-from crcETROC import mod2div
+from crcETROC import crc_frames
 
 here = os.path.dirname(os.path.abspath(__file__))
 maxpixel = 256
@@ -51,11 +51,11 @@ class ETROC2_Emulator(ETROC):
         self.nbits = self.format['nbits']
 
         # generate fake baseline/noise properties per pixel
-        self.bl_means  = [[np.random.normal(700, 2.0) for x in range(16)] for y in range(16)]
-        self.bl_stdevs = [[np.random.normal(  1, .2) for x in range(16)] for y in range(16)]
+        self.bl_means  = np.random.normal(700, 2.0, (16, 16))
+        self.bl_stdevs = np.random.normal(  1,  .2, (16, 16))
 
         # this represents the registers on the actual chip
-        self.register = {adr: 0 for adr in range(2**16)}  # fill all registers with 0
+        self.register = bytearray(2**16)  # fill all registers with 0
 
         self.default_config()
 
@@ -69,34 +69,37 @@ class ETROC2_Emulator(ETROC):
     def read_adr(self, adr):
         return self.register[adr]
 
+    def pack(self, frame_type, fields):
+        '''
+        Format words of frame_type from a dictionary of fields (numbers or arrays).
+        '''
+        word = np.uint64(self.format['identifiers'][frame_type]['frame'])
+        for datatype in fields:
+            field = self.format['data'][frame_type][datatype]
+            word = word | ((np.asarray(fields[datatype], dtype=np.uint64) << np.uint64(field['shift'])) & np.uint64(field['mask']))
+        return word
+
     # add hit data to self.L1Adata & increment hit counter
     def add_hit(self, row, col):
-        # generate random data
-        data = {
-                'ea'     : 0,
-                'row_id' : row,
-                'col_id' : col,
-                'toa'    : np.random.randint(0,500),
-                'cal'    : np.random.randint(0,500),
-                'tot'    : np.random.randint(0,500),
-                }
-        # format data
-        word = self.format['identifiers']['data']['frame']
-        for datatype in data:
-            word = ( word +
-                ((data[datatype]<<self.format['data']['data'][datatype]['shift'])
-                &self.format['data']['data'][datatype]['mask']) )
-
         if self.data['hits'] < 255:
             # the data format does not allow us to actually have 256 hits
             # so we always have to cut the last one if there would be 100% occupancy
-            self.L1Adata.append(word)
+            # generate random data
+            toa, cal, tot = np.random.randint(0, 500, 3)
+            self.L1Adata.append(int(self.pack('data', {'ea': 0, 'row_id': row, 'col_id': col, 'toa': toa, 'cal': cal, 'tot': tot})))
 
             # inc Nhits
             self.data['hits'] += 1
 
         return None
 
+    def get_hits(self, N):
+        '''
+        Random hit maps (N x 16 x 16) of N L1As.
+        A pixel has a hit if its signal, drawn from its baseline and noise, is above threshold.
+        '''
+        vth = self.get_Vth_mV()
+        return np.random.normal(self.bl_means, self.bl_stdevs, (N, 16, 16)) > vth
 
     # run one L1A
     def runL1A(self):
@@ -104,50 +107,65 @@ class ETROC2_Emulator(ETROC):
         self.L1Adata = [] # wipe previous L1A data
         self.data['l1counter'] += 1
 
-        for row in range(16):
-            for col in range(16):
-                # produce random hit
-                val = np.random.normal(self.bl_means[row][col], self.bl_stdevs[row][col])
-                # if we have a hit
-                if val > self.get_Vth_mV():
-                    self.add_hit(row, col)
+        for row, col in zip(*np.nonzero(self.get_hits(1)[0])):
+            self.add_hit(row, col)
 
         data = self.get_data()
         return data
 
+    def run_block(self, N):
+        '''
+        Vectorized version of run.
+        Returns the words (header, data, trailer with CRC) of N L1As as an array of uint64.
+        '''
+        hits = self.get_hits(N).reshape(N, 256)
+        # the data format does not allow us to actually have 256 hits, so the last one is cut
+        hits &= np.cumsum(hits, axis=1) <= 255
+        nhits = hits.sum(axis=1)
+        event, pixel = np.nonzero(hits)
+
+        l1counter = self.data['l1counter'] + 1 + np.arange(N)
+        self.data['l1counter'] += N
+        self.data['hits'] = int(nhits[-1]) if N > 0 else 0
+
+        header = self.pack('header', {'l1counter': l1counter, 'type': self.data['type'], 'bcid': self.data['bcid']})
+        data = self.pack('data', {
+            'ea': 0,
+            'row_id': pixel // 16,
+            'col_id': pixel % 16,
+            'toa': np.random.randint(0, 500, len(pixel)),
+            'cal': np.random.randint(0, 500, len(pixel)),
+            'tot': np.random.randint(0, 500, len(pixel)),
+        })
+        trailer = self.pack('trailer', {'chipid': self.data['chipid'], 'status': self.data['status'], 'hits': nhits})
+
+        # frame every L1A as header, data, trailer
+        n_words = nhits + 2
+        ends = np.cumsum(n_words)
+        starts = ends - n_words
+        words = np.empty(ends[-1] if N > 0 else 0, dtype=np.uint64)
+        words[starts] = header
+        words[ends - 1] = trailer
+        first_hit = np.cumsum(nhits) - nhits
+        words[starts[event] + 1 + np.arange(len(event)) - first_hit[event]] = data
+
+        # Computing CRC and adding it to the trailer
+        words[ends - 1] |= crc_frames(words, n_words).astype(np.uint64)
+        return words
 
     # run N L1As and return all data from them
     def run(self, N):
-        data = []
-        for i in range(N):
-            self.runL1A()
-            data += self.get_data()
-        return data
+        return self.run_block(N).tolist()
 
 
     # return full data package (list of words) for most recent L1A
     def get_data(self):
-        # form header word
-        header = self.format['identifiers']['header']['frame']
-        for datatype in ['l1counter', 'type', 'bcid']:
-            header = ( header +
-                ((self.data[datatype]<<self.format['data']['header'][datatype]['shift'])
-                &self.format['data']['header'][datatype]['mask']) )
-
-        # form trailer word
-        trailer = self.format['identifiers']['trailer']['frame']
-        for datatype in ['chipid', 'status', 'hits', 'crc']:
-            trailer = ( trailer +
-                ((self.data[datatype]<<self.format['data']['trailer'][datatype]['shift'])
-                &self.format['data']['trailer'][datatype]['mask']) )
+        header = int(self.pack('header', {datatype: self.data[datatype] for datatype in ['l1counter', 'type', 'bcid']}))
+        trailer = int(self.pack('trailer', {datatype: self.data[datatype] for datatype in ['chipid', 'status', 'hits', 'crc']}))
 
         frame = [header] + self.L1Adata + [trailer]
 
         #Computing CRC and adding it to the trailer
-        poly ='100101111' #crc generator polynomial
-        binstr40 = np.vectorize(lambda x: f'{x:040b}') #joining event frames into a string of bits
-        merged_frames = "".join(binstr40(frame)) 
-        crc_val = mod2div(merged_frames,poly) #compute CRC value
-        frame[-1] = trailer +int(crc_val,2) 
-        
-        return frame
\ No newline at end of file
+        frame[-1] = trailer + int(crc_frames(frame, [len(frame)])[0])
+
+        return frame
@@ -2,7 +2,7 @@ import struct
 import os
 import time
 import numpy as np
-from tamalero.utils import chunk
+from tamalero.utils import chunk, merge_words
 from yaml import load, dump
 from tamalero.DataFrame import DataFrame
 from uhal._core import exception as uhal_exception
@@ -15,28 +15,6 @@ except ImportError:
 def revbits(x):
     return int(f'{x:08b}'[::-1],2)
 
-def merge_words(res):
-    '''
-    this function merges 32 bit words from the fifo into 64 bit words (40bit ETROC2 + added meta data in the DAQ)
-    it strips empty entries and removes orphan 32 bit words that could be present at the end of a FIFO read
-    '''
-    if len(res) > 0:
-        # offset is only needed when zero suppression is turned off, and packet boundaries are not defined
-        # it relies on the fact that the second 32 bit word is half empty (8 bit ETROC data + 12 bits meta data)
-        # if we ever add more meta data this has to be revisited
-        #offset = 1 if (res[1] > res[0]) else 0
-        offset = 0
-        #print(f"## Offset is {offset=}")
-        #offset = 0
-        res = res[offset:]
-        #empty_frame_mask = np.array(res[0::2]) > (2**8)  # masking empty fifo entries
-        #print(res)
-        empty_frame_mask = np.array(res[0::2]) > 0  # masking empty fifo entries FIXME verify that this does not cause troubles! remove mask if possible
-        len_cut = min(len(res[0::2]), len(res[1::2]))  # ensuring equal length of arrays downstream
-        return list (np.array(res[0::2])[:len_cut][empty_frame_mask[:len_cut]] | (np.array(res[1::2]) << 32)[:len_cut][empty_frame_mask[:len_cut]])
-    else:
-        return []
-
 class FIFO:
     def __init__(self, rb, block=255):
         self.rb = rb
@@ -45,17 +23,21 @@ class FIFO:
             self.reset()
 
     def ready(self):
-        self.rb.kcu.write_node("READOUT_BOARD_%s.ERR_CNT_RESET"%self.rb.rb, 0x1)
-        tmp_err_cnt = self.rb.kcu.read_node("READOUT_BOARD_%s.ERROR_CNT"%self.rb.rb).value()
+        with self.rb.kcu.batch():
+            self.rb.kcu.write_node("READOUT_BOARD_%s.ERR_CNT_RESET"%self.rb.rb, 0x1)
+            tmp_err_cnt = self.rb.kcu.read_node("READOUT_BOARD_%s.ERROR_CNT"%self.rb.rb)
+        tmp_err_cnt = tmp_err_cnt.value()
         start_time = time.time()
         while tmp_err_cnt != self.rb.kcu.read_node("READOUT_BOARD_%s.ERROR_CNT"%self.rb.rb).value():
             print("Redoing bitslip")
             self.reset()
             self.enable_bitslip()
             time.sleep(0.1)
-            self.disable_bitslip()
-            self.rb.kcu.write_node("READOUT_BOARD_%s.ERR_CNT_RESET"%self.rb.rb, 0x1)
-            tmp_err_cnt = self.rb.kcu.read_node("READOUT_BOARD_%s.ERROR_CNT"%self.rb.rb).value()
+            with self.rb.kcu.batch():
+                self.disable_bitslip()
+                self.rb.kcu.write_node("READOUT_BOARD_%s.ERR_CNT_RESET"%self.rb.rb, 0x1)
+                tmp_err_cnt = self.rb.kcu.read_node("READOUT_BOARD_%s.ERROR_CNT"%self.rb.rb)
+            tmp_err_cnt = tmp_err_cnt.value()
 
             if time.time() > start_time + 2:
                 print("Time out, FIFO might not work as expected.")
@@ -95,44 +77,70 @@ class FIFO:
         self.rb.kcu.write_node("READOUT_BOARD_%s.RX_FIFO_DATA_SRC"%self.rb.rb, 0x0)
         self.reset()
 
-    def set_trigger_rate(self, rate):
-        # set rate in Hz
+    def set_trigger_rate(self, rate, wait=0.5):
+        # set rate in Hz, the measured rate is read back after wait seconds
         rate_setting = rate / 25E-9 / (0xffffffff) * 10000
         self.rb.kcu.write_node("SYSTEM.L1A_RATE", int(rate_setting))
-        time.sleep(0.5)
+        time.sleep(wait)
         return self.get_trigger_rate()
 
     def get_trigger_rate(self):
         rate = self.rb.kcu.read_node("SYSTEM.L1A_RATE_CNT").value()
         return rate
 
-    def send_l1a(self, count=1, quiet=True):
+    def send_l1a(self, count=1, quiet=True, max_rate=-1, rate=None, burst=False, return_count=False):
+        '''
+        Send count L1As.
+        By default they are sent one per IPbus dispatch, at most at max_rate (Hz), see KCU.send_pulses.
+        burst=True sends them back-to-back in as few IPbus packets as possible.
+        With a rate (Hz) the firmware trigger generator is used instead, see run_trigger_generator.
+        Returns the achieved rate in Hz, or with return_count=True the number of L1As that were sent
+        and the rate. With the trigger generator that number is only an estimate.
+        '''
+        if rate:
+            n_sent, rate = self.run_trigger_generator(count, rate)
+            if not quiet:
+                print(f"Sent about {n_sent} L1As (estimated from L1A_RATE_CNT) at a rate of {rate}Hz")
+        else:
+            n_sent, rate = self.rb.kcu.send_pulses("SYSTEM.L1A_PULSE", count=count, max_rate=max_rate, burst=burst)
+            if not quiet:
+                print(f"Sent {n_sent} L1As at a rate of {rate}Hz")
+        if return_count:
+            return n_sent, rate
+        return rate
+
+    def run_trigger_generator(self, count, rate):
+        '''
+        Run the firmware L1A generator at rate (Hz) for as long as it takes to send count L1As.
+        The firmware does not count the L1As it sends, so the returned number of L1As is
+        an estimate from the rate measured with L1A_RATE_CNT and the time the generator was on.
+        Returns the estimated number of L1As and the measured rate.
+        '''
         start_time = time.time()
-        for i in range(count):
-            try:
-                self.rb.kcu.write_node("SYSTEM.L1A_PULSE", 1)
-            except:
-                print("Couldn't send pulse.")
+        measured_rate = self.set_trigger_rate(rate, wait=count/rate)
+        self.rb.kcu.write_node("SYSTEM.L1A_RATE", 0)
         timediff = time.time() - start_time
-        rate = count/timediff
-        if not quiet:
-            print(f"Sent {count} L1As at a rate of {rate}Hz")
-        return rate
+        return int(round(measured_rate*timediff)), measured_rate
 
-    def send_QInj(self, count=1, delay=0, omit_l1a = False):
-        if omit_l1a: 
+    def send_QInj(self, count=1, delay=0, omit_l1a=False, max_rate=-1, quiet=True, burst=False, return_count=False):
+        '''
+        Send count charge injection pulses, followed by an L1A after delay clock cycles unless omit_l1a is set.
+        Like for send_l1a, the pulses are sent one per IPbus dispatch, at most at max_rate (Hz).
+        burst=True sends them back-to-back, in which case pulses and their delayed L1As can overlap.
+        With return_count=True, returns the number of pulses that were sent and the achieved rate in Hz.
+        '''
+        if omit_l1a:
             self.rb.kcu.write_node("READOUT_BOARD_%s.TRIG_DLY_SEL"%self.rb.rb, delay)
             # self.rb.kcu.write_node("READOUT_BOARD_%s.L1A_INJ_DLY"%self.rb.rb, delay)
+            node = "READOUT_BOARD_%s.QINJ_PULSE" % self.rb.rb
         else:
             self.rb.kcu.write_node("READOUT_BOARD_%s.L1A_INJ_DLY"%self.rb.rb, delay)
-        for i in range(count):
-            try:
-                if omit_l1a:
-                    self.rb.kcu.write_node("READOUT_BOARD_%s.QINJ_PULSE" % self.rb.rb, 0x01)
-                else:
-                    self.rb.kcu.write_node("READOUT_BOARD_%s.L1A_QINJ_PULSE" % self.rb.rb, 0x01)
-            except:
-                print("Couldn't send pulse.")
+            node = "READOUT_BOARD_%s.L1A_QINJ_PULSE" % self.rb.rb
+        n_sent, rate = self.rb.kcu.send_pulses(node, count=count, max_rate=max_rate, burst=burst)
+        if not quiet:
+            print(f"Sent {n_sent} charge injections at a rate of {rate}Hz")
+        if return_count:
+            return n_sent, rate
 
     def reset(self):
         self.rb.kcu.write_node("READOUT_BOARD_%s.FIFO_RESET" % self.rb.rb, 0x01)
@@ -141,8 +149,9 @@ class FIFO:
         '''
         only needed for ILA debugging
         '''
-        self.rb.kcu.write_node("READOUT_BOARD_%s.FIFO_ELINK_SEL0" % self.rb.rb, elink)
-        self.rb.kcu.write_node("READOUT_BOARD_%s.FIFO_LPGBT_SEL0" % self.rb.rb, lpgbt)
+        with self.rb.kcu.batch():
+            self.rb.kcu.write_node("READOUT_BOARD_%s.FIFO_ELINK_SEL0" % self.rb.rb, elink)
+            self.rb.kcu.write_node("READOUT_BOARD_%s.FIFO_LPGBT_SEL0" % self.rb.rb, lpgbt)
 
     def read_block(self, block, dispatch=False):
         success = False
@@ -169,12 +178,18 @@ class FIFO:
         #last_block = occupancy % self.block
         #if verbose: print(f"{last_block=}")
         data = []
-        while self.get_occupancy()>0:
-            # FIXME checking get_occupancy all the time is slow, but this is at least not broken.
+        occupancy = self.get_occupancy()
+        while occupancy>0:
+            # the block read and the occupancy check for the next iteration share one dispatch
             try:
-               data += self.read_block(250, dispatch=dispatch).value()
+                with self.rb.kcu.batch():
+                    block = self.rb.kcu.read_block(f"DAQ_RB{self.rb.rb}", 250)
+                    occupancy = self.rb.kcu.read_node(f"READOUT_BOARD_{self.rb.rb}.RX_FIFO_OCCUPANCY")
+                data += block.value()
+                occupancy = occupancy.value()
             except:
-               print('Data read failed')
+                print('Data read failed')
+                occupancy = self.get_occupancy()
 
         #if (num_blocks_to_read or last_block):
         #    if dispatch:
@@ -6,8 +6,76 @@ try:
 except ModuleNotFoundError:
     print("Running without uhal (ipbus not installed with correct python bindings)")
 from tamalero.colors import red, green
+from contextlib import contextmanager
+import threading
 import time
 
+
+class DeferredRead:
+    '''
+    Result of a read_node inside of KCU.batch().
+    The read is queued together with all other transactions of the batch,
+    and resolved once the batch is dispatched.
+    Asking for the value before that flushes the queue.
+    '''
+    def __init__(self, kcu, valword):
+        self.kcu = kcu
+        self.valword = valword
+
+    def resolve(self):
+        if not self.valword.valid():
+            self.kcu.flush()
+        return self.valword
+
+    def valid(self):
+        return self.resolve().valid()
+
+    def value(self):
+        return self.resolve().value()
+
+    def __int__(self):
+        return int(self.value())
+
+    def __index__(self):
+        return int(self.value())
+
+    def __bool__(self):
+        return bool(self.value())
+
+    def __eq__(self, other):
+        return self.value() == other
+
+    def __ne__(self, other):
+        return self.value() != other
+
+    def __lt__(self, other):
+        return self.value() < other
+
+    def __gt__(self, other):
+        return self.value() > other
+
+    def __and__(self, other):
+        return self.value() & other
+
+    __rand__ = __and__
+
+    def __or__(self, other):
+        return self.value() | other
+
+    __ror__ = __or__
+
+    def __rshift__(self, other):
+        return self.value() >> other
+
+    def __lshift__(self, other):
+        return self.value() << other
+
+    def __repr__(self):
+        if self.valword.valid():
+            return f"DeferredRead({self.valword.value()})"
+        return "DeferredRead(pending)"
+
+
 class KCU:
 
     def __init__(self,
@@ -19,6 +87,15 @@ class KCU:
         uhal.disableLogging()
         self.auto_dispatch = True  # default -> True
 
+        # state of batch() contexts
+        # The lock is held for the whole batch, so that threads (e.g. one per lpGBT I2C master)
+        # can share the KCU: their batches are sent one after the other, never mixed.
+        self.lock = threading.RLock()
+        self.batch_depth = 0
+        self.n_queued = 0
+        self.max_batch_size = 1000  # flush a batch after this many transactions
+        self.n_dispatches = 0
+
         self.dummy = dummy
 
         self.max_retries = 20
@@ -36,25 +113,79 @@ class KCU:
         self.auto_dispatch = False
 
     def dispatch(self):
-        i = 0
-        while i<self.max_retries:
+        with self.lock:
+            i = 0
+            while i<self.max_retries:
+                try:
+                    self.hw.dispatch()
+                    self.n_dispatches += 1
+                    self.n_queued = 0
+                    # inside a batch we keep queueing after an explicit dispatch
+                    self.auto_dispatch = self.batch_depth == 0
+                    break
+                except:
+                    if i > (self.max_retries-2):
+                        raise
+                    i+=1
+
+    def flush(self):
+        '''
+        dispatch all queued transactions.
+        uhal splits the queue into as few IPbus packets as the packet size allows.
+        '''
+        if self.n_queued > 0:
+            self.dispatch()
+
+    @contextmanager
+    def batch(self):
+        '''
+        Queue all register accesses within the context and dispatch them at once, e.g.
+
+        with kcu.batch():
+            kcu.write_node("READOUT_BOARD_0.FIFO_RESET", 1)
+            occupancy = kcu.read_node("READOUT_BOARD_0.RX_FIFO_OCCUPANCY")
+        print(occupancy.value())
+
+        Reads return a DeferredRead that is resolved when the batch is flushed.
+        Asking for the value of a read before the end of the batch dispatches everything queued so far.
+        Batches can be nested, the outermost one dispatches.
+        Batches that grow beyond max_batch_size transactions are flushed in between.
+        Other threads wait until the outermost batch is dispatched.
+        '''
+        with self.lock:
+            self.batch_depth += 1
+            self.auto_dispatch = False
             try:
-                self.hw.dispatch()
-                self.auto_dispatch = True
-                break
-            except:
-                if i > (self.max_retries-2):
-                    raise
-                i+=1
+                yield self
+            finally:
+                self.batch_depth -= 1
+                if self.batch_depth == 0:
+                    try:
+                        self.flush()
+                    finally:
+                        self.auto_dispatch = True
+
+    def is_batching(self):
+        return self.batch_depth > 0
+
+    def queued(self):
+        '''
+        book keeping of transactions that were queued without dispatch
+        '''
+        self.n_queued += 1
+        if self.batch_depth > 0 and self.n_queued >= self.max_batch_size:
+            self.flush()
 
     def write_node(self, id, value):
-        reg = self.hw.getNode(id)
-        if (reg.getPermission() == uhal.NodePermission.WRITE):
-            self.action_reg(reg)
-        else:
-            reg.write(value)
-            if self.auto_dispatch:
-                self.dispatch()
+        with self.lock:
+            reg = self.hw.getNode(id)
+            if (reg.getPermission() == uhal.NodePermission.WRITE):
+                self.action_reg(reg)
+            else:
+                reg.write(value)
+                self.queued()
+                if self.auto_dispatch:
+                    self.dispatch()
 
     def rd_lpgbt_adr(self, rb=0):
         '''
@@ -71,21 +202,40 @@ class KCU:
         return None
 
     def read_node(self, id):
-        try:
-            reg = self.hw.getNode(id)
-        except:
-            raise Exception(f"Failed finding node {id} in read_node")
-        ret = reg.read()
-        if self.auto_dispatch:
-            self.dispatch()
-        return ret
+        with self.lock:
+            try:
+                reg = self.hw.getNode(id)
+            except:
+                raise Exception(f"Failed finding node {id} in read_node")
+            ret = reg.read()
+            if self.batch_depth > 0:
+                ret = DeferredRead(self, ret)
+            self.queued()
+            if self.auto_dispatch:
+                self.dispatch()
+            return ret
+
+    def read_block(self, id, size):
+        '''
+        block read, e.g. of a FIFO. Returns a DeferredRead inside of a batch.
+        '''
+        with self.lock:
+            ret = self.hw.getNode(id).readBlock(size)
+            if self.batch_depth > 0:
+                ret = DeferredRead(self, ret)
+            self.queued()
+            if self.auto_dispatch:
+                self.dispatch()
+            return ret
 
     def action_reg(self, reg):
-        addr = reg.getAddress()
-        mask = reg.getMask()
-        self.hw.getClient().write(addr, mask)
-        if self.auto_dispatch:
-            self.dispatch()
+        with self.lock:
+            addr = reg.getAddress()
+            mask = reg.getMask()
+            self.hw.getClient().write(addr, mask)
+            self.queued()
+            if self.auto_dispatch:
+                self.dispatch()
 
     def action(self, id):
         reg = self.hw.getNode(id)
@@ -230,17 +380,54 @@ class KCU:
 
         return errs
 
-    def send_l1a(self, count=1, quiet=True, max_rate=-1):
+    def send_pulses(self, id, count=1, max_rate=-1, burst=False):
+        '''
+        Pulse a node count times, e.g. SYSTEM.L1A_PULSE.
+        By default every pulse is dispatched on its own, so the pulses are at least one IPbus
+        round trip apart, and with a max_rate (Hz) there is a sleep in between.
+        With burst=True the pulses are queued in batches of max_batch_size, so that they go out
+        in as few IPbus packets as possible. The pulses within a packet are then only a few
+        IPbus transactions apart, far above the trigger rate ETROC2 can take, and charge injections
+        with a delayed L1A can overlap. Only use it when the receiving end can handle that.
+        With a max_rate, the packets of a burst are spaced to keep the average rate below it.
+        Returns the number of pulses that were sent, and the achieved rate in Hz.
+        '''
         sleeper = 1./max_rate if max_rate>0 else 0
+        n_sent = 0
         start_time = time.time()
-        for i in range(count):
-            time.sleep(sleeper)
-            try:
-                self.write_node("SYSTEM.L1A_PULSE", 1)
-            except:
-                print("Couldn't send pulse.")
+        if not burst:
+            for i in range(count):
+                time.sleep(sleeper)
+                try:
+                    self.write_node(id, 1)
+                    n_sent += 1
+                except:
+                    print("Couldn't send pulse.")
+        else:
+            while n_sent < count:
+                n = min(self.max_batch_size, count - n_sent)
+                try:
+                    with self.batch():
+                        for i in range(n):
+                            self.write_node(id, 1)
+                except:
+                    print(f"Couldn't send pulses, sent {n_sent} out of {count}.")
+                    break
+                n_sent += n
+                if n_sent < count:
+                    time.sleep(n*sleeper)
         timediff = time.time() - start_time
-        rate = count/timediff
+        rate = n_sent/timediff if timediff > 0 else 0
+        return n_sent, rate
+
+    def send_l1a(self, count=1, quiet=True, max_rate=-1, burst=False, return_count=False):
+        '''
+        Send count L1As, one per IPbus dispatch, at most at max_rate (Hz), or in a burst (see send_pulses).
+        Returns the achieved rate in Hz, or with return_count=True the number of L1As sent and the rate.
+        '''
+        n_sent, rate = self.send_pulses("SYSTEM.L1A_PULSE", count=count, max_rate=max_rate, burst=burst)
         if not quiet:
-            print(f"Sent {count} L1As at a rate of {rate}Hz")
+            print(f"Sent {n_sent} L1As at a rate of {rate}Hz")
+        if return_count:
+            return n_sent, rate
         return rate
@@ -43,6 +43,7 @@ class LPGBT(RegParser):
         The trigger lpGBT is accessed through I2C of the master (= DAQ lpGBT).
         '''
         self.nodes = {}
+        self.i2c_adrs = {}
         self.rb = rb
         self.trigger = trigger
         self.calibrated = False
@@ -407,28 +408,39 @@ class LPGBT(RegParser):
             return self.master.I2C_write(adr, data)
             #raise NotImplementedError("rd_adr does only read from the master lpGBT, and you're trying to write to a servant")
         else:
-            self.kcu.toggle_dispatch()
-            #self.kcu.write_node("READOUT_BOARD_%d.SC.TX_GBTX_ADDR" % self.rb, 115)
-            self.kcu.write_node("READOUT_BOARD_%d.SC.TX_REGISTER_ADDR" % self.rb, adr)
-            self.kcu.write_node("READOUT_BOARD_%d.SC.TX_DATA_TO_GBTX" % self.rb, data)
-            self.kcu.action("READOUT_BOARD_%d.SC.TX_WR" % self.rb)
-            self.kcu.action("READOUT_BOARD_%d.SC.TX_START_WRITE" % self.rb)
-            self.kcu.dispatch()
+            # all four transactions go out in one dispatch,
+            # or get queued with everything else if we're already inside a batch
+            with self.kcu.batch():
+                #self.kcu.write_node("READOUT_BOARD_%d.SC.TX_GBTX_ADDR" % self.rb, 115)
+                self.kcu.write_node("READOUT_BOARD_%d.SC.TX_REGISTER_ADDR" % self.rb, adr)
+                self.kcu.write_node("READOUT_BOARD_%d.SC.TX_DATA_TO_GBTX" % self.rb, data)
+                self.kcu.action("READOUT_BOARD_%d.SC.TX_WR" % self.rb)
+                self.kcu.action("READOUT_BOARD_%d.SC.TX_START_WRITE" % self.rb)
 
     def rd_adr(self, adr):
         if self.trigger:
             return self.master.I2C_read(adr)
             #raise NotImplementedError("rd_adr does only read from the master lpGBT, and you're trying to read from a servant")
-        else:
-            self.kcu.toggle_dispatch()
+        elif self.kcu.is_batching():
+            # Send the read request together with everything queued so far.
+            # The reply is picked up with the next dispatch of the batch,
+            # so the IC transaction still gets (at least) one round trip to complete.
             self.kcu.write_node("READOUT_BOARD_%d.SC.TX_REGISTER_ADDR" % self.rb, adr)
-            self.kcu.dispatch()
             self.kcu.action("READOUT_BOARD_%d.SC.TX_START_READ" % self.rb)
-            valid = self.kcu.read_node("READOUT_BOARD_%d.SC.RX_DATA_VALID" % self.rb).valid()
-            if valid:
-                # this only means that the KCU successfully read data
-                # not necessarily does it mean there's communication with the lpGBT
-                return self.kcu.read_node("READOUT_BOARD_%d.SC.RX_DATA_FROM_GBTX" % self.rb)
+            self.kcu.flush()
+            return self.kcu.read_node("READOUT_BOARD_%d.SC.RX_DATA_FROM_GBTX" % self.rb)
+        else:
+            # several dispatches that share the auto dispatch state of the KCU, keep other threads out
+            with self.kcu.lock:
+                self.kcu.toggle_dispatch()
+                self.kcu.write_node("READOUT_BOARD_%d.SC.TX_REGISTER_ADDR" % self.rb, adr)
+                self.kcu.dispatch()
+                self.kcu.action("READOUT_BOARD_%d.SC.TX_START_READ" % self.rb)
+                valid = self.kcu.read_node("READOUT_BOARD_%d.SC.RX_DATA_VALID" % self.rb).valid()
+                if valid:
+                    # this only means that the KCU successfully read data
+                    # not necessarily does it mean there's communication with the lpGBT
+                    return self.kcu.read_node("READOUT_BOARD_%d.SC.RX_DATA_FROM_GBTX" % self.rb)
 
             print("LpGBT read failed!")
             return None
@@ -1220,17 +1232,14 @@ class LPGBT(RegParser):
     def I2C_write_single(self, reg=0x0, val=0, master=2, slave_addr=0x70, freq=2):
         pass
 
-    def I2C_write(self, reg=0x0, val=10, master=2, slave_addr=0x70, adr_nbytes=2, freq=2, verbose=False, ignore_response=False):
+    def get_I2C_adrs(self, master=2):
         '''
-        reg: target register
-        val: has to be a single byte, or a list of single bytes.
-        master: lpGBT master (2 by default)
-        this function is following https://lpgbt.web.cern.ch/lpgbt/v0/i2cMasters.html#example-2-multi-byte-write
+        Register addresses of the I2C master `master` of this lpGBT.
+        These only depend on the lpGBT version and are looked up once,
+        instead of walking the register tree for every I2C transaction.
         '''
-
-        self.kcu.toggle_dispatch()
-
-        i2cm = master
+        if (self.ver, master) in self.i2c_adrs:
+            return self.i2c_adrs[(self.ver, master)]
 
         i2cm1cmd = self.get_node('LPGBT.RW.I2C.I2CM1CMD').real_address
         i2cm0cmd = self.get_node('LPGBT.RW.I2C.I2CM0CMD').real_address
@@ -1239,17 +1248,30 @@ class LPGBT(RegParser):
         if self.ver == 0:
             i2cm1status = self.LPGBT_CONST.I2CM1STATUS
             i2cm0status = self.LPGBT_CONST.I2CM0STATUS
+            i2cm0read15 = self.LPGBT_CONST.I2CM0READ15
         else:
             i2cm1status = self.get_node('LPGBT.RO.I2CREAD.I2CM1STATUS').real_address
             i2cm0status = self.get_node('LPGBT.RO.I2CREAD.I2CM0STATUS').real_address
+            i2cm0read15 = self.get_node("LPGBT.RO.I2CREAD.I2CM0READ.I2CM0READ15").real_address
 
-        i2cm0data0 = self.get_node('LPGBT.RW.I2C.I2CM0DATA0').real_address
-        i2cm0cmd = self.get_node('LPGBT.RW.I2C.I2CM0CMD').real_address
-        i2cm0address = self.get_node('LPGBT.RW.I2C.I2CM0ADDRESS').real_address
+        OFFSET_WR = master*(i2cm1cmd - i2cm0cmd) #using the offset trick to switch between masters easily
+        OFFSET_RD = master*(i2cm1status - i2cm0status)
 
-        OFFSET_WR = i2cm*(i2cm1cmd - i2cm0cmd) #using the offset trick to switch between masters easily
-        OFFSET_RD = i2cm*(i2cm1status - i2cm0status)
+        self.i2c_adrs[(self.ver, master)] = {
+            'cmd': i2cm0cmd + OFFSET_WR,
+            'address': self.get_node('LPGBT.RW.I2C.I2CM0ADDRESS').real_address + OFFSET_WR,
+            'data': [self.get_node("LPGBT.RW.I2C.I2CM0DATA%d"%i).real_address + OFFSET_WR for i in range(4)],
+            'status': i2cm0status + OFFSET_RD,
+            'read': [abs(i-i2cm0read15) + OFFSET_RD for i in range(16)],
+        }
+        return self.i2c_adrs[(self.ver, master)]
 
+    def I2C_queue_write(self, adrs, reg, val, slave_addr=0x70, adr_nbytes=2, freq=2):
+        '''
+        Queue the lpGBT register writes of a multi-byte I2C write,
+        following https://lpgbt.web.cern.ch/lpgbt/v0/i2cMasters.html#example-2-multi-byte-write
+        Nothing is dispatched here, and the status is not checked.
+        '''
         adr_bytes = [ ((reg >> (8*i)) & 0xff) for i in range(adr_nbytes) ]
         if type(val) == int:
             data_bytes = [val]
@@ -1260,172 +1282,156 @@ class LPGBT(RegParser):
         nbytes = len(adr_bytes+data_bytes)
 
         self.wr_adr(
-            i2cm0data0+OFFSET_WR,
+            adrs['data'][0],
             nbytes<<self.LPGBT_CONST.I2CM_CR_NBYTES_of | freq<<self.LPGBT_CONST.I2CM_CR_FREQ_of,
         )
         self.wr_adr(
-            i2cm0cmd+OFFSET_WR,
+            adrs['cmd'],
             self.LPGBT_CONST.I2CM_WRITE_CRA,
         )
         for i, data_byte in enumerate(adr_bytes+data_bytes):
             page    = int(i/4)
             offset  = int(i%4)
-            
+
             self.wr_adr(
-                i2cm0data0 + OFFSET_WR + offset,
+                adrs['data'][offset],
                 data_byte
             )
 
             if i%4==3 or i==(nbytes-1):
                 self.wr_adr(
-                    i2cm0cmd+OFFSET_WR,
+                    adrs['cmd'],
                     self.LPGBT_CONST.I2CM_W_MULTI_4BYTE0+page,
                 )
 
-        self.wr_adr(i2cm0address+OFFSET_WR, slave_addr)# write the address of the follower
-        self.wr_adr(i2cm0cmd+OFFSET_WR, self.LPGBT_CONST.I2CM_WRITE_MULTI)# execute write (c)
+        self.wr_adr(adrs['address'], slave_addr)# write the address of the follower
+        self.wr_adr(adrs['cmd'], self.LPGBT_CONST.I2CM_WRITE_MULTI)# execute write (c)
 
-        self.kcu.dispatch()
-
-        if not ignore_response:
-            status = self.rd_adr(i2cm0status+OFFSET_RD)
-            retries = 0
-            while (status != self.LPGBT_CONST.I2CM_SR_SUCC_bm):
-                status = self.rd_adr(i2cm0status+OFFSET_RD).value()
-                retries += 1
-                if retries > 50:
-                    raise TimeoutError(f"I2C write failed after 50 retries, status={status}")
-
-    def I2C_read(self, reg=0x0, master=2, slave_addr=0x70, nbytes=1, adr_nbytes=2, freq=2, verbose=False, timeout=0.1):
-        #https://gitlab.cern.ch/lpgbt/pigbt/-/blob/master/backend/apiapp/lpgbtLib/lowLevelDrivers/MASTERI2C.py#L83
+    def I2C_wait(self, adrs, status=None, retries=50, msg="I2C write failed"):
+        '''
+        Poll the status register of the I2C master until the last transaction succeeded.
+        status: the status that has already been read back (int, ValWord or deferred read),
+        or None to read it first.
+        The status has to be read in a packet sent after the one that issued the I2C command:
+        a status read in the same packet can still report SUCC from the previous transaction,
+        as the lpGBT has not started the new one yet.
+        '''
+        if status is None:
+            with self.kcu.batch():
+                status = self.rd_adr(adrs['status'])
+        status = status if isinstance(status, int) else status.value()
+        i = 0
+        while (status != self.LPGBT_CONST.I2CM_SR_SUCC_bm):
+            with self.kcu.batch():
+                status = self.rd_adr(adrs['status'])
+            status = status.value()
+            i += 1
+            if i > retries:
+                raise TimeoutError(f"{msg} after {retries} retries, status={status}")
 
-        # debugging
-        #print("### LPGBT.I2C_read ###")
-        #print(f"reg: {reg}, \tmaster: {master}, \tslave_addr: {slave_addr}, \tnbytes: {nbytes}, \tadr_nbytes: {adr_nbytes}, \tfreq: {freq}, \tver: {self.ver}")
+    def I2C_write(self, reg=0x0, val=10, master=2, slave_addr=0x70, adr_nbytes=2, freq=2, verbose=False, ignore_response=False):
+        '''
+        reg: target register
+        val: has to be a single byte, or a list of single bytes.
+        master: lpGBT master (2 by default)
+        this function is following https://lpgbt.web.cern.ch/lpgbt/v0/i2cMasters.html#example-2-multi-byte-write
+        All lpGBT register writes are sent in a single batch, the status is polled afterwards.
+        '''
+        adrs = self.get_I2C_adrs(master)
 
-        i2cm      = master
+        with self.kcu.batch():
+            self.I2C_queue_write(adrs, reg, val, slave_addr=slave_addr, adr_nbytes=adr_nbytes, freq=freq)
 
-        i2cm1cmd = self.get_node('LPGBT.RW.I2C.I2CM1CMD').real_address
-        i2cm0cmd = self.get_node('LPGBT.RW.I2C.I2CM0CMD').real_address
+        if not ignore_response:
+            self.I2C_wait(adrs, msg="I2C write failed")
 
-        # debugging
-        #print(f"i2cm1cmd: {i2cm1cmd}, \ti2cm0cmd: {i2cm0cmd}")
+    def I2C_write_multi(self, transactions, master=2, slave_addr=0x70, adr_nbytes=2, freq=2):
+        '''
+        Execute a list of I2C writes one after the other.
+        transactions: list of (reg, val) tuples, with val a single byte or a list of bytes.
 
-        if self.ver == 0:
-            i2cm1status = self.LPGBT_CONST.I2CM1STATUS
-            i2cm0status = self.LPGBT_CONST.I2CM0STATUS
-        else:
-            i2cm1status = self.get_node('LPGBT.RO.I2CREAD.I2CM1STATUS').real_address
-            i2cm0status = self.get_node('LPGBT.RO.I2CREAD.I2CM0STATUS').real_address
+        Each write is sent in one batch, and its status is polled before the next write is issued,
+        so that a write is never started while the previous one is still running.
+        '''
+        adrs = self.get_I2C_adrs(master)
 
-        i2cm0data0 = self.get_node('LPGBT.RW.I2C.I2CM0DATA0').real_address
-        i2cm0cmd = self.get_node('LPGBT.RW.I2C.I2CM0CMD').real_address
-        i2cm0address = self.get_node('LPGBT.RW.I2C.I2CM0ADDRESS').real_address
+        for reg, val in transactions:
+            with self.kcu.batch():
+                self.I2C_queue_write(adrs, reg, val, slave_addr=slave_addr, adr_nbytes=adr_nbytes, freq=freq)
+            self.I2C_wait(adrs, msg="I2C write failed")
 
-        OFFSET_WR = i2cm*(i2cm1cmd - i2cm0cmd) #using the offset trick to switch between masters easily
-        OFFSET_RD = i2cm*(i2cm1status - i2cm0status)
+    def I2C_read(self, reg=0x0, master=2, slave_addr=0x70, nbytes=1, adr_nbytes=2, freq=2, verbose=False, timeout=0.1):
+        #https://gitlab.cern.ch/lpgbt/pigbt/-/blob/master/backend/apiapp/lpgbtLib/lowLevelDrivers/MASTERI2C.py#L83
 
-        # debugging
-        #print(f"i2cm1status: {i2cm1status}, \ti2cm0status: {i2cm0status}, \ti2cm0data0: {i2cm0data0}, \ti2cm0cmd: {i2cm0cmd}, \ti2cm0address: {i2cm0address}, \tOFFSET_WR: {OFFSET_WR}, \tOFFSET_RD: {OFFSET_RD}")
+        adrs = self.get_I2C_adrs(master)
 
         ################################################################################
         # Write the register address
         ################################################################################
 
-        self.kcu.toggle_dispatch()
+        with self.kcu.batch():
+            # https://lpgbt.web.cern.ch/lpgbt/v0/i2cMasters.html#i2c-write-cr-0x0
+            self.wr_adr(adrs['data'][0], adr_nbytes<<self.LPGBT_CONST.I2CM_CR_NBYTES_of | (freq<<self.LPGBT_CONST.I2CM_CR_FREQ_of))
+            self.wr_adr(adrs['cmd'], self.LPGBT_CONST.I2CM_WRITE_CRA) #write to config register
 
-        # https://lpgbt.web.cern.ch/lpgbt/v0/i2cMasters.html#i2c-write-cr-0x0
-        self.wr_adr(i2cm0data0+OFFSET_WR, adr_nbytes<<self.LPGBT_CONST.I2CM_CR_NBYTES_of | (freq<<self.LPGBT_CONST.I2CM_CR_FREQ_of))
-        # debugging
-        #print(f"Address: {i2cm0data0+OFFSET_WR}, \tValue: {adr_nbytes<<self.LPGBT_CONST.I2CM_CR_NBYTES_of | (freq<<self.LPGBT_CONST.I2CM_CR_FREQ_of)}")
-        self.wr_adr(i2cm0cmd+OFFSET_WR, self.LPGBT_CONST.I2CM_WRITE_CRA) #write to config register
-        # debugging
-        #print(f"Address: {i2cm0cmd+OFFSET_WR}, \tValue: {self.LPGBT_CONST.I2CM_WRITE_CRA}")
-
-        # https://lpgbt.web.cern.ch/lpgbt/v0/i2cMasters.html#i2c-w-multi-4byte0-0x8
-        for i in range (adr_nbytes):
-            self.wr_adr(self.get_node("LPGBT.RW.I2C.I2CM0DATA%d"%i).real_address + OFFSET_WR, (reg >> (8*i)) & 0xff )
-            # debugging
-            #print(f"Address: {self.get_node('LPGBT.RW.I2C.I2CM0DATA%d'%i).real_address + OFFSET_WR}, \tValue: {(reg >> (8*i)) & 0xff}, \ti: {i}")
-        # self.wr_adr(self.LPGBT_CONST.I2CM0DATA1 + OFFSET_WR , regh)
-        self.wr_adr(i2cm0cmd+OFFSET_WR, self.LPGBT_CONST.I2CM_W_MULTI_4BYTE0) # prepare a multi-write
-        # debugging
-        #print(f"Address: {i2cm0cmd+OFFSET_WR}, \tValue: {self.LPGBT_CONST.I2CM_W_MULTI_4BYTE0}")
-
-        # https://lpgbt.web.cern.ch/lpgbt/v0/i2cMasters.html#i2c-write-multi-0xc
-        self.wr_adr(i2cm0address+OFFSET_WR, slave_addr)
-        # debugging
-        #print(f"Address: {i2cm0address+OFFSET_WR}, \tValue: {slave_addr}")
-        self.wr_adr(i2cm0cmd+OFFSET_WR, self.LPGBT_CONST.I2CM_WRITE_MULTI)# execute multi-write
-        # debugging
-        #print(f"Address: {i2cm0cmd+OFFSET_WR}, \tValue: {self.LPGBT_CONST.I2CM_WRITE_MULTI}")
+            # https://lpgbt.web.cern.ch/lpgbt/v0/i2cMasters.html#i2c-w-multi-4byte0-0x8
+            for i in range (adr_nbytes):
+                self.wr_adr(adrs['data'][i], (reg >> (8*i)) & 0xff )
+            self.wr_adr(adrs['cmd'], self.LPGBT_CONST.I2CM_W_MULTI_4BYTE0) # prepare a multi-write
 
-        self.kcu.dispatch()
-
-        status = self.rd_adr(i2cm0status+OFFSET_RD)
+            # https://lpgbt.web.cern.ch/lpgbt/v0/i2cMasters.html#i2c-write-multi-0xc
+            self.wr_adr(adrs['address'], slave_addr)
+            self.wr_adr(adrs['cmd'], self.LPGBT_CONST.I2CM_WRITE_MULTI)# execute multi-write
 
-        # debugging
-        #print(f"status: {status}, LPGBT_CONST.I2CM_SR_SUCC_bm: {self.LPGBT_CONST.I2CM_SR_SUCC_bm}, Address: {i2cm0status+OFFSET_RD}")
-
-        retries = 0
-        while (status != self.LPGBT_CONST.I2CM_SR_SUCC_bm):
-            status = self.rd_adr(i2cm0status+OFFSET_RD).value()
-            # debugging
-            #print(f"Updating status: {status}, retries: {retries}")
-            retries += 1
-            if retries > 50:
-                raise TimeoutError(f"I2C transaction failed after 50 retries because of an issue in writing the register address, status={status}")
+        self.I2C_wait(adrs, msg="I2C transaction failed because of an issue in writing the register address")
 
         ################################################################################
         # Write the data
         ################################################################################
 
-        self.kcu.toggle_dispatch()
-
-        # https://lpgbt.web.cern.ch/lpgbt/v0/i2cMasters.html#i2c-write-cr-0x0
-        self.wr_adr(i2cm0data0+OFFSET_WR, nbytes<<self.LPGBT_CONST.I2CM_CR_NBYTES_of | freq<<self.LPGBT_CONST.I2CM_CR_FREQ_of)
-        self.wr_adr(i2cm0cmd+OFFSET_WR, self.LPGBT_CONST.I2CM_WRITE_CRA) #write to config register
+        with self.kcu.batch():
+            # https://lpgbt.web.cern.ch/lpgbt/v0/i2cMasters.html#i2c-write-cr-0x0
+            self.wr_adr(adrs['data'][0], nbytes<<self.LPGBT_CONST.I2CM_CR_NBYTES_of | freq<<self.LPGBT_CONST.I2CM_CR_FREQ_of)
+            self.wr_adr(adrs['cmd'], self.LPGBT_CONST.I2CM_WRITE_CRA) #write to config register
 
-        # https://lpgbt.web.cern.ch/lpgbt/v0/i2cMasters.html#i2c-read-multi-0xd
-        self.wr_adr(i2cm0address+OFFSET_WR, slave_addr) #write the address of follower first
-        self.wr_adr(i2cm0cmd+OFFSET_WR, self.LPGBT_CONST.I2CM_READ_MULTI)# execute read
+            # https://lpgbt.web.cern.ch/lpgbt/v0/i2cMasters.html#i2c-read-multi-0xd
+            self.wr_adr(adrs['address'], slave_addr) #write the address of follower first
+            self.wr_adr(adrs['cmd'], self.LPGBT_CONST.I2CM_READ_MULTI)# execute read
 
-        self.kcu.dispatch()
+        # pick up the data together with the first status poll, in the packet after the read command.
+        # The data is only used if that status already reports success, otherwise it is read again.
+        with self.kcu.batch():
+            status = self.rd_adr(adrs['status'])
+            reads = [self.rd_adr(adrs['read'][i]) for i in range(nbytes)]
 
-        status = self.rd_adr(i2cm0status+OFFSET_RD)
+        if status.value() != self.LPGBT_CONST.I2CM_SR_SUCC_bm:
+            self.I2C_wait(adrs, status, msg="I2C transaction failed because of an issue in reading back the data")
+            with self.kcu.batch():
+                reads = [self.rd_adr(adrs['read'][i]) for i in range(nbytes)]
 
-        # debugging
-        #print(f"status: {status}")
-
-        retries = 0
-        while (status != self.LPGBT_CONST.I2CM_SR_SUCC_bm):
-            status = self.rd_adr(i2cm0status+OFFSET_RD).value()
-            retries += 1
-            if retries > 50:
-                raise TimeoutError(f"I2C transaction failed after 50 retries because of an issue in reading back the data, status={status}")
+        read_values = [read.value() for read in reads]
 
-        read_values = []
-
-        if self.ver == 0:
-            i2cm0read15 = self.LPGBT_CONST.I2CM0READ15
-        else:
-            i2cm0read15 = self.get_node("LPGBT.RO.I2CREAD.I2CM0READ.I2CM0READ15").real_address
-
-        # debugging
-        #print(f"i2cm0read15: {i2cm0read15}")
-
-        for i in range(0, nbytes):
-            tmp_adr = abs(i-i2cm0read15)+OFFSET_RD
-            # debugging
-            #print(f"tmp_adr: {tmp_adr}, \ttmp_adr_val: {self.rd_adr(tmp_adr).value()}")
-            read_values.append(self.rd_adr(tmp_adr).value())
-
-        #read_value = self.rd_adr(self.LPGBT_CONST.I2CM0READ15+OFFSET_RD) # get the read value. this is just the first byte
         if nbytes==1:
             return read_values[0]  # this is so bad, but needed for compatibility with wr_reg
         else:
             return read_values
 
+    def I2C_read_batch(self, transactions, master=2, slave_addr=0x70, adr_nbytes=2, freq=2):
+        '''
+        Execute a list of I2C reads one after the other.
+        transactions: list of (reg, nbytes) tuples.
+        Returns the list of read bytes for every transaction.
+
+        Like in I2C_write_multi, each read is confirmed by polling the status before the next one is issued.
+        The reads of different I2C masters can overlap when they are issued from separate threads,
+        see run_threshold_scans.
+        '''
+        res = []
+        for reg, nbytes in transactions:
+            val = self.I2C_read(reg, master=master, slave_addr=slave_addr, nbytes=nbytes, adr_nbytes=adr_nbytes, freq=freq)
+            res.append(val if nbytes > 1 else [val])
+        return res
+
     def program_slave_from_file (self, filename, master=2, slave_addr=0x70):
         if self.verbose:
             print(" > Programming Trigger lpGBT from file.")
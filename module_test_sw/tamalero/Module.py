@@ -2,12 +2,12 @@
 import os
 from tamalero.utils import load_yaml
 from tamalero.colors import red, green, yellow, blue
-from tamalero.ETROC import ETROC
+from tamalero.ETROC import ETROC, run_threshold_scans
 from tamalero.Monitoring import Lock
 from time import sleep
 
 class Module:
-    def __init__(self, rb, i=1, strict=False, enable_power_board=False, moduleid=0, poke=False, hard_reset=False, ext_vref=False, verbose=False):
+    def __init__(self, rb, i=1, strict=False, enable_power_board=False, moduleid=0, poke=False, hard_reset=False, ext_vref=False, verbose=False, i2c_cache=False):
         # don't like that this also needs a RB
         # think about a better solution
         self.config = rb.configuration['modules'][i]
@@ -58,6 +58,7 @@ class Module:
                             no_init = poke,
                             hard_reset = hard_reset,
                             no_hard_reset_on_init = (j != 0),
+                            i2c_cache = i2c_cache,
                         ))
                     all_good &= self.ETROCs[-1].get_elink_status(summary=True)
                 except RuntimeError:
@@ -114,11 +115,29 @@ class Module:
         return self.rb.SCA.read_gpio(self.config['power_board'])
 
     def enable_power_board(self):
+        self.invalidate_caches()
         return self.rb.SCA.set_gpio(self.config['power_board'], 1)
 
     def disable_power_board(self):
+        self.invalidate_caches()
         return self.rb.SCA.set_gpio(self.config['power_board'], 0)
 
+    def invalidate_caches(self):
+        # power cycling the module wipes the ETROC configuration
+        for etroc in getattr(self, 'ETROCs', []):
+            etroc.invalidate_cache()
+
+    def get_cache_stats(self):
+        return [etroc.get_cache_stats() for etroc in self.ETROCs]
+
+    def run_threshold_scan(self, offset='auto', use=True, out_dir=None, batch=1):
+        '''
+        Automatic threshold calibration of all connected ETROCs of the module at the same time,
+        see run_threshold_scans.
+        '''
+        etrocs = [etroc for etroc in self.ETROCs if etroc.is_connected()]
+        return run_threshold_scans(etrocs, offset=offset, use=use, out_dir=out_dir, batch=batch)
+
     def get_power_good(self):
         if self.rb.config.count('modulev0') and self.rb.ver<3:
             return self.rb.SCA.read_gpio(self.config['pgood'])
@@ -683,8 +683,9 @@ class ReadoutBoard:
 
     def disable_etroc_readout(self, elink=-1, slave=False, all=False):
         if all:
-            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.ETROC_DISABLE_SLAVE", 0x0FFFFFFF)
-            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.ETROC_DISABLE", 0x0FFFFFFF)
+            with self.kcu.batch():
+                self.kcu.write_node(f"READOUT_BOARD_{self.rb}.ETROC_DISABLE_SLAVE", 0x0FFFFFFF)
+                self.kcu.write_node(f"READOUT_BOARD_{self.rb}.ETROC_DISABLE", 0x0FFFFFFF)
         elif elink>=0 and elink<28:
             if slave:
                 disabled = self.kcu.read_node(f"READOUT_BOARD_{self.rb}.ETROC_DISABLE_SLAVE").value()
@@ -714,29 +715,38 @@ class ReadoutBoard:
                 self.kcu.write_node(f"READOUT_BOARD_{self.rb}.ETROC_DISABLE", 0)
 
     def reset_data_error_count(self):
-        self.kcu.write_node(f"READOUT_BOARD_{self.rb}.PACKET_CNT_RESET", 0x1)
-        self.kcu.write_node(f"READOUT_BOARD_{self.rb}.ERR_CNT_RESET", 0x1)
-        self.kcu.write_node(f"READOUT_BOARD_{self.rb}.DATA_CNT_RESET", 0x1)
+        with self.kcu.batch():
+            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.PACKET_CNT_RESET", 0x1)
+            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.ERR_CNT_RESET", 0x1)
+            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.DATA_CNT_RESET", 0x1)
 
     def read_filler_rate(self, elink, slave=False):
-        self.kcu.write_node(f"READOUT_BOARD_{self.rb}.FIFO_ELINK_SEL0", elink)
-        self.kcu.write_node(f"READOUT_BOARD_{self.rb}.FIFO_LPGBT_SEL0", 1 if slave else 0)
-        return self.kcu.read_node(f"READOUT_BOARD_{self.rb}.FILLER_RATE").value()
+        with self.kcu.batch():
+            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.FIFO_ELINK_SEL0", elink)
+            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.FIFO_LPGBT_SEL0", 1 if slave else 0)
+            res = self.kcu.read_node(f"READOUT_BOARD_{self.rb}.FILLER_RATE")
+        return res.value()
 
     def read_packet_count(self, elink, slave=False):
-        self.kcu.write_node(f"READOUT_BOARD_{self.rb}.FIFO_ELINK_SEL0", elink)
-        self.kcu.write_node(f"READOUT_BOARD_{self.rb}.FIFO_LPGBT_SEL0", 1 if slave else 0)
-        return self.kcu.read_node(f"READOUT_BOARD_{self.rb}.PACKET_CNT").value()
+        with self.kcu.batch():
+            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.FIFO_ELINK_SEL0", elink)
+            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.FIFO_LPGBT_SEL0", 1 if slave else 0)
+            res = self.kcu.read_node(f"READOUT_BOARD_{self.rb}.PACKET_CNT")
+        return res.value()
 
     def read_error_count(self, elink, slave=False):
-        self.kcu.write_node(f"READOUT_BOARD_{self.rb}.FIFO_ELINK_SEL0", elink)
-        self.kcu.write_node(f"READOUT_BOARD_{self.rb}.FIFO_LPGBT_SEL0", 1 if slave else 0)
-        return self.kcu.read_node(f"READOUT_BOARD_{self.rb}.ERROR_CNT").value()
+        with self.kcu.batch():
+            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.FIFO_ELINK_SEL0", elink)
+            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.FIFO_LPGBT_SEL0", 1 if slave else 0)
+            res = self.kcu.read_node(f"READOUT_BOARD_{self.rb}.ERROR_CNT")
+        return res.value()
 
     def read_data_count(self, elink, slave=False):
-        self.kcu.write_node(f"READOUT_BOARD_{self.rb}.FIFO_ELINK_SEL0", elink)
-        self.kcu.write_node(f"READOUT_BOARD_{self.rb}.FIFO_LPGBT_SEL0", 1 if slave else 0)
-        return self.kcu.read_node(f"READOUT_BOARD_{self.rb}.DATA_CNT").value()
+        with self.kcu.batch():
+            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.FIFO_ELINK_SEL0", elink)
+            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.FIFO_LPGBT_SEL0", 1 if slave else 0)
+            res = self.kcu.read_node(f"READOUT_BOARD_{self.rb}.DATA_CNT")
+        return res.value()
 
     def get_link_status(self, elink, slave=False, verbose=True):
         expected_filler_rate = 16500000
@@ -835,7 +845,7 @@ class ReadoutBoard:
             self.TRIG_LPGBT.set_gpio(f'MODULE_SELECT{pos_module}', 1) 
         print(f"Readout Board: Selected module {pos_module + 1}")          
 
-    def connect_modules(self, power_board=False, moduleids=[9996,9997,9998,9999], hard_reset=False, ext_vref=False, verbose=False):
+    def connect_modules(self, power_board=False, moduleids=[9996,9997,9998,9999], hard_reset=False, ext_vref=False, verbose=False, i2c_cache=False):
         if not power_board and self.ver > 3:
             self.TRIG_LPGBT.set_gpio('PENABLE1',1)
             self.TRIG_LPGBT.set_gpio('PENABLE2',1)
@@ -861,6 +871,7 @@ class ReadoutBoard:
                     hard_reset = hard_reset,
                     ext_vref=ext_vref,
                     verbose=verbose,
+                    i2c_cache=i2c_cache,
                 ),
             )
             if self.modules[-1].connected:
@@ -915,8 +926,9 @@ class ReadoutBoard:
         Bitmask to enable bits in the trigger link
         """
         # if we want per etroc granularity this needs to be more specific
-        for i in range(7):
-            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.TRIG_ENABLE_MASK_{i}", value) 
+        with self.kcu.batch():
+            for i in range(7):
+                self.kcu.write_node(f"READOUT_BOARD_{self.rb}.TRIG_ENABLE_MASK_{i}", value)
 
     def self_trig_elink_enable(self, link: int) -> None:
         """
@@ -946,14 +958,15 @@ class ReadoutBoard:
         """
         Returns all the registers for self trigger to the defualt value
         """
-        self.kcu.write_node(f"READOUT_BOARD_{self.rb}.TRIG_ENABLE", 0)
-        self.kcu.write_node(f"READOUT_BOARD_{self.rb}.TRIG_CLEAR", 0)
-        self.kcu.write_node(f"READOUT_BOARD_{self.rb}.TRIG_ELINK_ENABLE", 0)
-        self.kcu.write_node(f"READOUT_BOARD_{self.rb}.TRIG_UPLINK_SEL", 0)
-        for i in range(7):
-            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.TRIG_ENABLE_MASK_{i}", 0)
-        self.kcu.write_node(f"READOUT_BOARD_{self.rb}.SELF_TRIG_RESET",0)
-        self.kcu.write_node(f"READOUT_BOARD_{self.rb}.TRIG_DLY_SEL", 0)
+        with self.kcu.batch():
+            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.TRIG_ENABLE", 0)
+            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.TRIG_CLEAR", 0)
+            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.TRIG_ELINK_ENABLE", 0)
+            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.TRIG_UPLINK_SEL", 0)
+            for i in range(7):
+                self.kcu.write_node(f"READOUT_BOARD_{self.rb}.TRIG_ENABLE_MASK_{i}", 0)
+            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.SELF_TRIG_RESET",0)
+            self.kcu.write_node(f"READOUT_BOARD_{self.rb}.TRIG_DLY_SEL", 0)
 
     def self_trig_status(self):
         kcu_regs = [
@@ -967,5 +980,7 @@ class ReadoutBoard:
         ]
         kcu_regs += [f"READOUT_BOARD_{self.rb}.TRIG_ENABLE_MASK_{i}" for i in range(7)]
 
-        for r in kcu_regs:
-            print(r, hex(self.kcu.read_node(r).value()))
\ No newline at end of file
+        with self.kcu.batch():
+            reads = [self.kcu.read_node(r) for r in kcu_regs]
+        for r, read in zip(kcu_regs, reads):
+            print(r, hex(read.value()))
\ No newline at end of file
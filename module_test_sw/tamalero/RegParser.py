@@ -1,5 +1,11 @@
 import xml.etree.ElementTree as xml
 import os
+import pickle
+import hashlib
+from bisect import bisect_left
+
+# bump this whenever the content of the compiled address table cache changes
+CACHE_VERSION = 2
 
 
 class Node:
@@ -54,12 +60,128 @@ class RegParser(object):
                 self.address_table = os.path.expandvars('$TAMALERO_BASE/address_table/lpgbt_v2.xml')
         else:
             self.address_table = address_table
-        if verbose:
-            print('Parsing', self.address_table, '...')
-        self.tree = xml.parse(self.address_table)
-        root = self.tree.getroot()[0]
+        with open(self.address_table, 'rb') as f:
+            xml_hash = hashlib.sha256(f.read()).hexdigest()
+        cache_file = os.path.splitext(self.address_table)[0] + '.pkl'
+        if not self.load_cache(cache_file, xml_hash):
+            if verbose:
+                print('Parsing', self.address_table, '...')
+            self.tree = xml.parse(self.address_table)
+            root = self.tree.getroot()[0]
+            self.vars = {}
+            nodes = {}
+            self.make_tree(root, '', 0x0, nodes, None, self.vars, False)
+            self.nodes.update(nodes)
+            self.write_cache(cache_file, xml_hash, nodes)
+        elif verbose:
+            print('Loaded', self.address_table, 'from', cache_file)
+        self.make_index()
+
+    def write_cache(self, cache_file, xml_hash, nodes):
+        '''
+        Store the parsed tree as a flat list of node properties, with the parent and children as list indices.
+        Generated nodes can repeat a name, the earlier ones are then only reachable through the parent
+        and children links, so all linked nodes are stored to rebuild exactly the tree of parse_xml.
+        The cache is keyed by the hash of the xml file, so it is invalidated on any change.
+        '''
+        index = {}
+        all_nodes = []
+        todo = list(nodes.values())
+        while todo:
+            node = todo.pop()
+            if id(node) in index:
+                continue
+            index[id(node)] = len(all_nodes)
+            all_nodes.append(node)
+            todo.extend(node.children.values())
+            if node.parent is not None:
+                todo.append(node.parent)
+
+        flat = [(
+            node.name,
+            node.address,
+            node.real_address,
+            node.permission,
+            node.mask,
+            node.lsb_pos,
+            node.is_module,
+            node.mode,
+            node.level,
+            index[id(node.parent)] if node.parent is not None else None,
+            [index[id(child)] for child in node.children.values()],
+        ) for node in all_nodes]
+        names = [(name, index[id(node)]) for name, node in nodes.items()]
+        try:
+            with open(cache_file + '.tmp', 'wb') as f:
+                pickle.dump({'version': CACHE_VERSION, 'hash': xml_hash, 'top_node_name': self.top_node_name, 'nodes': flat, 'names': names}, f)
+            os.replace(cache_file + '.tmp', cache_file)
+        except OSError:
+            # a read-only address table directory just means we parse the xml every time
+            pass
+
+    def load_cache(self, cache_file, xml_hash):
+        '''
+        Rebuild the node tree from the cache file.
+        Returns False if there's no valid cache for this version of the xml file.
+        '''
+        try:
+            with open(cache_file, 'rb') as f:
+                cache = pickle.load(f)
+        except Exception:
+            return False
+        if cache.get('version') != CACHE_VERSION or cache.get('hash') != xml_hash or cache.get('top_node_name') != self.top_node_name:
+            return False
+
+        self.tree = None
         self.vars = {}
-        self.make_tree(root, '', 0x0, self.nodes, None, self.vars, False)
+        all_nodes = []
+        for name, address, real_address, permission, mask, lsb_pos, is_module, mode, level, _, _ in cache['nodes']:
+            new_node = Node(self.top_node_name)
+            new_node.name = name
+            new_node.address = address
+            new_node.real_address = real_address
+            new_node.permission = permission
+            new_node.mask = mask
+            new_node.lsb_pos = lsb_pos
+            new_node.is_module = is_module
+            new_node.mode = mode
+            new_node.level = level
+            all_nodes.append(new_node)
+        for new_node, (_, _, _, _, _, _, _, _, _, parent, children) in zip(all_nodes, cache['nodes']):
+            if parent is not None:
+                new_node.parent = all_nodes[parent]
+            for child in children:
+                new_node.addChild(all_nodes[child])
+        self.nodes.update({name: all_nodes[i] for name, i in cache['names']})
+        return True
+
+    def make_index(self):
+        '''
+        Sorted name and address indices of all nodes, used for the node lookups.
+        '''
+        self.node_order = {name: i for i, name in enumerate(self.nodes)}
+        self.sorted_names = sorted(self.nodes)
+        # names that contain the top node name somewhere else than at the start
+        # can match a query that starts with the top node name anywhere
+        self.names_with_repeated_top = [name for name in self.nodes if name.find(self.top_node_name, 1) > -1]
+        self.address_index = {}
+        for node in self.nodes.values():
+            if node.real_address not in self.address_index:
+                self.address_index[node.real_address] = node
+
+    def get_names_containing(self, nodeString):
+        '''
+        Names of all nodes containing nodeString, in the order of the address table.
+        Queries starting with the top node name are looked up as prefixes in the sorted names.
+        '''
+        if not nodeString.startswith(self.top_node_name):
+            return [name for name in self.nodes if nodeString in name]
+        names = set(name for name in self.names_with_repeated_top if nodeString in name)
+        i = bisect_left(self.sorted_names, nodeString)
+        while i < len(self.sorted_names) and self.sorted_names[i].startswith(nodeString):
+            names.add(self.sorted_names[i])
+            i += 1
+        return sorted(names, key=self.node_order.get)
 
     def make_tree(self, node, base_name, base_address, nodes, parent_node, vars, is_generated):
         if ((is_generated is None or is_generated is False) and
@@ -100,7 +222,7 @@ class RegParser(object):
             new_node.parent = parent_node
             new_node.level = parent_node.level+1
         for child in node:
-            self.make_tree(child, name, address, self.nodes, new_node, vars, False)
+            self.make_tree(child, name, address, nodes, new_node, vars, False)
 
     def dump(self, nMax=99999):
         for i, nodename in enumerate(list(self.nodes.keys())[:nMax]):
@@ -120,18 +242,11 @@ class RegParser(object):
         return thisnode
 
     def get_node_from_address(self, nodeAddress):
-        for key in self.nodes:
-            if self.nodes[key].real_address == nodeAddress:
-                return self.nodes[key]
+        return self.address_index.get(nodeAddress)
 
     def get_nodes_containing(self, nodeString):
 
-        nodelist = []
-
-        for key in self.nodes:
-            node = self.nodes[key]
-            if (nodeString in node.name):
-                nodelist.append(node)
+        nodelist = [self.nodes[name] for name in self.get_names_containing(nodeString)]
 
         if len(nodelist):
             return nodelist
@@ -142,9 +257,9 @@ class RegParser(object):
 
         nodelist = []
 
-        for key in self.nodes:
+        for key in self.get_names_containing(nodeString):
             node = self.nodes[key]
-            if (nodeString in node.name and node.permission is not None and 'r' in node.permission):
+            if (node.permission is not None and 'r' in node.permission):
                 nodelist.append(node)
 
         if len(nodelist):
@@ -413,6 +413,347 @@ def majority_vote(values, majority=None):
     #print(votes)
     return reduce(lambda x, y: x | y, votes)
 
+def sigmoid_fit_batch(x_axis, y, refine=True, max_rms=0.05, n_iter=30):
+    '''
+    Fit 1/(1+exp(a*(x-b))) to the S-curves of many pixels at once, y has the shape (pixels, len(x_axis)).
+    The slope a and mean b are estimated from the mean and width of the derivative of the S-curves,
+    and optionally refined with damped Gauss-Newton steps for all pixels together.
+    Pixels with a bad fit (RMS of the residuals above max_rms) are fitted with curve_fit one by one.
+    Returns the slopes, the means and a mask of the pixels that needed curve_fit.
+    '''
+    x = np.asarray(x_axis, dtype=float)
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+
+    # the derivative of the sigmoid is a logistic distribution with mean b and standard deviation pi/(sqrt(3)*|a|)
+    dy = np.clip(np.diff(y, axis=1), 0, None)
+    x_mid = (x[1:] + x[:-1]) / 2
+    norm = np.sum(dy, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        b = np.sum(dy * x_mid, axis=1) / norm
+        std = np.sqrt(np.sum(dy * (x_mid - b[:, None])**2, axis=1) / norm)
+    std = np.maximum(std, np.min(np.diff(x)) / 4)  # a step between two DAC values
+    a = -np.pi / (np.sqrt(3) * std)
+
+    def residuals(a, b):
+        with np.errstate(over='ignore', invalid='ignore'):
+            f = 1 / (1 + np.exp(np.clip(a[:, None] * (x - b[:, None]), -500, 500)))
+        r = y - f
+        return f, r, np.sum(r**2, axis=1)
+
+    f, r, sse = residuals(a, b)
+    if refine:
+        lam = np.full(len(y), 1e-3)
+        for i in range(n_iter):
+            # Levenberg-Marquardt step on the sum of squares, like curve_fit
+            d = f * (1 - f)
+            ja = -d * (x - b[:, None])
+            jb = d * a[:, None]
+            a11 = np.sum(ja * ja, axis=1) * (1 + lam)
+            a22 = np.sum(jb * jb, axis=1) * (1 + lam)
+            a12 = np.sum(ja * jb, axis=1)
+            ga = np.sum(ja * r, axis=1)
+            gb = np.sum(jb * r, axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                det = a11 * a22 - a12**2
+                a_new = np.minimum(a + (a22 * ga - a12 * gb) / det, 0)
+                b_new = b + (a11 * gb - a12 * ga) / det
+            f_new, r_new, sse_new = residuals(a_new, b_new)
+            better = sse_new < sse
+            a = np.where(better, a_new, a)
+            b = np.where(better, b_new, b)
+            f = np.where(better[:, None], f_new, f)
+            r = np.where(better[:, None], r_new, r)
+            sse = np.where(better, sse_new, sse)
+            lam = np.where(better, lam / 10, lam * 10)
+
+    failed = ~(np.isfinite(a) & np.isfinite(b) & (np.sqrt(sse / len(x)) <= max_rms))
+    if np.any(failed):
+        from scipy.optimize import curve_fit
+        for pix in np.nonzero(failed)[0]:
+            try:
+                res = curve_fit(
+                    lambda x, a, b: 1/(1+np.exp(a*(x-b))),
+                    x - x[0],
+                    y[pix],
+                    maxfev=10000,
+                    bounds=([-np.inf, -np.inf], [0, np.inf]),
+                )
+                a[pix], b[pix] = res[0][0], res[0][1] + x[0]
+            except (RuntimeError, ValueError):
+                pass
+    return a, b, failed
+
+def fifo_bytes(res):
+    '''
+    View of 32 bit FIFO words as little endian bytes.
+    bytes, bytearrays, memoryviews and uint32 arrays are not copied.
+    '''
+    if isinstance(res, (bytes, bytearray, memoryview)):
+        return np.frombuffer(res, dtype=np.uint8)
+    return np.ascontiguousarray(res, dtype='<u4').reshape(-1).view(np.uint8)
+
+def drop_empty_words(words, empty=0):
+    '''
+    Remove empty FIFO entries, i.e. merged words with a lower 32 bit word <= empty.
+    '''
+    keep = (words & np.uint64(0xFFFFFFFF)) > empty
+    return words if keep.all() else words[keep]
+
+def merge_words(res, empty=0):
+    '''
+    this function merges 32 bit words from the fifo into 64 bit words (40bit ETROC2 + added meta data in the DAQ)
+    res is the stream of 32 bit words, as list, array, or the raw (little endian) bytes as written by the DAQ.
+    Returns a uint64 array. Without empty entries this is a view of res, if res is bytes or a uint32 array.
+    It strips empty entries (lower 32 bit word <= empty) and removes an orphan 32 bit word that could be
+    present at the end of a FIFO read, use WordMerger to keep it for the next chunk of a stream.
+    '''
+    buf = fifo_bytes(res)
+    words = buf[:len(buf)//8*8].view('<u8').astype(np.uint64, copy=False)
+    return drop_empty_words(words, empty)
+
+class WordMerger:
+    '''
+    merge_words for a stream that is read in chunks.
+    Bytes at the end of a chunk that don't make a full 64 bit word are kept for the next chunk.
+    Counts the merged words and the dropped empty entries.
+    '''
+    def __init__(self, empty=0):
+        self.empty = empty
+        self.rest = np.zeros(0, dtype=np.uint8)
+        self.n_words = 0
+        self.n_empty = 0
+
+    def merge(self, res):
+        buf = fifo_bytes(res)
+        first = np.zeros(0, dtype=np.uint64)
+        if len(self.rest) > 0:
+            # complete the word that was split between the chunks
+            n_missing = 8 - len(self.rest)
+            if len(buf) < n_missing:
+                self.rest = np.concatenate([self.rest, buf])
+                return first
+            first = np.concatenate([self.rest, buf[:n_missing]]).view('<u8').astype(np.uint64)
+            buf = buf[n_missing:]
+        n_full = len(buf)//8*8
+        self.rest = buf[n_full:].copy()
+        words = buf[:n_full].view('<u8').astype(np.uint64, copy=False)
+        if len(first) > 0:
+            words = np.concatenate([first, words])
+        merged = drop_empty_words(words, self.empty)
+        self.n_words += len(merged)
+        self.n_empty += len(words) - len(merged)
+        return merged
+
+    def orphans(self):
+        '''
+        number of 32 bit words left over at the end of the stream
+        '''
+        return len(self.rest)//4
+
+def write_events(events, f_out, row_group_size=10000):
+    '''
+    Write an awkward array of events to a parquet file.
+    Row groups of row_group_size events allow to read big files in chunks.
+    '''
+    import awkward as ak
+    ak.to_parquet(events, f_out, row_group_size=row_group_size)
+
+class EventWriter:
+    '''
+    Write events to a parquet file chunk by chunk, in the same format as write_events.
+    The file is only created once there are events to write.
+    '''
+    def __init__(self, f_out, row_group_size=10000):
+        self.f_out = f_out
+        self.row_group_size = row_group_size
+        self.writer = None
+        self.n_events = 0
+
+    def write(self, events):
+        import awkward as ak
+        import pyarrow.parquet as pq
+        if len(events) == 0:
+            return
+        table = ak.to_arrow_table(events)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.f_out, table.schema, compression='zstd')
+        self.writer.write_table(table, row_group_size=self.row_group_size)
+        self.n_events += len(events)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def read_events(f_in, columns=None):
+    '''
+    Read events written by data_dumper, only loading the requested columns.
+    If a parquet file does not exist but a json file of the same name does,
+    the json file is read instead. These are the old outputs of data_dumper,
+    a json string of the events stored in a json file.
+    '''
+    import awkward as ak
+    import json
+    if f_in.endswith('.parquet') and not os.path.isfile(f_in) and os.path.isfile(f_in.replace('.parquet', '.json')):
+        f_in = f_in.replace('.parquet', '.json')
+    if f_in.endswith('.json'):
+        with open(f_in, 'r') as f:
+            events = ak.from_json(json.load(f))
+        if columns is not None:
+            events = events[columns]
+        return events
+    return ak.from_parquet(f_in, columns=columns)
+
+def event_keys(events, bcid_offset=0):
+    '''
+    8 bit L1A counter and BCID of every event, for matching events across boards.
+    '''
+    import awkward as ak
+    l1 = ak.to_numpy(events.l1counter).astype(np.int64) & 0xFF
+    bcid = ak.to_numpy(ak.fill_none(ak.firsts(events.bcid), -1)).astype(np.int64)
+    bcid = np.where(bcid < 0, -1, (bcid + bcid_offset) % 3564)
+    return l1, bcid
+
+class KeyIndex:
+    '''
+    Events of one board sorted by (key, position), to find for many reference events at once
+    the event with the same key that is closest to an expected position.
+    '''
+    def __init__(self, key):
+        combined = (key << 32) | np.arange(len(key), dtype=np.int64)
+        self.order = np.argsort(combined, kind='stable')
+        self.combined = combined[self.order]
+        self.key = key[self.order]
+
+    def closest(self, key_ref, expected, window):
+        '''
+        Index of the event with the same key as every reference key that is closest to the expected position,
+        and a mask of the reference events for which it is at most window events away.
+        '''
+        if len(self.key) == 0:
+            return np.zeros(len(key_ref), dtype=np.int64), np.zeros(len(key_ref), dtype=bool)
+        pos = np.searchsorted(self.combined, (key_ref << 32) | np.clip(expected, 0, 2**32 - 1))
+        after = np.minimum(pos, len(self.key) - 1)
+        before = np.maximum(pos - 1, 0)
+        no_match = np.iinfo(np.int64).max
+        dist_after = np.where(self.key[after] == key_ref, np.abs(self.order[after] - expected), no_match)
+        dist_before = np.where(self.key[before] == key_ref, np.abs(self.order[before] - expected), no_match)
+        idx = np.where(dist_before <= dist_after, self.order[before], self.order[after])
+        return idx, np.minimum(dist_before, dist_after) <= window
+
+def closest_nearby(key, key_ref, expected, window):
+    '''
+    Same as KeyIndex(key).closest, for reference events whose expected positions are close to each other:
+    only the events within window of the expected positions are indexed.
+    '''
+    if len(expected) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+    lo = max(int(expected.min()) - window, 0)
+    hi = min(int(expected.max()) + window + 1, len(key))
+    if hi <= lo:
+        return np.zeros(len(key_ref), dtype=np.int64), np.zeros(len(key_ref), dtype=bool)
+    idx, matched = KeyIndex(key[lo:hi]).closest(key_ref, expected - lo, window)
+    return idx + lo, matched
+
+def match_events(l1_ref, bcid_ref, l1, bcid, window=100, chunk=64, max_gap=10000):
+    '''
+    Index of the event with the same L1A counter and BCID for every reference event.
+    The 8 bit L1A counter wraps every 256 events, so the match is searched within window events
+    of the expected position: the position of the reference event, shifted by the offset between the boards
+    at the last matched event before it. The offset is followed chunk by chunk through the run, so missing or
+    out of order events on either board only shift the expected position, and a counter wrap needs no special
+    treatment. The window (plus the events missing in a chunk) has to stay below the number of events between
+    two wraps of the counter, otherwise an event of the previous or next wrap with the same BCID can be picked up.
+    If no event of a chunk matches, e.g. after a gap longer than the window, the closest events with the same
+    key within max_gap events are used instead, if most events of the chunk agree on the new offset.
+    Returns the indices, and masks for the matched events and the ones that only agree in L1A counter.
+    '''
+    ref_pos = np.arange(len(l1_ref))
+    key_ref = (l1_ref << 12) | (bcid_ref & 0xFFF)
+    key_all = (l1 << 12) | (bcid & 0xFFF)
+    index = None
+
+    idx = np.zeros(len(l1_ref), dtype=np.int64)
+    matched = np.zeros(len(l1_ref), dtype=bool)
+    expected = np.zeros(len(l1_ref), dtype=np.int64)
+    offset = 0
+    for start in range(0, len(l1_ref), chunk):
+        pos = ref_pos[start:start + chunk]
+        key = key_ref[start:start + chunk]
+        idx_chunk, matched_chunk = closest_nearby(key_all, key, pos + offset, window)
+        if not matched_chunk.any():
+            if index is None:
+                index = KeyIndex(key_all)
+            idx_any, matched_any = index.closest(key, pos + offset, max_gap)
+            if matched_any.any():
+                offsets = (idx_any - pos)[matched_any]
+                median = int(np.median(offsets))
+                agree = np.count_nonzero(abs(offsets - median) <= window//2)
+                if 2*agree > len(offsets) and 4*agree > len(pos):
+                    offset = median
+                    idx_chunk, matched_chunk = closest_nearby(key_all, key, pos + offset, window)
+        # the unmatched events are tried again with the offset at the last matched event before them,
+        # until that does not change any more
+        tried = pos + offset
+        while True:
+            last = np.maximum.accumulate(np.where(matched_chunk, np.arange(len(pos)), -1))
+            expected_chunk = pos + np.where(last >= 0, (idx_chunk - pos)[np.maximum(last, 0)], offset)
+            retry = ~matched_chunk & (expected_chunk != tried)
+            if not retry.any():
+                break
+            tried[retry] = expected_chunk[retry]
+            idx_chunk[retry], matched_chunk[retry] = closest_nearby(key_all, key[retry], expected_chunk[retry], window)
+        idx[start:start + chunk] = idx_chunk
+        matched[start:start + chunk] = matched_chunk
+        expected[start:start + chunk] = expected_chunk
+        offset = expected_chunk[-1] - pos[-1]
+
+    # same L1A counter, but a different BCID
+    _, same_l1 = KeyIndex(l1).closest(l1_ref, expected, window)
+    misaligned = ~matched & same_l1
+    return idx, matched, misaligned
+
+def merge_rb_events(events_all_rb, bcid_offset=1, fields=None):
+    '''
+    Merge the events of several RBs into the events of the first one.
+    Events are matched by their L1A counter and BCID, the BCID of the other RBs is bcid_offset lower than for RB 0.
+    The hits of matched events are appended to the ones of RB 0.
+    Returns the merged events and a report with the number of matched, misaligned
+    (same L1A counter but different BCID), missing and unmatched events of every RB.
+    '''
+    import awkward as ak
+    if fields is None:
+        fields = ['row', 'col', 'tot_code', 'toa_code', 'cal_code', 'elink', 'chipid', 'nhits']
+    ref = events_all_rb[0]
+    l1_ref, bcid_ref = event_keys(ref)
+    merged = {f: [ref[f]] for f in fields}
+    report = {}
+    for rb, events in enumerate(events_all_rb[1:], start=1):
+        l1, bcid = event_keys(events, bcid_offset=bcid_offset)
+        idx, matched, misaligned = match_events(l1_ref, bcid_ref, l1, bcid)
+        for f in fields:
+            counts = np.where(matched, ak.to_numpy(ak.num(events[f]))[idx], 0)
+            merged[f].append(ak.unflatten(ak.flatten(events[f][idx[matched]]), counts))
+        report[rb] = {
+            'matched': int(np.sum(matched)),
+            'misaligned': int(np.sum(misaligned)),
+            'missing': int(np.sum(~matched & ~misaligned)),
+            'unmatched': len(events) - int(np.count_nonzero(np.bincount(idx[matched], minlength=len(events)))),
+        }
+    out = {
+        'event': ref.event,
+        'l1counter': ref.l1counter,
+    }
+    for f in fields:
+        out[f] = ak.concatenate(merged[f], axis=1)
+    out['bcid'] = ref.bcid
+    return ak.Array(out), report
+
 if __name__ == '__main__':
     print ("Temperature example:")
     print (get_temp(0.8159, 1.5, 10000, 25, 10000, 3900))
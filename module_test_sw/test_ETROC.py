@@ -1,7 +1,7 @@
 from tamalero.ETROC import ETROC
 from tamalero.ETROC_Emulator import ETROC2_Emulator as software_ETROC2
 from tamalero.DataFrame import DataFrame
-from tamalero.utils import get_kcu
+from tamalero.utils import get_kcu, sigmoid_fit_batch
 from tamalero.ReadoutBoard import ReadoutBoard
 from tamalero.PixelMask import PixelMask
 from tamalero.colors import red, green, yellow
@@ -1416,16 +1416,13 @@ if __name__ == '__main__':
 
         # ======= PERFORM FITS =======
         # fit to sigmoid and save to NxN layout
-        slopes = np.empty([N_pix_w, N_pix_w])
-        means  = np.empty([N_pix_w, N_pix_w])
-        widths = np.empty([N_pix_w, N_pix_w])
-
-        for pix in range(N_pix):
-            fitresults = sigmoid_fit(vth_axis, hit_rate[pix])
-            r, c = fromPixNum(pix, N_pix_w)
-            slopes[r][c] = fitresults[0]
-            means[r][c]  = fitresults[1]
-            widths[r][c] = 4/fitresults[0]
+        # all pixels are fitted together, the pixel number is col*N_pix_w+row
+        fit_slopes, fit_means, fit_failed = sigmoid_fit_batch(vth_axis, hit_rate)
+        slopes = fit_slopes.reshape(N_pix_w, N_pix_w).T
+        means  = fit_means.reshape(N_pix_w, N_pix_w).T
+        widths = 4/slopes
+        if np.any(fit_failed):
+            print(f"Needed curve_fit for {np.sum(fit_failed)} pixels")
 
         # print out results nicely
         for r in range(N_pix_w):
@@ -31,6 +31,9 @@ try:
 except ImportError:
     from yaml import Loader, Dumper
 
+# average L1A rate (Hz) of the bursts in the coarse threshold scan, well below the 1MHz L1A rate of ETROC2
+COARSE_SCAN_L1A_RATE = 100000
+
 def run(ETROC, N, fifo=None):
     # currently uses the software ETROC to produce fake data
     if ETROC.isfake:
@@ -196,7 +199,10 @@ def manual_threshold_scan(etroc, fifo, rb_0, args):
     first_val = 1023
     for i in range(0, 1000, 3):
         etroc.wr_reg("DAC", i, row=row, col=col)
-        fifo.send_l1a(2000)
+        # the coarse scan only looks for the peak, so the L1As can go out in bursts
+        n_sent, _ = fifo.send_l1a(2000, burst=True, max_rate=COARSE_SCAN_L1A_RATE, return_count=True)
+        if n_sent < 2000:
+            print(f"Only {n_sent} out of 2000 L1As were sent at DAC={i}")
         vth.append(i)
         data_cnt = rb_0.read_data_count(elink, slave=slave)
         count.append(data_cnt)
@@ -235,26 +241,21 @@ def manual_threshold_scan(etroc, fifo, rb_0, args):
     N_pix_w     = int(round(np.sqrt(N_pix))) # N_pix in NxN layout
     max_indices = np.argmax(hit_rate, axis=1)
     maximums    = vth_axis[max_indices]
-    max_matrix  = np.empty([N_pix_w, N_pix_w])
-    noise_matrix  = np.empty([N_pix_w, N_pix_w])
 
     rawout = {vth_axis[i]:hit_rate.T[i].tolist() for i in range(len(vth_axis))}
     with open(f'{result_dir}/{prefix}thresh_scan_data.json', 'w') as f:
         json.dump(rawout, f)
 
-    threshold_matrix = np.empty([N_pix_w, N_pix_w])
-    for pix in range(N_pix):
-        r, c = fromPixNum(pix, N_pix_w)
-        max_matrix[r][c] = maximums[pix]
-        noise_matrix[r][c] = np.size(np.nonzero(hit_rate[pix]))
-        max_value = vth_axis[hit_rate[pix]==max(hit_rate[pix])]
-        if isinstance(max_value, np.ndarray):
-            max_value = max_value[-1]
-        zero_dac_values = vth_axis[((vth_axis>(max_value)) & (hit_rate[pix]==0))]
-        if len(zero_dac_values)>0:
-            threshold_matrix[r][c] = zero_dac_values[0] + 2
-        else:
-            threshold_matrix[r][c] = dac_max + 2
+    # all pixels at once, the pixel number is col*N_pix_w+row
+    noise_widths = np.count_nonzero(hit_rate, axis=1)
+    # the threshold is just above the first DAC value without hits, above the last maximum
+    last_max = len(vth_axis) - 1 - np.argmax(hit_rate[:, ::-1], axis=1)
+    zero_dac = (vth_axis > vth_axis[last_max][:, None]) & (hit_rate == 0)
+    thresholds = np.where(np.any(zero_dac, axis=1), vth_axis[np.argmax(zero_dac, axis=1)], dac_max) + 2
+
+    max_matrix = maximums.reshape(N_pix_w, N_pix_w).T.astype(float)
+    noise_matrix = noise_widths.reshape(N_pix_w, N_pix_w).T.astype(float)
+    threshold_matrix = thresholds.reshape(N_pix_w, N_pix_w).T.astype(float)
     
     etroc.baseline = max_matrix
     etroc.noise_width = noise_matrix
@@ -896,6 +897,7 @@ if __name__ == '__main__':
     argParser.add_argument('--show_plots', action = 'store_true')
     argParser.add_argument('--external_vref', action = 'store_true')
     argParser.add_argument('--run_internal', action = 'store_true')
+    argParser.add_argument('--i2c_cache', action = 'store_true', help="Keep a shadow copy of the ETROC registers to save I2C transactions")
     #Charge injection
     argParser.add_argument('--qinj', action='store_true')
     argParser.add_argument('--charges', action = 'store', type = int, nargs = '*', default = [])
@@ -952,9 +954,12 @@ if __name__ == '__main__':
     print("Connecting modules")
     moduleids = [0,0,0]
     moduleids[args.module-1] = MID
-    rb.connect_modules(moduleids=moduleids, hard_reset=True, ext_vref=args.external_vref)
+    rb.connect_modules(moduleids=moduleids, hard_reset=True, ext_vref=args.external_vref, i2c_cache=args.i2c_cache)
     for mod in rb.modules:
         mod.show_status()
+        if args.i2c_cache:
+            for etroc, stats in zip(mod.ETROCs, mod.get_cache_stats()):
+                print(f"ETROC {etroc.chip_id} I2C cache: {stats['hits']} hits, {stats['misses']} misses, {stats['skipped_writes']} skipped writes, {stats['i2c_transactions']} I2C transactions")
     '''
     if args.reset_fifo:
         print("RESETTING FIFO")
@@ -0,0 +1,63 @@
+import numpy as np
+
+from crcETROC import check_frames, crc_frames, mod2div, CRC_POLY
+from tamalero.DataFrame import DataFrame
+
+
+def crc_ref(words):
+    return int(mod2div(''.join(f'{w & 0xFFFFFFFFFF:040b}' for w in words), f'{CRC_POLY:b}'), 2)
+
+
+def test_crc_frames_matches_mod2div():
+    rng = np.random.default_rng(7)
+    for trial in range(5):
+        counts = rng.integers(0, 40, 100)
+        words = rng.integers(0, 2**40, counts.sum(), dtype=np.uint64)
+        res = crc_frames(words, counts)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        ref = [crc_ref(words[offsets[i]:offsets[i+1]].tolist()) if counts[i] > 0 else 0 for i in range(len(counts))]
+        assert res.tolist() == ref
+
+
+def test_check_frames_matches_mod2div():
+    rng = np.random.default_rng(3)
+    df = DataFrame('ETROC2')
+    ids = df.format['identifiers']
+
+    def word(frame_type):
+        w = int(rng.integers(0, 2**40))
+        return (w & ~ids[frame_type]['mask']) | ids[frame_type]['frame']
+
+    # frames with a correct CRC in the lowest 8 bits of the trailer, some of them with a flipped bit,
+    # fillers in between, and a few stray data words and trailers without a header
+    words = []
+    for i in range(300):
+        frame = [word('header')] + [word('data') for _ in range(int(rng.integers(0, 20)))] + [word('trailer') & ~0xFF]
+        frame[-1] |= crc_ref(frame)
+        if rng.random() < 0.3:
+            j = int(rng.integers(1, len(frame)))
+            # keep the frame type of the word
+            frame[j] ^= 1 << int(rng.integers(0, 20))
+        words += frame + [word('filler') for _ in range(int(rng.integers(0, 3)))]
+        if rng.random() < 0.05:
+            words += [word('data'), word('trailer')]
+    words = np.array(words, dtype=np.uint64)
+
+    frame_type = df.read_block(words)['frame_type']
+    trailers, ok = check_frames(words, frame_type, df.frame_types)
+
+    ref_trailers, ref_ok = [], []
+    frame = None
+    for i, t in enumerate(frame_type.tolist()):
+        name = df.frame_types[t] if t >= 0 else None
+        if name == 'header':
+            frame = [i]
+        elif name == 'data' and frame is not None:
+            frame.append(i)
+        elif name == 'trailer' and frame is not None:
+            frame.append(i)
+            ref_trailers.append(i)
+            ref_ok.append(crc_ref([int(words[j]) for j in frame]) == 0)
+    assert trailers.tolist() == ref_trailers
+    assert ok.tolist() == ref_ok
+    assert 0 < sum(ref_ok) < len(ref_ok)
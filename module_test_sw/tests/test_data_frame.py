@@ -0,0 +1,38 @@
+import numpy as np
+
+from tamalero.DataFrame import DataFrame
+
+
+def make_words(df, n, seed=0):
+    '''
+    Random 64 bit words, most of them forced to match one of the frame identifiers.
+    '''
+    rng = np.random.default_rng(seed)
+    words = rng.integers(0, 2**63, n, dtype=np.uint64) * np.uint64(2) + rng.integers(0, 2, n, dtype=np.uint64)
+    kind = rng.integers(0, len(df.frame_types) + 1, n)
+    for i, frame_type in enumerate(df.frame_types):
+        identifier = df.format['identifiers'][frame_type]
+        sel = kind == i
+        words[sel] = (words[sel] & ~np.uint64(identifier['mask'])) | np.uint64(identifier['frame'])
+    return words
+
+
+def test_read_block_matches_read():
+    df_block = DataFrame('ETROC2')
+    df_word = DataFrame('ETROC2')
+    fields = df_block.get_fields()
+    for seed in range(3):
+        words = make_words(df_block, 5000, seed=seed)
+        block = df_block.read_block(words)
+        for i, word in enumerate(words.tolist()):
+            frame_type, res = df_word.read(word)
+            expected = df_word.frame_types.index(frame_type) if frame_type is not None else -1
+            assert block['frame_type'][i] == expected
+            if frame_type is None:
+                continue
+            assert int(block['raw'][i]) == int(res['raw'], 16)
+            assert int(block['meta'][i]) == int(res['meta'], 16)
+            for d in fields:
+                assert int(block[d][i]) == res.get(d, 0), (i, d)
+        # the type of the last header carries over to the next block
+        assert df_block.type == df_word.type
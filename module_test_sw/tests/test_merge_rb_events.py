@@ -0,0 +1,92 @@
+import awkward as ak
+import numpy as np
+
+from tamalero.utils import merge_rb_events
+
+FIELDS = ['row', 'col', 'chipid', 'nhits']
+
+
+def make_events(l1counter, bcid, chipid):
+    '''
+    Events with one hit each, the row of the hit is the event number of the reference board
+    so that the merged hits show which events were matched.
+    '''
+    n = len(l1counter)
+    return ak.Array({
+        'event': np.arange(n),
+        'l1counter': np.asarray(l1counter) % 256,
+        'bcid': [[int(b)] for b in bcid],
+        'row': [[int(l1)] for l1 in l1counter],
+        'col': [[0]]*n,
+        'chipid': [[chipid]]*n,
+        'nhits': [[1]]*n,
+    })
+
+
+def make_run(n, seed=0, start=0):
+    rng = np.random.default_rng(seed)
+    l1 = np.arange(start, start + n)
+    bcid = rng.integers(0, 3564, n)
+    return l1, bcid
+
+
+def check_merged(merged, l1_ref, expected):
+    for i in range(len(l1_ref)):
+        if i in expected:
+            assert ak.to_list(merged.row[i]) == [l1_ref[i], l1_ref[i]]
+            assert ak.to_list(merged.chipid[i]) == [0, 1]
+        else:
+            assert ak.to_list(merged.row[i]) == [l1_ref[i]]
+
+
+def test_aligned():
+    l1, bcid = make_run(1000)
+    ref = make_events(l1, bcid, 0)
+    other = make_events(l1, bcid - 1, 1)
+    merged, report = merge_rb_events([ref, other], fields=FIELDS)
+    assert report[1] == {'matched': 1000, 'misaligned': 0, 'missing': 0, 'unmatched': 0}
+    check_merged(merged, l1, set(range(1000)))
+
+
+def test_missing_events_across_wrap():
+    # the other board misses the first 10 events, during which the L1A counter wraps
+    l1, bcid = make_run(1000, start=250)
+    ref = make_events(l1, bcid, 0)
+    other = make_events(l1[10:], bcid[10:] - 1, 1)
+    merged, report = merge_rb_events([ref, other], fields=FIELDS)
+    assert report[1] == {'matched': 990, 'misaligned': 0, 'missing': 10, 'unmatched': 0}
+    check_merged(merged, l1, set(range(10, 1000)))
+
+
+def test_missing_events_in_reference():
+    l1, bcid = make_run(1000)
+    keep = np.ones(1000, dtype=bool)
+    keep[[100, 300, 301, 302, 700]] = False
+    ref = make_events(l1[keep], bcid[keep], 0)
+    other = make_events(l1, bcid - 1, 1)
+    merged, report = merge_rb_events([ref, other], fields=FIELDS)
+    assert report[1] == {'matched': 995, 'misaligned': 0, 'missing': 0, 'unmatched': 5}
+    check_merged(merged, l1[keep], set(range(995)))
+
+
+def test_out_of_order_event():
+    # a stale event shows up in the middle of the other board's stream
+    l1, bcid = make_run(1000)
+    ref = make_events(l1, bcid, 0)
+    order = np.concatenate([np.arange(500), [20], np.arange(500, 1000)])
+    other = make_events(l1[order], bcid[order] - 1, 1)
+    merged, report = merge_rb_events([ref, other], fields=FIELDS)
+    assert report[1]['matched'] == 1000
+    assert report[1]['unmatched'] == 1
+    check_merged(merged, l1, set(range(1000)))
+
+
+def test_misaligned_bcid():
+    l1, bcid = make_run(300)
+    ref = make_events(l1, bcid, 0)
+    other_bcid = bcid - 1
+    other_bcid[50] += 7
+    other = make_events(l1, other_bcid, 1)
+    merged, report = merge_rb_events([ref, other], fields=FIELDS)
+    assert report[1] == {'matched': 299, 'misaligned': 1, 'missing': 0, 'unmatched': 1}
+    check_merged(merged, l1, set(range(300)) - {50})
@@ -0,0 +1,57 @@
+import awkward as ak
+import numpy as np
+import pytest
+
+uproot = pytest.importorskip('uproot')
+
+from root_dumper import dump_to_root
+
+
+def make_events(n, seed=0):
+    rng = np.random.default_rng(seed)
+    nhits = rng.integers(0, 4, n)
+    hits = lambda high: ak.unflatten(rng.integers(0, high, nhits.sum()), nhits)
+    return ak.Array({
+        'event': np.arange(n),
+        'l1counter': np.arange(n) % 256,
+        'row': hits(16),
+        'col': hits(16),
+        'tot_code': hits(512),
+        'toa_code': hits(1024),
+        'cal_code': hits(1024),
+        'elink': hits(28),
+        'chipid': hits(256),
+        'bcid': [[int(b)] for b in rng.integers(0, 3564, n)],
+        'nhits': [[int(x)] for x in nhits],
+    })
+
+
+def test_write_and_read_back(tmp_path):
+    events = make_events(250)
+    f_in = str(tmp_path / 'output_run_1_rb0.parquet')
+    f_out = str(tmp_path / 'output_run_1_rb0.root')
+    ak.to_parquet(events, f_in)
+
+    dump_to_root(f_out, f_in, basket_size=100)
+
+    with uproot.open(f_out) as f:
+        tree = f['pulse']
+        assert tree.num_entries == len(events)
+        for branch in ['event', 'l1counter', 'bcid']:
+            assert tree[branch].interpretation.from_dtype == np.dtype('>u4')
+        read = tree.arrays(library='ak')
+
+    assert ak.to_list(read.event) == ak.to_list(events.event)
+    assert ak.to_list(read.l1counter) == ak.to_list(events.l1counter)
+    assert ak.to_list(read.bcid) == ak.to_list(ak.firsts(events.bcid))
+    for branch in ['row', 'col', 'tot_code', 'toa_code', 'cal_code', 'elink', 'chipid', 'nhits']:
+        assert ak.to_list(read[branch]) == ak.to_list(events[branch])
+        assert ak.to_list(read['n' + branch]) == ak.to_list(ak.num(events[branch]))
+    assert ak.to_list(ak.num(read.nhits_trail)) == [0]*len(events)
+
+
+def test_missing_input(tmp_path):
+    f_out = str(tmp_path / 'output_run_2_rb0.root')
+    dump_to_root(f_out, str(tmp_path / 'output_run_2_rb0.parquet'))
+    with uproot.open(f_out) as f:
+        assert f['pulse'].num_entries == 0
@@ -0,0 +1,37 @@
+import numpy as np
+from scipy.optimize import curve_fit
+
+from tamalero.utils import sigmoid_fit_batch
+
+
+def sigmoid_fit(x_axis, y_axis):
+    # the per pixel fit of test_ETROC.py
+    res = curve_fit(
+        lambda x, a, b: 1/(1+np.exp(a*(x-b))),
+        x_axis-x_axis[0],
+        y_axis,
+        maxfev=10000,
+        bounds=([-np.inf, -np.inf], [0, np.inf]),
+    )
+    return res[0][0], res[0][1]+x_axis[0]
+
+
+def test_sigmoid_fit_batch_matches_curve_fit():
+    rng = np.random.default_rng(1)
+    x = np.arange(400, 601, 2).astype(float)
+    n_pix = 64
+    means = rng.uniform(450, 550, n_pix)
+    slopes = -4/rng.uniform(2, 15, n_pix)
+    y = 1/(1+np.exp(slopes[:, None]*(x-means[:, None])))
+    y = np.clip(y + rng.normal(0, 0.01, y.shape), 0, 1)
+    # pixels without any S-curve
+    y[0] = 0
+    y[1] = 1
+
+    a, b, failed = sigmoid_fit_batch(x, y)
+    assert failed[0] and failed[1]
+    assert not np.any(failed[2:])
+    for pix in range(n_pix):
+        ref_a, ref_b = sigmoid_fit(x, y[pix])
+        assert np.isclose(a[pix], ref_a, rtol=1e-5, atol=1e-5), pix
+        assert np.isclose(b[pix], ref_b, rtol=1e-5, atol=1e-5), pix
@@ -8,7 +8,7 @@ from tamalero.utils import get_kcu
 
 from cocina.PowerSupply import PowerSupply
 
-from daq import stream_daq, stream_daq_multi
+from daq import stream_daq, stream_daq_multi, write_run_done
 
 if __name__ == '__main__':
     argParser = argparse.ArgumentParser(description = "Argument parser")
@@ -61,18 +61,19 @@ if __name__ == '__main__':
 
     stream_0 = stream_daq_multi(
         stream_daq,
-        {'kcu':kcu, 'rb':0, 'l1a_rate':l1a_rate, 'run_time':run_time, 'run':run, 'ext_l1a':True},
+        {'kcu':kcu, 'rb':0, 'l1a_rate':l1a_rate, 'run_time':run_time, 'run':run, 'ext_l1a':True, 'run_done':False},
     )
 
     stream_1 = stream_daq_multi(
         stream_daq,
-        {'kcu':kcu, 'rb':1, 'l1a_rate':l1a_rate, 'run_time':run_time+0.2, 'run':run, 'ext_l1a':True},
+        {'kcu':kcu, 'rb':1, 'l1a_rate':l1a_rate, 'run_time':run_time+0.2, 'run':run, 'ext_l1a':True, 'run_done':False},
     )
 
     print("Taking data")
     while stream_0._running or stream_1._running:
         time.sleep(1)
     print("Done with all streams")
+    write_run_done(run=run)
 
     if power_down:
         psu1.power_down('ch1')